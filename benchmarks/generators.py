@@ -0,0 +1,170 @@
+"""
+Synthetic documents and matching schemas for the benchmarks
+"""
+
+import random as _random
+
+from toolbox.bigquery_sink import SchemaField as _SF
+from toolbox.bigquery_sink import FieldType as _FT
+from toolbox.bigquery_sink import FieldMode as _FM
+from toolbox.bigquery_sink import SourcePathElements as _SPE
+
+
+def _random_string(rnd, length=12):
+    return "".join(rnd.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(length))
+
+
+def flat(rows, seed=0):
+    """
+    A small table with one field per common type
+    """
+    schema = [
+        _SF(name="id", field_type=_FT.INTEGER),
+        _SF(name="name", field_type=_FT.STRING),
+        _SF(name="price", field_type=_FT.NUMERIC),
+        _SF(name="score", field_type=_FT.FLOAT),
+        _SF(name="active", field_type=_FT.BOOLEAN),
+        _SF(name="created_at", field_type=_FT.TIMESTAMP),
+        _SF(name="day", field_type=_FT.DATE),
+    ]
+
+    def generate():
+        rnd = _random.Random(seed)
+        for idx in range(rows):
+            yield {
+                "id": idx,
+                "name": _random_string(rnd),
+                "price": rnd.random() * 1000,
+                "score": str(rnd.random()),
+                "active": rnd.choice(["true", "false", 1, 0]),
+                "created_at": 1600000000 + idx,
+                "day": "2020-09-{:02d}".format(1 + idx % 28),
+            }
+
+    return schema, generate()
+
+
+def wide(rows, columns=300, seed=0):
+    """
+    A wide table, as produced by denormalized exports
+    """
+    field_types = [_FT.INTEGER, _FT.STRING, _FT.FLOAT]
+    schema = [
+        _SF(name="col_{}".format(idx), field_type=field_types[idx % len(field_types)])
+        for idx in range(columns)
+    ]
+
+    def generate():
+        rnd = _random.Random(seed)
+        for _ in range(rows):
+            yield {
+                "col_{}".format(idx): rnd.randint(0, 1000000) for idx in range(columns)
+            }
+
+    return schema, generate()
+
+
+def nested(rows, depth=6, seed=0):
+    """
+    Deeply nested documents, mapped to STRUCTs and to flat columns with long source paths
+    """
+    keys = ["level{}".format(idx) for idx in range(depth)]
+
+    def struct(level):
+        if level == depth - 1:
+            return _SF(
+                name=keys[level],
+                field_type=_FT.STRUCT,
+                fields=[
+                    _SF(name="value", field_type=_FT.INTEGER),
+                    _SF(name="label", field_type=_FT.STRING),
+                ],
+            )
+        return _SF(
+            name=keys[level],
+            field_type=_FT.STRUCT,
+            fields=[struct(level + 1), _SF(name="tag", field_type=_FT.STRING)],
+        )
+
+    schema = [
+        struct(0),
+        _SF(name="deep_value", field_type=_FT.INTEGER, source_path=keys + ["value"]),
+        _SF(name="deep_label", field_type=_FT.STRING, source_path=keys + ["label"]),
+    ]
+
+    def generate():
+        rnd = _random.Random(seed)
+        for idx in range(rows):
+            doc = {"value": idx, "label": _random_string(rnd)}
+            for key in reversed(keys):
+                doc = {key: doc, "tag": _random_string(rnd, 4)}
+            yield doc
+
+    return schema, generate()
+
+
+def repeated(rows, items=10, seed=0):
+    """
+    Documents with lists that are unrolled via REPEATED fields and LIST_INDEX paths
+    """
+    schema = [
+        _SF(name="order_id", field_type=_FT.INTEGER),
+        _SF(
+            name="skus",
+            field_type=_FT.STRING,
+            mode=_FM.REPEATED,
+            source_path=["items", _SPE.LIST_INDEX, "sku"],
+        ),
+        _SF(
+            name="items",
+            field_type=_FT.STRUCT,
+            mode=_FM.REPEATED,
+            fields=[
+                _SF(name="sku", field_type=_FT.STRING),
+                _SF(name="quantity", field_type=_FT.INTEGER),
+                _SF(name="price", field_type=_FT.NUMERIC),
+            ],
+        ),
+        _SF(
+            name="tags",
+            field_type=_FT.STRING,
+            mode=_FM.REPEATED,
+            source_path=["items", _SPE.LIST_INDEX, "tags", _SPE.LIST_INDEX],
+        ),
+        _SF(
+            name="first_promo_sku",
+            field_type=_FT.STRING,
+            source_path=[
+                "items",
+                _SPE.find_list_index_with_key_value("promo", True),
+                "sku",
+            ],
+        ),
+    ]
+
+    def generate():
+        rnd = _random.Random(seed)
+        for idx in range(rows):
+            yield {
+                "order_id": idx,
+                "items": [
+                    {
+                        "sku": _random_string(rnd, 8),
+                        "quantity": rnd.randint(1, 5),
+                        "price": rnd.random() * 100,
+                        "promo": rnd.random() < 0.1,
+                        "tags": [_random_string(rnd, 3) for _ in range(3)],
+                    }
+                    for _ in range(items)
+                ],
+            }
+
+    return schema, generate()
+
+
+DATASETS = {
+    "flat": flat,
+    "wide": wide,
+    "nested": nested,
+    "repeated": repeated,
+}
@@ -0,0 +1,205 @@
+"""
+Throughput benchmarks for extraction, casting, serialization and the end-to-end bulk sink.
+
+Usage:
+    python -m benchmarks.run --rows 20000
+    python -m benchmarks.run --save baseline.json
+    python -m benchmarks.run --baseline baseline.json --max-regression 0.1
+"""
+
+import argparse as _argparse
+import gzip as _gzip
+import io as _io
+import json as _json
+import sys as _sys
+import time as _time
+
+from toolbox import bigquery_sink as _bigquery_sink
+from toolbox.bigquery_sink import bulk_sink as _bulk_sink
+from toolbox.bigquery_sink import fake as _fake
+
+from benchmarks import generators as _generators
+
+
+def _best_of(repeat, fn):
+    best = None
+    for _ in range(repeat):
+        start = _time.perf_counter()
+        fn()
+        elapsed = _time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _create_sink(schema, compressed_upload=False, latency_s=0.0, upload_bytes_per_s=None):
+    backend = _fake.FakeBackend(
+        latency_s=latency_s, upload_bytes_per_s=upload_bytes_per_s, store_rows=False
+    )
+    options = _bigquery_sink.Options(
+        project_id="bench", dataset_id="bench", temp_bucket_name="bench", backend=backend
+    )
+    return _bulk_sink.BQBulkSink(
+        table_id="bench",
+        options=options,
+        schema=schema,
+        write_disposition=_bulk_sink.WriteDisposition.APPEND,
+        compressed_upload=compressed_upload,
+    )
+
+
+def run_dataset(name, rows, repeat, latency_s=0.0, upload_bytes_per_s=None):
+    """
+    Run all stages for one synthetic dataset
+    :return: dict of stage name -> {"seconds", "rows_per_s", "bytes_per_s"}
+    """
+    schema, generator = _generators.DATASETS[name](rows=rows)
+    source_rows = list(generator)
+    sink = _create_sink(schema=schema)  # only used for its json default fn
+
+    def extract(should_ensure_type):
+        return [
+            {
+                field.name: field.extract(row, should_ensure_type=should_ensure_type)
+                for field in schema
+            }
+            for row in source_rows
+        ]
+
+    extracted = extract(should_ensure_type=True)
+    encoded = [
+        (_json.dumps(row, default=sink._json_default_fn) + "\n").encode("utf-8")
+        for row in extracted
+    ]
+    payload_bytes = sum(len(line) for line in encoded)
+
+    def encode():
+        for row in extracted:
+            (_json.dumps(row, default=sink._json_default_fn) + "\n").encode("utf-8")
+
+    def compress():
+        with _gzip.GzipFile(mode="wb", fileobj=_io.BytesIO(), compresslevel=9) as gzip_file:
+            for line in encoded:
+                gzip_file.write(line)
+
+    def end_to_end(compressed_upload):
+        _create_sink(
+            schema=schema,
+            compressed_upload=compressed_upload,
+            latency_s=latency_s,
+            upload_bytes_per_s=upload_bytes_per_s,
+        ).from_iterable(source_rows)
+
+    stages = {
+        "extract": lambda: extract(should_ensure_type=False),
+        "extract_cast": lambda: extract(should_ensure_type=True),
+        "json_encode": encode,
+        "gzip": compress,
+        "from_iterable": lambda: end_to_end(compressed_upload=False),
+        "from_iterable_gzip": lambda: end_to_end(compressed_upload=True),
+    }
+
+    results = {}
+    for stage, fn in stages.items():
+        seconds = _best_of(repeat, fn)
+        results[stage] = {
+            "seconds": seconds,
+            "rows_per_s": len(source_rows) / seconds,
+            "bytes_per_s": payload_bytes / seconds,
+        }
+    return results
+
+
+def compare(results, baseline, max_regression):
+    """
+    Compare rows/s against a baseline
+    :return: list of (dataset, stage, ratio) that regressed by more than max_regression
+    """
+    regressions = []
+    for dataset, stages in results.items():
+        for stage, result in stages.items():
+            base = baseline.get(dataset, {}).get(stage)
+            if not base:
+                continue
+            ratio = result["rows_per_s"] / base["rows_per_s"]
+            result["baseline_ratio"] = ratio
+            if ratio < 1 - max_regression:
+                regressions.append((dataset, stage, ratio))
+    return regressions
+
+
+def format_report(results):
+    lines = [
+        "{:<10} {:<20} {:>14} {:>12} {:>10}".format(
+            "dataset", "stage", "rows/s", "MB/s", "vs base"
+        )
+    ]
+    for dataset, stages in results.items():
+        for stage, result in stages.items():
+            ratio = result.get("baseline_ratio")
+            lines.append(
+                "{:<10} {:<20} {:>14,.0f} {:>12.2f} {:>10}".format(
+                    dataset,
+                    stage,
+                    result["rows_per_s"],
+                    result["bytes_per_s"] / 1e6,
+                    "" if ratio is None else "{:.2f}x".format(ratio),
+                )
+            )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = _argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--datasets", default=",".join(_generators.DATASETS.keys()),
+        help="comma separated list of: {}".format(", ".join(_generators.DATASETS)),
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0,
+        help="simulated latency in seconds per api call / job of the fake backend",
+    )
+    parser.add_argument(
+        "--upload-mbps", type=float, default=None,
+        help="simulated upload bandwidth of the fake backend in MB/s (default: unlimited)",
+    )
+    parser.add_argument("--save", help="write the results as json to this path")
+    parser.add_argument("--baseline", help="compare against results saved with --save")
+    parser.add_argument(
+        "--max-regression", type=float, default=0.1,
+        help="fail if rows/s drop by more than this fraction compared to the baseline",
+    )
+    args = parser.parse_args(argv)
+
+    results = {
+        name: run_dataset(
+            name=name,
+            rows=args.rows,
+            repeat=args.repeat,
+            latency_s=args.latency,
+            upload_bytes_per_s=args.upload_mbps * 1e6 if args.upload_mbps else None,
+        )
+        for name in args.datasets.split(",")
+    }
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(
+                results, _json.load(baseline_file), max_regression=args.max_regression
+            )
+
+    print(format_report(results))
+
+    if args.save:
+        with open(args.save, "w") as save_file:
+            _json.dump(results, save_file, indent=2)
+
+    for dataset, stage, ratio in regressions:
+        print("REGRESSION: {} {} at {:.2f}x of baseline".format(dataset, stage, ratio))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    _sys.exit(main())
@@ -26,5 +26,6 @@ setuptools.setup(
         package for package in setuptools.find_namespace_packages() if package.startswith('toolbox')
     ],
     install_requires=dependencies,
+    extras_require={'pandas': ['pandas>=1.0']},
     zip_safe=False
 )
\ No newline at end of file
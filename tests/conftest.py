@@ -0,0 +1,42 @@
+"""
+Shared factories of the tests: access configs and sinks on the offline fake backend
+"""
+
+import pytest
+
+from toolbox import bigquery_sink as _bs
+from toolbox.bigquery_sink import bulk_sink as _bulk_sink
+from toolbox.bigquery_sink import fake as _fake
+
+
+@pytest.fixture
+def create_options():
+    """
+    fn(backend=None, create_dataset=False, **kwargs) -> options of project "p", dataset "d" and temp bucket "bucket"
+    on the given (or a new) fake backend, kwargs override the other arguments of `Options`
+    """
+
+    def create(backend=None, create_dataset=False, **kwargs):
+        kwargs.setdefault("project_id", "p")
+        kwargs.setdefault("dataset_id", "d")
+        kwargs.setdefault("temp_bucket_name", "bucket")
+        options = _bs.Options(backend=_fake.FakeBackend() if backend is None else backend, **kwargs)
+        if create_dataset:
+            options.get_bigquery_client().create_dataset("{}.{}".format(options.project_id, options.dataset_id))
+        return options
+
+    return create
+
+
+@pytest.fixture
+def create_sink(create_options):
+    """
+    fn(options=None, table_id="t", **kwargs) -> `bulk_sink.BQBulkSink` (with new options if none are given)
+    """
+
+    def create(options=None, table_id="t", **kwargs):
+        return _bulk_sink.BQBulkSink(
+            table_id=table_id, options=create_options() if options is None else options, **kwargs
+        )
+
+    return create
@@ -0,0 +1,156 @@
+import datetime as _datetime
+
+import pytest
+
+from toolbox import bigquery_sink as _bs
+from toolbox.bigquery_sink import backfill as _backfill
+from toolbox.bigquery_sink import bulk_sink as _bulk_sink
+from toolbox.bigquery_sink import fake as _fake
+
+SCHEMA = [
+    _bs.SchemaField(name="day", field_type=_bs.FieldType.DATE),
+    _bs.SchemaField(name="value", field_type=_bs.FieldType.INTEGER),
+]
+START = _datetime.date(2020, 1, 30)
+END = _datetime.date(2020, 2, 2)
+
+
+def _rows_fn(partition):
+    return [{"day": partition, "value": partition.day}]
+
+
+def test_backfill_writes_partitions_with_retries_and_resume(tmp_path, create_options):
+    backend = _fake.FakeBackend(failure_rate={"load": 0.3}, seed=3)
+    options = create_options(backend)
+    state_path = str(tmp_path / "state")
+    progress = []
+
+    summary = _backfill.backfill(
+        table_id="t",
+        options=options,
+        start_date=START,
+        end_date=END,
+        rows_fn=_rows_fn,
+        parallelism=3,
+        retries=5,
+        retry_wait_s=0,
+        state_path=state_path,
+        progress_fn=lambda s: progress.append(s.done),
+        schema=SCHEMA,
+        table_partitioning=_bulk_sink.create_table_date_partitioning("day"),
+    )
+    summary.raise_for_errors()
+    assert summary.completed == {START + _datetime.timedelta(days=i): 1 for i in range(4)}
+    assert max(summary.attempts.values()) > 1
+    assert progress == [1, 2, 3, 4]
+    assert backend.rows("p.d.t", partition="20200201") == [{"day": "2020-02-01", "value": 1}]
+
+    backend.failure_rate = {"load": 1.0}
+    resumed = _backfill.backfill(
+        table_id="t",
+        options=options,
+        start_date=START,
+        end_date=_datetime.date(2020, 2, 3),
+        rows_fn=_rows_fn,
+        retries=1,
+        retry_wait_s=0,
+        state_path=state_path,
+        schema=SCHEMA,
+    )
+    assert len(resumed.skipped) == 4
+    assert list(resumed.failed) == [_datetime.date(2020, 2, 3)]
+    assert resumed.attempts == {_datetime.date(2020, 2, 3): 2}
+    with pytest.raises(RuntimeError):
+        resumed.raise_for_errors()
+
+
+def test_backfill_from_query_template(create_options):
+    backend = _fake.FakeBackend()
+    options = create_options(backend)
+    backend.register_query(
+        r"WHERE day = '(\S+)'", lambda match, job_config: [{"day": match.group(1), "value": 1}]
+    )
+    summary = _backfill.backfill(
+        table_id="t",
+        options=options,
+        start_date=START,
+        end_date=END,
+        query_template="SELECT * FROM src WHERE day = '{partition_date}' -- {partition_suffix}",
+        schema=SCHEMA,
+    )
+    assert len(summary.completed) == 4
+    assert backend.rows("p.d.t", partition="20200130") == [{"day": "2020-01-30", "value": 1}]
+
+    with pytest.raises(ValueError):
+        _backfill.backfill(table_id="t", options=options, start_date=START, end_date=END)
+
+
+def test_backfill_writes_one_job_per_month_of_a_month_partitioned_table(create_options):
+    backend = _fake.FakeBackend()
+    options = create_options(backend)
+    partitioning = _bulk_sink.create_table_time_partitioning("day", partition_type="MONTH")
+    assert _backfill.partition_dates(START, _datetime.date(2020, 3, 2), table_partitioning=partitioning) == [
+        _datetime.date(2020, 1, 1),
+        _datetime.date(2020, 2, 1),
+        _datetime.date(2020, 3, 1),
+    ]
+
+    summary = _backfill.backfill(
+        table_id="t",
+        options=options,
+        start_date=START,
+        end_date=_datetime.date(2020, 3, 2),
+        rows_fn=lambda month: [{"day": month + _datetime.timedelta(days=i), "value": i} for i in range(3)],
+        parallelism=4,
+        schema=SCHEMA,
+        table_partitioning=partitioning,
+    )
+    summary.raise_for_errors()
+    assert summary.completed == {
+        _datetime.date(2020, 1, 1): 3, _datetime.date(2020, 2, 1): 3, _datetime.date(2020, 3, 1): 3
+    }
+    assert backend.calls["load"] == 3
+    assert [row["day"] for row in backend.rows("p.d.t", partition="202002")] == [
+        "2020-02-01", "2020-02-02", "2020-02-03"
+    ]
+
+    backend.register_query(r"day < '(\S+)' -- (\d+)", lambda match, job_config: [{"day": "x", "value": 1}])
+    resumed = _backfill.backfill(
+        table_id="t",
+        options=options,
+        start_date=_datetime.date(2020, 3, 15),
+        end_date=_datetime.date(2020, 4, 1),
+        query_template="SELECT * FROM src WHERE day >= '{partition_date}' AND day < '{partition_end}' "
+        "-- {partition_suffix}",
+    )
+    assert sorted(resumed.completed) == [_datetime.date(2020, 3, 1), _datetime.date(2020, 4, 1)]
+    assert any("day >= '2020-04-01' AND day < '2020-05-01' -- 202004" in query for query in backend.queries)
+
+
+def test_partition_dates_of_hour_and_range_partitioning():
+    hours = _backfill.partition_dates(
+        START, START, table_partitioning=_bulk_sink.create_table_time_partitioning("at", partition_type="HOUR")
+    )
+    assert len(hours) == 24 and hours[-1] == _datetime.datetime(2020, 1, 30, 23)
+    ranges = _bulk_sink.create_table_range_partitioning("value", start=0, end=100, interval=10)
+    assert _backfill.partition_dates(-5, 1000, table_partitioning=ranges) == list(range(0, 100, 10))
+    assert _backfill.partition_dates(15, 31, table_partitioning=ranges) == [10, 20, 30]
+
+
+def test_backfill_updates_the_table_metadata_once(create_options):
+    backend = _fake.FakeBackend()
+    options = create_options(backend, labels={"team": "dwh"})
+    summary = _backfill.backfill(
+        table_id="t",
+        options=options,
+        start_date=START,
+        end_date=END,
+        query_template="SELECT * FROM src WHERE day = '{partition_date}'",
+        schema=SCHEMA,
+        table_description="events",
+        table_partitioning=_bulk_sink.create_table_date_partitioning("day"),
+    )
+    summary.raise_for_errors()
+    assert backend.calls["update_table"] == 2  # labels and description of the new table
+    table = options.get_bigquery_client().get_table("p.d.t")
+    assert (table.labels, table.description) == ({"team": "dwh"}, "events")
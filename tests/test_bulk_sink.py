@@ -0,0 +1,442 @@
+import datetime as _datetime
+import functools as _functools
+import gzip as _gzip
+import json as _json
+import os as _os
+import time as _time
+
+import pytest
+from google.cloud import bigquery as _bigquery
+
+from toolbox import bigquery_sink as _bs
+from toolbox.bigquery_sink import bulk_sink as _bulk_sink
+from toolbox.bigquery_sink import fake as _fake
+
+SCHEMA = [_bs.SchemaField(name="a", field_type=_bs.FieldType.INTEGER)]
+
+
+@pytest.fixture
+def create_sink(create_sink):
+    return _functools.partial(create_sink, schema=SCHEMA)
+
+
+def test_from_iterable_collects_stats(create_sink):
+    metrics = []
+    sink = create_sink(
+        compressed_upload=True,
+        metrics_hooks=[lambda name, value, tags: metrics.append((name, value, tags))],
+    )
+    assert sink.from_iterable([{"a": "1"}, {"a": 2}]) == 2
+    assert sink.rows_written == 2
+
+    backend = sink.options.backend
+    uploaded = list(backend.blobs("bucket").values())[0]
+    assert _gzip.decompress(uploaded).decode("utf-8").splitlines() == [
+        _json.dumps({"a": 1}),
+        _json.dumps({"a": 2}),
+    ]
+    assert backend.rows("p.d.t") == [{"a": 1}, {"a": 2}]
+
+    assert sink.stats.counters["rows"] == 2
+    assert sink.stats.counters["bytes_uncompressed"] == len(b'{"a": 1}\n') * 2
+    assert sink.stats.counters["bytes_compressed"] == len(uploaded)
+    for stage in ("extract", "encode", "compress", "write", "metadata", "upload", "load"):
+        assert stage in sink.stats.stages
+    assert sink.stats.stages["upload"].cpu_s is not None
+    assert sink.stats.job["output_rows"] == 2
+
+    emitted = {name: value for name, value, _ in metrics}
+    assert emitted["rows"] == 2
+    assert emitted["job.output_rows"] == 2
+    assert metrics[0][2]["table"] == "t"
+
+
+def test_open_updates_rows_written(create_sink):
+    sink = create_sink()
+    with sink.open() as writer:
+        writer({"a": 1})
+    assert sink.rows_written == 1
+    assert sink.stats.counters["bytes_compressed"] == sink.stats.counters["bytes_uncompressed"]
+
+
+def test_write_dispositions_on_fake_backend(create_options, create_sink):
+    options = create_options()
+    create_sink(options=options).from_iterable([{"a": 1}])
+
+    with pytest.raises(Exception):
+        create_sink(options=options).from_iterable([{"a": 2}])  # IF_EMPTY
+
+    create_sink(
+        options=options, write_disposition=_bulk_sink.WriteDisposition.APPEND
+    ).from_iterable([{"a": 2}])
+    assert options.backend.rows("p.d.t") == [{"a": 1}, {"a": 2}]
+
+    create_sink(
+        options=options,
+        write_disposition=_bulk_sink.WriteDisposition.REPLACE,
+        table_partition_date=_datetime.date(2020, 1, 1),
+    ).from_iterable([{"a": 3}])
+    assert options.backend.rows("p.d.t", partition="20200101") == [{"a": 3}]
+
+    sink = create_sink(
+        options=options, table_id="copy", write_disposition=_bulk_sink.WriteDisposition.REPLACE
+    )
+    sink.from_query("SELECT * FROM `p.d.t`")
+    assert sink.rows_written == 3
+
+
+def test_fake_backend_failure_injection(create_options, create_sink):
+    backend = _fake.FakeBackend(failure_rate={"load": 1.0})
+    with pytest.raises(Exception, match="Injected failure"):
+        create_sink(options=create_options(backend=backend)).from_iterable([{"a": 1}])
+    assert backend.calls["load"] == 1
+
+
+def test_create_view_on_fake_backend(create_options):
+    options = create_options().replace(labels={"team": "dwh"})
+    options.get_bigquery_client().create_dataset("p.d")
+    _bs.create_view(name="view", query="SELECT 1", options=options, description="desc")
+    view = _bs.create_view(name="view", query="SELECT 2", options=options, description="desc")
+    assert view.view_query == "SELECT 2"
+    assert view.labels == {"team": "dwh"}
+    assert view.description == "desc"
+
+
+def test_from_query_skip_if_unchanged(create_options, create_sink):
+    options = create_options()
+    backend = options.backend
+    create_sink(options=options, table_id="source").from_iterable([{"a": 1}])
+
+    def run():
+        sink = create_sink(
+            options=options, table_id="derived", write_disposition=_bulk_sink.WriteDisposition.REPLACE
+        )
+        result = sink.from_query("SELECT * FROM `p.d.source`", skip_if_unchanged=True)
+        return sink, result
+
+    sink, result = run()
+    assert result is not None
+    assert list(sink.lineage) == ["p.d.source"]
+    assert sink.bigquery.get_table("p.d.derived").labels[_bulk_sink.QUERY_HASH_LABEL]
+
+    sink, result = run()
+    assert result is None
+    assert sink.stats.counters["skipped"] == 1
+
+    _time.sleep(0.002)
+    backend.insert_rows("p.d.source", [{"a": 2}])
+    sink, result = run()
+    assert result is not None
+    assert backend.rows("p.d.derived") == [{"a": 1}, {"a": 2}]
+
+
+def test_from_query_skip_if_unchanged_reruns_after_input_changed_during_query(create_options, create_sink):
+    options = create_options()
+    backend = options.backend
+    create_sink(options=options, table_id="source").from_iterable([{"a": 1}])
+    sink = create_sink(options=options, table_id="derived", write_disposition=_bulk_sink.WriteDisposition.REPLACE)
+
+    def change_input_while_running(match, job_config):
+        rows = backend.rows("p.d.source")
+        _time.sleep(0.002)
+        backend.insert_rows("p.d.source", [{"a": len(rows) + 1}])  # after the query read its input
+        return rows
+
+    backend.register_query(r"SELECT a FROM `p.d.source`", change_input_while_running)
+    assert sink.from_query("SELECT a FROM `p.d.source`", skip_if_unchanged=True) is not None
+    assert _bulk_sink.QUERY_HASH_LABEL not in sink.labels
+    _time.sleep(0.002)
+    assert sink.from_query("SELECT a FROM `p.d.source`", skip_if_unchanged=True) is not None
+    assert backend.rows("p.d.derived") == [{"a": 1}, {"a": 2}]
+
+    sink.from_iterable([{"a": 3}])  # not the result of the query: the next run must not be skipped
+    assert _bulk_sink.QUERY_HASH_LABEL not in sink.bigquery.get_table("p.d.derived").labels
+
+
+def test_clustering_and_partitioning_are_applied_and_reconciled(create_options, create_sink):
+    options = create_options()
+    schema = SCHEMA + [_bs.SchemaField(name="at", field_type=_bs.FieldType.TIMESTAMP)]
+    hourly = _bulk_sink.create_table_time_partitioning("at", partition_type=_bigquery.TimePartitioningType.HOUR)
+    create_sink(
+        options=options,
+        schema=schema,
+        table_partitioning=hourly,
+        table_partition_date=_datetime.datetime(2020, 1, 2, 15, 30),
+        clustering_fields=["a"],
+        require_partition_filter=True,
+    ).from_iterable([{"a": 1, "at": "2020-01-02 15:30:00"}])
+    assert options.backend.rows("p.d.t", partition="2020010215") == [
+        {"a": 1, "at": "2020-01-02 15:30:00"}
+    ]
+    table = options.get_bigquery_client().get_table("p.d.t")
+    assert table.time_partitioning.type_ == "HOUR"
+    assert (table.clustering_fields, table.require_partition_filter) == (["a"], True)
+
+    sink = create_sink(
+        options=options,
+        schema=schema,
+        table_partitioning=hourly,
+        clustering_fields=["at", "a"],
+        require_partition_filter=False,
+        write_disposition=_bulk_sink.WriteDisposition.APPEND,
+    )
+    sink.from_iterable([{"a": 2, "at": "2020-01-02 16:00:00"}])
+    table = options.get_bigquery_client().get_table("p.d.t")
+    assert (table.clustering_fields, table.require_partition_filter) == (["at", "a"], False)
+
+    monthly = _bulk_sink.create_table_time_partitioning("at", partition_type=_bigquery.TimePartitioningType.MONTH)
+    with pytest.raises(ValueError):
+        create_sink(
+            options=options,
+            schema=schema,
+            table_partitioning=monthly,
+            write_disposition=_bulk_sink.WriteDisposition.APPEND,
+        ).from_iterable([{"a": 3}])
+    assert create_sink(options=options, table_partitioning=monthly)._partition_table_ref(
+        "p.d.t", partition_date=_datetime.date(2020, 1, 31)
+    ) == "p.d.t$202001"
+
+    ranges = _bulk_sink.create_table_range_partitioning("a", start=0, end=100, interval=10)
+    sink = create_sink(options=options, table_id="ranges", table_partitioning=ranges, table_partition_date=0)
+    assert sink._partition_table_ref(sink.table_ref) == "p.d.ranges$0"
+    sink.from_iterable([{"a": 5}])
+    assert options.backend.rows("p.d.ranges", partition="0") == [{"a": 5}]
+    assert options.get_bigquery_client().get_table("p.d.ranges").range_partitioning.range_.interval == 10
+    with pytest.raises(ValueError):  # the partition 0 is a partition write, too
+        create_sink(
+            options=options,
+            table_partitioning=ranges,
+            table_partition_date=0,
+            write_disposition=_bulk_sink.WriteDisposition.UPSERT,
+            upsert_keys=["a"],
+        )
+
+
+def test_from_table_copies_tables_and_partitions(create_options, create_sink):
+    options = create_options().replace(labels={"team": "dwh"})
+    backend = options.backend
+    create_sink(options=options, table_id="one").from_iterable([{"a": 1}])
+    create_sink(options=options, table_id="two").from_iterable([{"a": 2}])
+
+    sink = create_sink(
+        options=options,
+        table_id="snapshot",
+        table_description="snapshot of one and two",
+        write_disposition=_bulk_sink.WriteDisposition.REPLACE,
+    )
+    sink.from_table(["p.d.one", "p.d.two"])
+    assert backend.rows("p.d.snapshot") == [{"a": 1}, {"a": 2}]
+    assert sink.rows_written == 2
+    table = sink.bigquery.get_table("p.d.snapshot")
+    assert table.description == "snapshot of one and two"
+    assert table.labels == {"team": "dwh"}
+    assert "copy" in sink.stats.stages
+
+    day = _datetime.date(2020, 1, 2)
+    create_sink(
+        options=options,
+        table_id="events",
+        table_partition_date=day,
+        write_disposition=_bulk_sink.WriteDisposition.REPLACE,
+    ).from_iterable([{"a": 3}])
+    create_sink(
+        options=options,
+        table_id="events_copy",
+        table_partition_date=day,
+        table_partitioning=_bulk_sink.create_table_date_partitioning(field=None),
+        write_disposition=_bulk_sink.WriteDisposition.REPLACE,
+    ).from_table("p.d.events")
+    assert backend.rows("p.d.events_copy", partition="20200102") == [{"a": 3}]
+
+    sink = create_sink(options=options, table_id="snapshot", write_disposition=_bulk_sink.WriteDisposition.APPEND)
+    sink.from_table("p.d.one")
+    assert sink.rows_written == 1  # the copied rows, not the rows of the destination
+    assert len(backend.rows("p.d.snapshot")) == 3
+
+
+def test_from_table_counts_the_source_rows_without_copy_statistics(create_options, create_sink, monkeypatch):
+    options = create_options()
+    create_sink(options=options, table_id="one").from_iterable([{"a": 1}, {"a": 2}])
+    copy_table = _fake.FakeBigQueryClient.copy_table
+
+    def copy_table_without_statistics(client, *args, **kwargs):
+        copy_job = copy_table(client, *args, **kwargs)
+        del copy_job._properties["statistics"]["copy"]
+        return copy_job
+
+    monkeypatch.setattr(_fake.FakeBigQueryClient, "copy_table", copy_table_without_statistics)
+    sink = create_sink(options=options, table_id="snapshot", write_disposition=_bulk_sink.WriteDisposition.APPEND)
+    sink.from_table("p.d.one")
+    sink.from_table("p.d.one")
+    assert sink.rows_written == 2
+    assert len(options.backend.rows("p.d.snapshot")) == 4
+
+
+def test_copied_rows_of_a_client_copy_job():
+    resource = {
+        "jobReference": {"projectId": "p", "jobId": "j"},
+        "configuration": {
+            "copy": {
+                "sourceTables": [{"projectId": "p", "datasetId": "d", "tableId": "one"}],
+                "destinationTable": {"projectId": "p", "datasetId": "d", "tableId": "t"},
+            }
+        },
+    }
+    assert _bulk_sink._copied_rows(_bigquery.CopyJob.from_api_repr(resource, client=None)) is None
+    resource["statistics"] = {"copy": {"copiedRows": "5"}}
+    assert _bulk_sink._copied_rows(_bigquery.CopyJob.from_api_repr(resource, client=None)) == 5
+
+
+def test_build_merge_query():
+    query = _bulk_sink.build_merge_query(
+        target_table_ref="p.d.target",
+        source="p.d.staging",
+        keys=["id"],
+        columns=["id", "value"],
+        partition_filter="T.day >= '2020-01-01'",
+    )
+    assert query == (
+        "MERGE `p.d.target` T\n"
+        "USING `p.d.staging` S\n"
+        "ON T.`id` = S.`id` AND (T.day >= '2020-01-01')\n"
+        "WHEN MATCHED THEN\n"
+        "  UPDATE SET `value` = S.`value`\n"
+        "WHEN NOT MATCHED THEN\n"
+        "  INSERT (`id`, `value`) VALUES (S.`id`, S.`value`)"
+    )
+    keys_only = _bulk_sink.build_merge_query("p.d.t", "(SELECT 1 AS id)", keys=["id"], columns=["id"])
+    assert "WHEN MATCHED" not in keys_only
+    assert "USING (SELECT 1 AS id) S" in keys_only
+
+
+def test_upsert_merges_through_staging_table(create_options, create_sink):
+    schema = [
+        _bs.SchemaField(name="id", field_type=_bs.FieldType.INTEGER),
+        _bs.SchemaField(name="value", field_type=_bs.FieldType.STRING),
+    ]
+    options = create_options()
+    backend = options.backend
+    create_sink(options=options, schema=schema).from_iterable(
+        [{"id": 1, "value": "a"}, {"id": 2, "value": "b"}]
+    )
+
+    sink = create_sink(
+        options=options,
+        schema=schema,
+        write_disposition=_bulk_sink.WriteDisposition.UPSERT,
+        upsert_keys=["id"],
+    )
+    sink.from_iterable([{"id": 2, "value": "B"}, {"id": 3, "value": "c"}])
+
+    assert sorted(backend.rows("p.d.t"), key=lambda row: row["id"]) == [
+        {"id": 1, "value": "a"},
+        {"id": 2, "value": "B"},
+        {"id": 3, "value": "c"},
+    ]
+    assert backend.queries[-1].startswith("MERGE `p.d.t` T")
+    assert [t.table_id for t in sink.bigquery.list_tables("p.d")] == ["t"]
+    assert sink.stats.counters["rows_merged"] == 2
+    assert "merge" in sink.stats.stages
+
+    with pytest.raises(ValueError):
+        create_sink(write_disposition=_bulk_sink.WriteDisposition.UPSERT)
+
+
+def test_upsert_staging_table_expires_relative_to_now_and_filter_limits_matches(create_options, create_sink):
+    schema = [_bs.SchemaField(name="id", field_type=_bs.FieldType.INTEGER)]
+    options = create_options()
+    options.now = _datetime.datetime(2000, 1, 1)  # logical date of e.g. a backfill
+    sink = create_sink(
+        options=options,
+        schema=schema,
+        write_disposition=_bulk_sink.WriteDisposition.UPSERT,
+        upsert_keys=["id"],
+        upsert_partition_filter="T.day >= '2020-01-01'",
+    )
+    created = []
+    create_table = sink.bigquery.create_table
+    sink.bigquery.create_table = lambda table, **kwargs: created.append(table) or create_table(table, **kwargs)
+    sink.from_iterable([{"id": 1}])
+
+    staging = [table for table in created if "__upsert_" in table.table_id]
+    assert len(staging) == 1
+    assert staging[0].expires > _datetime.datetime.now(_datetime.timezone.utc)
+    # the filter restricts the matched target rows (the ON clause), keys outside of it are inserted
+    assert "ON T.`id` = S.`id` AND (T.day >= '2020-01-01')\n" in options.backend.queries[-1]
+
+
+def test_validate_rows_writes_invalid_rows_to_dead_letters(tmp_path, create_sink):
+    schema = [
+        _bs.SchemaField(name="id", field_type=_bs.FieldType.INTEGER, mode=_bs.FieldMode.REQUIRED),
+        _bs.SchemaField(name="at", field_type=_bs.FieldType.TIMESTAMP),
+    ]
+    path = str(tmp_path / "dead_letters.jsonl")
+    sink = create_sink(schema=schema, validate_rows=True, dead_letter_path=path)
+    sink.from_iterable(
+        [
+            {"id": 1, "at": "2020-01-01 00:00:00"},
+            {"id": None, "at": "2020-01-01 00:00:00"},
+            {"id": 3, "at": "yesterday"},
+            {"id": 4},
+        ]
+    )
+    assert sink.options.backend.rows("p.d.t") == [
+        {"id": 1, "at": "2020-01-01 00:00:00"},
+        {"id": 4, "at": None},
+    ]
+    assert sink.rows_written == 2
+    assert sink.stats.counters["rows_rejected"] == 2
+    assert [(entry["offset"], entry["field"], entry["reasons"], entry["row"]) for entry in sink.dead_letters.entries()] == [
+        (1, "id", ["id: missing value of REQUIRED field"], {"id": None, "at": "2020-01-01 00:00:00"}),
+        (2, "at", ["at: invalid timestamp 'yesterday'"], {"id": 3, "at": "yesterday"}),
+    ]
+
+
+def test_dead_letter_errors_collects_failing_rows(create_options, create_sink):
+    schema = [
+        _bs.SchemaField(name="id", field_type=_bs.FieldType.INTEGER),
+        _bs.SchemaField(
+            name="item",
+            field_type=_bs.FieldType.STRUCT,
+            fields=[_bs.SchemaField(name="price", field_type=_bs.FieldType.FLOAT)],
+        ),
+    ]
+    options = create_options()
+    sink = create_sink(options=options, schema=schema, dead_letter_max_rows=2)
+    rows = [{"id": i, "item": {"price": 1.5}} for i in range(3)]
+    rows += [{"id": "x", "item": {"price": 1}}, {"id": 4, "item": {"price": "cheap"}}, {"id": "y"}]
+    assert sink.from_iterable(rows, dead_letter_errors=True) == 3
+
+    assert sink.dead_letters.count == 3
+    assert sink.dead_letters.stored == 2
+    assert sink.dead_letters.error_counts == {("id", "ValueError"): 2, ("item.price", "ValueError"): 1}
+    assert sink.stats.counters["rows_rejected"] == 3
+    assert sink.stats.counters["rows_rejected.ValueError"] == 3
+    entries = list(sink.dead_letters.entries())
+    assert [(entry["offset"], entry["field"], entry["row"]) for entry in entries] == [
+        (3, "id", {"id": "x", "item": {"price": 1}}),
+        (4, "item.price", {"id": 4, "item": {"price": "cheap"}}),
+    ]
+
+    assert sink.dead_letters.upload(options=options, table_id="dead_letters") == 2
+    uploaded = options.backend.rows("p.d.dead_letters")
+    assert uploaded[1]["field"] == "item.price"
+    assert _json.loads(uploaded[1]["row"]) == {"id": 4, "item": {"price": "cheap"}}
+
+    clean = create_sink(options=options, table_id="clean", schema=schema)
+    clean.from_iterable(rows[:3], dead_letter_errors=True)
+    assert clean.dead_letters is None
+
+
+def test_validate_stage_counts_validated_rows_and_temp_dead_letters_can_be_removed(create_sink):
+    schema = [_bs.SchemaField(name="id", field_type=_bs.FieldType.INTEGER, mode=_bs.FieldMode.REQUIRED)]
+    sink = create_sink(schema=schema, validate_rows=True)
+    rows = [{"id": 1}, {"id": "x"}, {"id": None}, {"id": 2}]
+    assert sink.from_iterable(rows, dead_letter_errors=True) == 2
+    assert sink.stats.counters["rows_rejected"] == 2
+    assert sink.stats.stages["validate"].calls == 3  # the row with the extraction error is not validated
+
+    path = sink.dead_letters.path
+    assert _os.path.exists(path)
+    sink.dead_letters.remove()
+    assert not _os.path.exists(path)
@@ -0,0 +1,79 @@
+import pytest
+
+from toolbox import bigquery_sink as _bs
+from toolbox.bigquery_sink import bulk_sink as _bulk_sink
+from toolbox.bigquery_sink import coalesce as _coalesce
+from toolbox.bigquery_sink import fake as _fake
+
+SCHEMA = [_bs.SchemaField(name="id", field_type=_bs.FieldType.INTEGER)]
+
+
+@pytest.fixture
+def create_append_sink(create_sink):
+    def create(options, table_id="t", **kwargs):
+        return create_sink(
+            options, table_id=table_id, schema=SCHEMA, write_disposition=_bulk_sink.WriteDisposition.APPEND, **kwargs
+        )
+
+    return create
+
+
+@pytest.mark.parametrize("location", ["local", "gs://bucket/spool"])
+def test_coalescer_loads_chunks_of_many_writers_with_one_job(location, tmp_path, create_options, create_append_sink):
+    backend = _fake.FakeBackend()
+    options = create_options(backend)
+    spool = _coalesce.ChunkSpool(str(tmp_path) if location == "local" else location, options=options)
+
+    for writer in range(3):
+        sink = create_append_sink(options, spool=spool, compressed_upload=writer == 1)
+        assert sink.from_iterable([{"id": writer * 10 + i} for i in range(2)]) == 2
+        assert "spool" in sink.stats.stages
+    create_append_sink(options, table_id="other", spool=spool).from_iterable([{"id": 100}])
+    assert "load" not in backend.calls
+    assert [len(chunks) for _, chunks in sorted(spool.pending().items())] == [1, 3]
+
+    coalescer = _coalesce.Coalescer(spool=spool, sinks=[create_append_sink(options)])
+    summary = coalescer.run_once(now=1000.0)
+    assert summary.loaded == {"p.d.t": (3, 6)}
+    assert summary.unknown == ["p.d.other"]
+    # chunks in storage are loaded as they are: one job per compression
+    assert backend.calls["load"] == summary.jobs == (1 if location == "local" else 2)
+    assert sorted(row["id"] for row in backend.rows("p.d.t")) == [0, 1, 10, 11, 20, 21]
+    assert list(spool.pending()) == ["p.d.other"]
+
+
+def test_coalescer_stays_within_job_budget(tmp_path, create_options, create_sink, create_append_sink):
+    backend = _fake.FakeBackend()
+    options = create_options(backend)
+    spool = _coalesce.ChunkSpool(str(tmp_path))
+    writer = create_append_sink(options, spool=spool)
+    coalescer = _coalesce.Coalescer(spool=spool, sinks=[create_append_sink(options)], jobs_per_hour=2, max_chunks_per_job=2)
+
+    for i in range(5):
+        writer.from_iterable([{"id": i}])
+    assert coalescer.run_once(now=0.0).loaded == {"p.d.t": (2, 2)}
+    assert coalescer.run_once(now=60.0).loaded == {"p.d.t": (2, 2)}
+    summary = coalescer.run_once(now=120.0)
+    assert (summary.loaded, summary.deferred) == ({}, ["p.d.t"])
+    assert coalescer.run_once(now=3600.0).loaded == {"p.d.t": (1, 1)}
+    assert sorted(row["id"] for row in backend.rows("p.d.t")) == [0, 1, 2, 3, 4]
+
+    with pytest.raises(ValueError):
+        _coalesce.Coalescer(spool=spool, sinks=[create_sink(options)])
+    with pytest.raises(ValueError):
+        create_sink(options, spool=spool)
+
+
+def test_coalescer_loads_compressed_and_plain_chunks_in_storage_separately(create_options, create_append_sink):
+    backend = _fake.FakeBackend()
+    options = create_options(backend)
+    spool = _coalesce.ChunkSpool("gs://bucket/spool", options=options)
+    for i, compressed in enumerate([True, False, True]):
+        create_append_sink(options, spool=spool, compressed_upload=compressed).from_iterable([{"id": i}])
+    coalescer = _coalesce.Coalescer(spool=spool, sinks=[create_append_sink(options)], jobs_per_hour=1)
+
+    summary = coalescer.run_once(now=0.0)
+    assert (summary.loaded, summary.deferred, summary.jobs) == ({"p.d.t": (1, 1)}, ["p.d.t"], 1)
+    assert [chunk.name.endswith(".gz") for chunk in spool.pending()["p.d.t"]] == [True, True]
+    assert coalescer.run_once(now=3600.0).loaded == {"p.d.t": (2, 2)}
+    assert sorted(row["id"] for row in backend.rows("p.d.t")) == [0, 1, 2]
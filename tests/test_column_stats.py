@@ -0,0 +1,91 @@
+import datetime as _datetime
+import decimal as _decimal
+
+from toolbox import bigquery_sink as _bs
+from toolbox.bigquery_sink import bulk_sink as _bulk_sink
+from toolbox.bigquery_sink import column_stats as _column_stats
+from toolbox.bigquery_sink.utils import hll as _hll
+
+
+def test_hyperloglog_estimates_distinct_values():
+    small = _hll.HyperLogLog()
+    for i in range(1000):
+        small.add(str(i % 100).encode("utf-8"))
+    assert small.count() == 100
+
+    large = _hll.HyperLogLog()
+    other = _hll.HyperLogLog()
+    for i in range(50000):
+        (large if i % 2 else other).add(str(i).encode("utf-8"))
+    large.merge(other)
+    assert abs(large.count() - 50000) < 50000 * 0.05
+
+
+def test_sink_collects_column_stats_and_partitions(create_sink):
+    schema = [
+        _bs.SchemaField(name="id", field_type=_bs.FieldType.INTEGER),
+        _bs.SchemaField(name="price", field_type=_bs.FieldType.NUMERIC),
+        _bs.SchemaField(name="at", field_type=_bs.FieldType.TIMESTAMP),
+        _bs.SchemaField(name="tags", field_type=_bs.FieldType.STRING, mode=_bs.FieldMode.REPEATED),
+    ]
+    rows = [
+        {"id": 1, "price": 1.5, "at": "2020-01-31 23:30:00+00:00", "tags": ["a"]},
+        {"id": 2, "price": "10.25", "at": _datetime.datetime(2020, 2, 1, 8), "tags": []},
+        {"id": 2, "price": None, "at": "2020-02-01T01:00:00+02:00"},
+        {"id": None, "price": 3, "at": None, "tags": ["b", "c"]},
+    ]
+    sink = create_sink(
+        schema=schema,
+        table_partitioning=_bulk_sink.create_table_date_partitioning("at"),
+        collect_column_stats=True,
+    )
+    sink.from_iterable(rows)
+
+    stats = sink.column_stats
+    assert stats.rows == 4
+    assert stats.partitions == {"20200131", "20200201", _column_stats.NULL_PARTITION}
+    assert stats.columns["id"].to_dict() == {"count": 3, "nulls": 1, "min": 1, "max": 2, "distinct": 2}
+    assert stats.columns["price"].min == _decimal.Decimal("1.5")
+    assert stats.columns["price"].max == _decimal.Decimal("10.25")
+    assert stats.columns["at"].min == _datetime.datetime(2020, 1, 31, 23, 0)
+    assert stats.columns["at"].max == _datetime.datetime(2020, 2, 1, 8)
+    assert stats.columns["tags"].to_dict() == {"count": 2, "nulls": 2, "min": None, "max": None, "distinct": None}
+    assert "column_stats" in sink.stats.stages
+
+
+def test_boolean_stats_parse_string_booleans_like_bigquery():
+    stats = _column_stats.ColumnStats(_bs.SchemaField(name="flag", field_type=_bs.FieldType.BOOLEAN))
+    for value in ["false", "0", False, "FALSE", 0]:
+        stats.add(value)
+    assert stats.to_dict() == {"count": 5, "nulls": 0, "min": False, "max": False, "distinct": 1}
+    stats.add("true")
+    stats.add(1)
+    assert (stats.min, stats.max, stats.distinct) == (False, True, 2)
+
+
+def test_partition_ids_follow_partitioning(create_options, create_sink):
+    options = create_options()
+    schema = [_bs.SchemaField(name="n", field_type=_bs.FieldType.INTEGER)]
+    sink = create_sink(
+        options,
+        table_id="ranges",
+        schema=schema,
+        table_partitioning=_bulk_sink.create_table_range_partitioning("n", start=0, end=100, interval=10),
+        collect_column_stats=True,
+    )
+    sink.from_iterable([{"n": 5}, {"n": 42}, {"n": 100}])
+    assert sink.column_stats.partitions == {"0", "40", _column_stats.UNPARTITIONED}
+    partition_id = _column_stats.range_partition_id_fn("n", start=0, end=100, interval=10)
+    assert [partition_id({"n": value}) for value in ("abc", [1], "42")] == [
+        _column_stats.UNPARTITIONED, _column_stats.UNPARTITIONED, "40"
+    ]
+
+    sink = create_sink(
+        options,
+        table_id="day",
+        schema=schema,
+        table_partition_date=_datetime.date(2020, 1, 2),
+        collect_column_stats=True,
+    )
+    sink.from_iterable([{"n": 1}])
+    assert sink.column_stats.partitions == {"20200102"}
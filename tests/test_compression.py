@@ -0,0 +1,60 @@
+import pytest
+
+from toolbox import bigquery_sink as _bs
+from toolbox.bigquery_sink import bulk_sink as _bulk_sink
+from toolbox.bigquery_sink import compression as _compression
+from toolbox.bigquery_sink import fake as _fake
+
+SCHEMA = [
+    _bs.SchemaField(name="a", field_type=_bs.FieldType.INTEGER),
+    _bs.SchemaField(name="s", field_type=_bs.FieldType.STRING),
+]
+ROWS = [{"a": i, "s": "event number {}".format(i % 100)} for i in range(40000)]
+
+
+@pytest.fixture
+def create_adaptive_sink(create_options, create_sink):
+    def create(bucket, **backend_kwargs):
+        return create_sink(
+            create_options(_fake.FakeBackend(**backend_kwargs), temp_bucket_name=bucket),
+            schema=SCHEMA,
+            compressed_upload=_compression.AUTO,
+            write_disposition=_bulk_sink.WriteDisposition.APPEND,
+        )
+
+    return create
+
+
+def test_choose_level_trades_cpu_for_bandwidth():
+    profile = {0: (1.0, float("inf")), 1: (0.2, 100e6), 9: (0.15, 5e6)}
+    assert _compression.choose_level(profile, upload_bytes_per_s=1e9) == 0
+    assert _compression.choose_level(profile, upload_bytes_per_s=10e6) == 1
+    assert _compression.choose_level(profile, upload_bytes_per_s=0.1e6) == 9
+
+    profile = _compression.measure_levels(b'{"a": 1, "s": "abc"}\n' * 10000)
+    assert profile[9][0] < profile[1][0] < 0.2
+
+
+def test_adaptive_compression_on_slow_uploads(create_adaptive_sink):
+    sink = create_adaptive_sink("slow-bucket", upload_bytes_per_s=20e6)
+    assert sink.from_iterable(ROWS) == len(ROWS)
+    level = sink.stats.counters["compression_level"]
+    assert level > 0
+    assert sink.stats.counters["bytes_compressed"] < sink.stats.counters["bytes_uncompressed"] / 3
+    assert 15e6 < sink.stats.counters["upload_bytes_per_s"] < 25e6
+    assert "compress" in sink.stats.stages and "compression_probe" in sink.stats.stages
+    assert list(sink.options.backend.blobs("slow-bucket"))[0].endswith(".nljson.gz")  # probe was deleted
+    assert len(sink.options.backend.rows("p.d.t")) == len(ROWS)
+
+    sink.from_iterable(ROWS[:10])  # too small to compress
+    assert sink.stats.counters["compression_level"] == 0
+    assert len(sink.options.backend.rows("p.d.t")) == len(ROWS) + 10
+
+
+def test_adaptive_compression_on_fast_uploads(create_adaptive_sink):
+    _compression.record_upload("fast-bucket", size=10 ** 9, seconds=0.1)
+    sink = create_adaptive_sink("fast-bucket")
+    sink.from_iterable(ROWS)
+    assert sink.stats.counters["compression_level"] == 0
+    assert sink.stats.counters["bytes_compressed"] == sink.stats.counters["bytes_uncompressed"]
+    assert sink.options.backend.calls["upload"] == 1  # cached bandwidth, no probe
@@ -0,0 +1,110 @@
+import datetime as _datetime
+import math as _math
+
+import pytest
+
+from toolbox import bigquery_sink as _bs
+from toolbox.bigquery_sink import dataframe as _dataframe
+
+pd = pytest.importorskip("pandas")
+
+_FT = _bs.FieldType
+
+
+def test_from_dataframe_casts_columns(create_sink):
+    schema = [
+        _bs.SchemaField(name="i", field_type=_FT.INTEGER),
+        _bs.SchemaField(name="i_from_float", field_type=_FT.INTEGER, source_path=["f"]),
+        _bs.SchemaField(name="f", field_type=_FT.FLOAT),
+        _bs.SchemaField(name="n", field_type=_FT.NUMERIC, source_path=["f"]),
+        _bs.SchemaField(name="b", field_type=_FT.BOOLEAN, source_path=["i"]),
+        _bs.SchemaField(name="s", field_type=_FT.STRING),
+        _bs.SchemaField(name="s_from_int", field_type=_FT.STRING, source_path=["i"]),
+        _bs.SchemaField(name="t", field_type=_FT.TIMESTAMP),
+        _bs.SchemaField(name="d", field_type=_FT.DATE, source_path=["t"]),
+        _bs.SchemaField(name="missing", field_type=_FT.STRING),
+        _bs.SchemaField(name="upper", field_type=_FT.STRING, source_fn=lambda row, path: row["s"].upper()),
+        _bs.SchemaField(name="forced", field_type=_FT.STRING),
+    ]
+    dataframe = pd.DataFrame(
+        {
+            "i": [0, 2],
+            "f": [1.123456789, None],
+            "s": ['a "quoted" ü', "b"],
+            "t": pd.to_datetime(["2020-01-01 00:30", None]).tz_localize("Europe/Berlin"),
+        }
+    )
+    sink = create_sink(schema=schema)
+    assert sink.from_dataframe(dataframe, force_values={"forced": "x"}, chunk_rows=1) == 2
+
+    assert sink.options.backend.rows("p.d.t") == [
+        {
+            "i": 0,
+            "i_from_float": 1,
+            "f": 1.123456789,
+            "n": "1.12345679",
+            "b": False,
+            "s": 'a "quoted" ü',
+            "s_from_int": "0",
+            "t": "2019-12-31T23:30:00.000000",
+            "d": "2020-01-01",
+            "missing": None,
+            "upper": 'A "QUOTED" Ü',
+            "forced": "x",
+        },
+        {
+            "i": 2,
+            "i_from_float": None,
+            "f": None,
+            "n": None,
+            "b": True,
+            "s": "b",
+            "s_from_int": "2",
+            "t": None,
+            "d": None,
+            "missing": None,
+            "upper": "B",
+            "forced": "x",
+        },
+    ]
+    assert sink.rows_written == 2
+    assert {"extract", "encode", "upload", "load"} <= set(sink.stats.stages)
+
+
+def test_from_dataframe_falls_back_to_value_casting(create_sink):
+    schema = [
+        _bs.SchemaField(name="b", field_type=_FT.BOOLEAN),
+        _bs.SchemaField(name="d", field_type=_FT.DATE),
+        _bs.SchemaField(name="f", field_type=_FT.FLOAT),
+    ]
+    dataframe = pd.DataFrame(
+        {
+            "b": ["yes", "false"],
+            "d": [_datetime.date(2020, 1, 2), "2020-01-03"],
+            "f": [_math.inf, 1.5],
+        }
+    )
+    sink = create_sink(schema=schema)
+    sink.from_dataframe(dataframe)
+    rows = sink.options.backend.rows("p.d.t")
+    assert [(row["b"], row["d"]) for row in rows] == [(True, "2020-01-02"), (False, "2020-01-03")]
+    assert rows[0]["f"] == _math.inf
+
+
+def test_encode_column_does_not_wrap_floats_beyond_int64_into_integers():
+    field = _bs.SchemaField(name="i", field_type=_FT.INTEGER)
+    dumps = _dataframe._dumps_fn(None)
+    assert _dataframe.encode_column(pd.Series([1.5, None, -2.5]), field, dumps) == ["1", "null", "-2"]
+    assert _dataframe.encode_column(pd.Series([1e20, None]), field, dumps) == ["100000000000000000000", "null"]
+    with pytest.raises(OverflowError):
+        _dataframe.encode_column(pd.Series([1.5, _math.inf, None]), field, dumps)
+
+
+@pytest.mark.parametrize(
+    "kwargs", [{"validate_rows": True}, {"dedup_key": ["i"]}, {"collect_column_stats": True}]
+)
+def test_from_dataframe_rejects_row_options(kwargs, create_sink):
+    sink = create_sink(schema=[_bs.SchemaField(name="i", field_type=_FT.INTEGER)], **kwargs)
+    with pytest.raises(ValueError, match="from_iterable"):
+        sink.from_dataframe(pd.DataFrame({"i": [1]}))
+    assert "load" not in sink.options.backend.calls
@@ -0,0 +1,60 @@
+from toolbox import bigquery_sink as _bs
+from toolbox.bigquery_sink.utils import dedup as _dedup
+
+
+def _key(i):
+    return str(i).encode("utf-8")
+
+
+def test_bloom_filter_has_no_false_negatives_and_few_false_positives():
+    bloom = _dedup.BloomFilter(capacity=10000, error_rate=0.01)
+    assert sum(bloom.add(_dedup.key_digest(_key(i))) for i in range(10000)) > 9900
+    assert not any(bloom.add(_dedup.key_digest(_key(i))) for i in range(10000))
+    false_positives = sum(_dedup.key_digest(_key(i)) in bloom for i in range(10000, 20000))
+    assert false_positives < 200
+    assert bloom.memory_bytes < 15000
+
+
+def test_deduplicator_switches_to_bloom_filter_beyond_budget():
+    deduplicator = _dedup.Deduplicator(memory_bytes=100 * _dedup.EXACT_KEY_BYTES, bloom_capacity=1000)
+    assert [deduplicator.add(_key(i % 50)) for i in range(100)] == [True] * 50 + [False] * 50
+    assert not deduplicator.using_bloom
+    assert (deduplicator.duplicates, deduplicator.probable_duplicates) == (50, 0)
+
+    new = [deduplicator.add(_key(i)) for i in range(1000)]
+    assert deduplicator.using_bloom
+    assert new[:50] == [False] * 50 and sum(new[50:]) >= 940
+    assert not deduplicator.add(_key(999))
+    assert deduplicator.duplicates == 100 + deduplicator.probable_duplicates
+    assert 1 <= deduplicator.probable_duplicates < 20
+
+
+def test_sink_drops_duplicates_by_key(create_options, create_sink):
+    options = create_options()
+    schema = [
+        _bs.SchemaField(name="id", field_type=_bs.FieldType.INTEGER),
+        _bs.SchemaField(name="v", field_type=_bs.FieldType.STRING),
+    ]
+    rows = [{"id": i % 3, "v": str(i % 2)} for i in range(10)]
+
+    sink = create_sink(options, table_id="by_field", schema=schema, dedup_key=["id"])
+    assert sink.from_iterable(rows) == 3
+    assert sink.stats.counters["rows_duplicate"] == 7
+    assert sink.stats.counters["rows_duplicate_probable"] == 0
+    assert [row["id"] for row in options.backend.rows("p.d.by_field")] == [0, 1, 2]
+
+    sink = create_sink(options, table_id="by_fn", schema=schema, dedup_key=lambda row: (row["id"], row["v"]))
+    assert sink.from_iterable(rows) == 6
+
+
+def test_sink_keeps_key_of_rejected_row_available(create_options, create_sink):
+    options = create_options()
+    schema = [
+        _bs.SchemaField(name="id", field_type=_bs.FieldType.INTEGER),
+        _bs.SchemaField(name="v", field_type=_bs.FieldType.STRING, mode=_bs.FieldMode.REQUIRED),
+    ]
+    sink = create_sink(options, schema=schema, validate_rows=True, dedup_key=["id"])
+    assert sink.from_iterable([{"id": 1, "v": None}, {"id": 1, "v": "ok"}, {"id": 1, "v": "again"}]) == 1
+    assert options.backend.rows("p.d.t") == [{"id": 1, "v": "ok"}]
+    assert sink.stats.counters["rows_rejected"] == 1
+    assert sink.stats.counters["rows_duplicate"] == 1
@@ -0,0 +1,86 @@
+import time as _time
+
+from toolbox import bigquery_sink as _bs
+from toolbox.bigquery_sink import deploy as _deploy
+from toolbox.bigquery_sink import fake as _fake
+
+
+def test_deploy_only_touches_changed_objects(create_options):
+    backend = _fake.FakeBackend()
+    options = create_options(backend, create_dataset=True, labels={"team": "dwh"})
+    specs = [
+        _deploy.ViewSpec(name="v1", query="SELECT 1"),
+        _deploy.ViewSpec(name="v2", query="SELECT 2", description="two"),
+        _deploy.TableSpec(
+            name="t", schema=[_bs.SchemaField(name="a", field_type=_bs.FieldType.INTEGER)]
+        ),
+    ]
+    summary = _deploy.deploy(specs, options=options)
+    assert sorted(summary.created) == ["t", "v1", "v2"]
+    assert summary.tables["v2"].description == "two"
+    assert summary.tables["v1"].labels == {"team": "dwh"}
+
+    backend.calls.clear()
+    specs[0] = _deploy.ViewSpec(name="v1", query="SELECT 11", labels={"team": "bi"})
+    summary = _deploy.deploy(specs, options=options)
+    assert summary.updated == {"v1": ["view_query", "labels"]}
+    assert sorted(summary.unchanged) == ["t", "v2"]
+    assert backend.calls["update_table"] == 1
+    table = options.get_bigquery_client().get_table("p.d.v1")
+    assert (table.view_query, table.labels) == ("SELECT 11", {"team": "bi"})
+    assert "updated v1: view_query, labels" in str(summary)
+
+    dry_run = _deploy.deploy([_deploy.ViewSpec(name="v2", query="SELECT 22")], options=options, dry_run=True)
+    assert dry_run.updated == {"v2": ["view_query"]}
+    assert options.get_bigquery_client().get_table("p.d.v2").view_query == "SELECT 2"
+
+
+def test_deploy_fetches_and_applies_concurrently_and_reports_failures(create_options):
+    backend = _fake.FakeBackend(latency_s={"get_table": 0.05, "create_table": 0.05})
+    options = create_options(backend, create_dataset=True)
+    specs = [_deploy.ViewSpec(name="v{}".format(i), query="SELECT {}".format(i)) for i in range(20)]
+    start = _time.monotonic()
+    summary = _deploy.deploy(specs, options=options, parallelism=20)
+    assert _time.monotonic() - start < 0.5
+    assert len(summary.created) == 20
+
+    table_schema = [_bs.SchemaField(name="a", field_type=_bs.FieldType.INTEGER)]
+    summary = _deploy.deploy(
+        [
+            _deploy.TableSpec(name="v0", schema=table_schema),  # is a view
+            _deploy.ViewSpec(name="v1", query="SELECT 1"),
+        ],
+        options=options,
+    )
+    assert list(summary.failed) == ["v0"]
+    assert summary.unchanged == ["v1"]
+
+
+def test_deploy_reconciles_clustering(create_options):
+    options = create_options(create_dataset=True)
+    table_schema = [_bs.SchemaField(name="a", field_type=_bs.FieldType.INTEGER)]
+    _deploy.deploy([_deploy.TableSpec(name="t", schema=table_schema, clustering_fields=["a"])], options=options)
+    assert options.get_bigquery_client().get_table("p.d.t").clustering_fields == ["a"]
+
+    spec = _deploy.TableSpec(name="t", schema=table_schema, clustering_fields=["a"], require_partition_filter=True)
+    assert _deploy.deploy([spec], options=options).updated == {"t": ["require_partition_filter"]}
+    assert _deploy.deploy([spec], options=options).unchanged == ["t"]
+
+
+def test_deploy_creates_tables_and_referenced_views_first(create_options):
+    backend = _fake.FakeBackend(latency_s={"create_table": 0.01})
+    options = create_options(backend, create_dataset=True)
+    specs = [
+        _deploy.ViewSpec(name="v_top", query="SELECT * FROM `p.d.v_base` JOIN `d.v_other` USING (a)"),
+        _deploy.ViewSpec(name="v_base", query="SELECT * FROM `p.d.t`"),
+        _deploy.ViewSpec(name="v_other", query="SELECT * FROM `p.d.v_base`"),
+        _deploy.TableSpec(name="t", schema=[_bs.SchemaField(name="a", field_type=_bs.FieldType.INTEGER)]),
+    ]
+    summary = _deploy.deploy(specs, options=options)
+    summary.raise_for_errors()
+    assert summary.created == ["t", "v_base", "v_other", "v_top"]
+
+    summary = _deploy.deploy(
+        [_deploy.ViewSpec(name="v_missing", query="SELECT * FROM `p.d.missing`")], options=options
+    )
+    assert list(summary.failed) == ["v_missing"]
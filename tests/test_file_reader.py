@@ -0,0 +1,58 @@
+import json as _json
+
+import pytest
+
+from toolbox import bigquery_sink as _bs
+from toolbox.bigquery_sink import file_reader as _file_reader
+
+SCHEMA = [
+    _bs.SchemaField(name="id", field_type=_bs.FieldType.INTEGER),
+    _bs.SchemaField(name="name", field_type=_bs.FieldType.STRING),
+    _bs.SchemaField(name="double", field_type=_bs.FieldType.INTEGER, source_fn=lambda row, path: int(row["id"]) * 2),
+]
+
+
+def test_split_chunks_ends_on_line_boundaries(tmp_path):
+    path = tmp_path / "data.csv"
+    path.write_bytes(b"header\n" + b"".join(b"line %d\n" % i for i in range(100)) + b"last")
+    chunks = _file_reader.split_chunks(str(path), chunk_bytes=50, skip_first_line=True)
+
+    content = path.read_bytes()
+    assert chunks[0][0] == len(b"header\n")
+    assert chunks[-1][1] == len(content)
+    assert all(end == next_start for (_, end), (next_start, _) in zip(chunks, chunks[1:]))
+    assert all(content[end - 1:end] == b"\n" for _, end in chunks[:-1])
+
+
+def test_from_jsonl_file_parses_chunks_in_parallel_and_in_order(tmp_path, create_sink):
+    path = tmp_path / "data.jsonl"
+    rows = [{"id": i, "name": "name   {}".format(i)} for i in range(500)]
+    path.write_text("\n".join(_json.dumps(row, ensure_ascii=False) for row in rows) + "\n", encoding="utf-8")
+
+    sink = create_sink(schema=SCHEMA)
+    assert sink.from_jsonl_file(str(path), workers=3, chunk_bytes=1024, force_values={"source": "file"}) == 500
+    written = sink.options.backend.rows("p.d.t")
+    assert written == [dict(row, double=row["id"] * 2, source="file") for row in rows]
+    assert sink.stats.counters["rows"] == 500
+    assert sink.stats.stages["extract"].calls == 500
+
+
+def test_from_csv_file(tmp_path, create_sink):
+    path = tmp_path / "data.csv"
+    path.write_text('id;name\r\n1;"a;b"\r\n2;\r\n', encoding="utf-8")
+
+    sink = create_sink(schema=SCHEMA)
+    assert sink.from_csv_file(str(path), workers=1, delimiter=";") == 2
+    assert sink.options.backend.rows("p.d.t") == [
+        {"id": 1, "name": "a;b", "double": 2},
+        {"id": 2, "name": None, "double": 4},
+    ]
+
+
+def test_from_file_rejects_row_options(tmp_path, create_sink):
+    path = tmp_path / "data.jsonl"
+    path.write_text('{"id": 1}\n', encoding="utf-8")
+    with pytest.raises(ValueError, match="validate_rows, dedup_key"):
+        create_sink(schema=SCHEMA, validate_rows=True, dedup_key=["id"]).from_jsonl_file(str(path), workers=1)
+    with pytest.raises(ValueError, match="collect_column_stats"):
+        create_sink(schema=SCHEMA, collect_column_stats=True).from_csv_file(str(path), workers=1)
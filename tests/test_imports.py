@@ -0,0 +1,12 @@
+import subprocess
+import sys
+
+
+def test_import_does_not_load_google_libraries():
+    code = (
+        "import sys\n"
+        "from toolbox import bigquery_sink\n"
+        "loaded = [m for m in sys.modules if m.startswith('google.cloud') or m.startswith('google.oauth2')]\n"
+        "assert not loaded, loaded\n"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
@@ -0,0 +1,109 @@
+import time as _time
+
+import pytest
+from google.api_core import exceptions as _exceptions
+
+from toolbox.bigquery_sink import fake as _fake
+from toolbox.bigquery_sink import materialize as _materialize
+
+
+def test_materialize_runs_independent_queries_concurrently(create_options):
+    backend = _fake.FakeBackend(latency_s={"query": 0.2})
+    options = create_options(backend)
+    client = options.get_bigquery_client()
+    client.create_dataset("p.d")
+    client.create_table("p.d.source")
+    backend.insert_rows("p.d.source", [{"x": 1}, {"x": 2}])
+
+    materializations = [
+        _materialize.Materialization(name="a", query="SELECT * FROM `p.d.source`"),
+        _materialize.Materialization(name="b", query="SELECT * FROM `p.d.source`"),
+        _materialize.Materialization(name="c", query="SELECT * FROM `p.d.source`"),
+        _materialize.Materialization(name="d", query="SELECT * FROM `p.d.a`", depends_on=["a", "b"]),
+    ]
+    start = _time.monotonic()
+    results = _materialize.materialize(
+        materializations, options=options, parallelism=3, poll_interval_s=0.01
+    )
+    elapsed = _time.monotonic() - start
+
+    assert {name: r.state for name, r in results.items()} == {
+        "a": "DONE", "b": "DONE", "c": "DONE", "d": "DONE"
+    }
+    assert results["d"].rows_written == 2
+    assert backend.rows("p.d.d") == [{"x": 1}, {"x": 2}]
+    assert elapsed < 0.6  # critical path is two queries, serial would be four
+
+
+def test_materialize_propagates_failures(create_options):
+    backend = _fake.FakeBackend()
+    options = create_options(backend)
+    materializations = [
+        _materialize.Materialization(name="a", query="SELECT * FROM `p.d.missing`"),
+        _materialize.Materialization(name="b", query="SELECT * FROM `p.d.a`", depends_on=["a"]),
+        _materialize.Materialization(name="c", query="SELECT * FROM `p.d.b`", depends_on=["b"]),
+        _materialize.Materialization(name="e", query="SELECT 1"),
+    ]
+    results = _materialize.materialize(materializations, options=options, poll_interval_s=0.01)
+    assert results["a"].state == "FAILED"
+    assert results["a"].error is not None
+    assert results["b"].state == "SKIPPED"
+    assert results["c"].state == "SKIPPED"
+    assert results["e"].state == "DONE"
+
+
+def test_materialize_fails_only_the_job_whose_polling_raises(create_options, monkeypatch):
+    backend = _fake.FakeBackend(latency_s={"query": 0.05})
+    options = create_options(backend)
+    done = _fake.FakeJob.done
+
+    def failing_done(job, *args, **kwargs):
+        if "--bad--" in job.job_id:
+            raise _exceptions.InternalServerError("polling failed")
+        return done(job, *args, **kwargs)
+
+    monkeypatch.setattr(_fake.FakeJob, "done", failing_done)
+    results = _materialize.materialize(
+        [
+            _materialize.Materialization(name="bad", query="SELECT 1"),
+            _materialize.Materialization(name="good", query="SELECT 1"),
+            _materialize.Materialization(name="after_bad", query="SELECT 1", depends_on=["bad"]),
+        ],
+        options=options,
+        poll_interval_s=0.01,
+    )
+    assert {name: r.state for name, r in results.items()} == {
+        "bad": "FAILED", "good": "DONE", "after_bad": "SKIPPED"
+    }
+    assert isinstance(results["bad"].error, _exceptions.InternalServerError)
+
+
+def test_materialize_rejects_cycles_and_unknown_dependencies(create_options):
+    options = create_options()
+    with pytest.raises(ValueError, match="cycle"):
+        _materialize.materialize(
+            [
+                _materialize.Materialization(name="a", query="", depends_on=["b"]),
+                _materialize.Materialization(name="b", query="", depends_on=["a"]),
+            ],
+            options=options,
+        )
+    with pytest.raises(ValueError, match="unknown"):
+        _materialize.materialize(
+            [_materialize.Materialization(name="a", query="", depends_on=["x"])], options=options
+        )
+
+
+def test_options_reuse_clients(create_options):
+    options = create_options()
+    assert options.get_bigquery_client() is options.get_bigquery_client()
+    assert options.get_storage_client() is options.get_storage_client()
+    assert options.get_bigquery_client() is not options.get_bigquery_client(scopes=["x"])
+
+
+def test_materialization_passes_table_settings_to_its_sink(create_options):
+    materialization = _materialize.Materialization(
+        name="a", query="SELECT 1", clustering_fields=["x"], require_partition_filter=True
+    )
+    sink = materialization.create_sink(options=create_options())
+    assert (sink.clustering_fields, sink.require_partition_filter) == (["x"], True)
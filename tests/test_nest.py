@@ -0,0 +1,69 @@
+import collections
+
+import pytest
+
+from toolbox.bigquery_sink.utils import nest as _nest
+
+
+@pytest.mark.parametrize(
+    "path",
+    [
+        [],
+        ["a"],
+        ["a", "b"],
+        ["a", "c", 1, "d"],
+        ["a", "c", 5, "d"],
+        ["a", "c", -1, "d"],
+        ["missing", "b"],
+        ["a", "b", "x"],
+        ["n", "x"],
+    ],
+)
+def test_compile_getter_matches_get(path):
+    obj = {"a": {"b": "hello", "c": [{"d": 1}, {"d": 2}]}, "n": None}
+    getter = _nest.compile_getter(path, default="default")
+    assert getter(obj) == _nest.get(obj, path, default="default")
+
+
+@pytest.mark.parametrize(
+    "obj, path",
+    [
+        ({"t": (10, 20)}, ["t", 0]),
+        ((10, 20), [1]),
+        ({"s": "abc"}, ["s", 0]),
+        ("abc", [0]),
+        (collections.defaultdict(list, {"a": 1}), ["x"]),
+        ({"d": collections.defaultdict(dict)}, ["d", "x", "y"]),
+        (collections.OrderedDict(a={"b": 1}), ["a", "b"]),
+        ({"l": [1, 2]}, ["l", True]),
+    ],
+)
+def test_compile_getter_matches_get_for_other_containers(obj, path):
+    def result(fn):
+        try:
+            return fn()
+        except Exception as exception:
+            return type(exception)
+
+    expected = result(lambda: _nest.get(obj, path, default="default"))
+    assert result(lambda: _nest.compile_getter(path, default="default")(obj)) == expected
+    assert "x" not in obj  # defaultdicts are not extended
+
+
+def test_compile_getter_raises_like_get():
+    getter = _nest.compile_getter(["a", "b"])
+    with pytest.raises(TypeError):
+        _nest.get({"a": 1}, ["a", "b"])
+    with pytest.raises(TypeError):
+        getter({"a": 1})
+
+
+def test_compile_inserter():
+    inserter = _nest.compile_inserter(["a", "b", "c"])
+    assert inserter({"a": {"x": 1}}, "hello") == {"a": {"x": 1, "b": {"c": "hello"}}}
+
+    ordered = inserter(collections.OrderedDict(), "hello")
+    assert isinstance(ordered["a"], collections.OrderedDict)
+
+    with pytest.raises(ValueError):
+        _nest.compile_inserter(["a", 1, "b"])
@@ -0,0 +1,42 @@
+import itertools as _itertools
+
+from toolbox import bigquery_sink as _bs
+from toolbox.bigquery_sink import pipeline as _pipeline
+from toolbox.bigquery_sink import stats as _stats
+
+SCHEMA = [
+    _bs.SchemaField(name="id", field_type=_bs.FieldType.INTEGER, source_path=["meta", "id"]),
+    _bs.SchemaField(name="name", field_type=_bs.FieldType.STRING),
+]
+
+
+def test_iter_extracted_is_lazy():
+    consumed = []
+
+    def rows():
+        for i in _itertools.count():
+            consumed.append(i)
+            yield {"meta": {"id": str(i)}, "name": i}
+
+    stats = _stats.SinkStats()
+    extracted = _pipeline.iter_extracted(SCHEMA, rows(), force_values={"day": "2020-01-01"}, stats=stats)
+    assert next(extracted) == {"id": 0, "name": "0", "day": "2020-01-01"}
+    assert next(extracted) == {"id": 1, "name": "1", "day": "2020-01-01"}
+    assert consumed == [0, 1]
+
+    extracted.close()
+    assert stats.stages["extract"].calls == 2
+
+
+def test_pipeline_chains_stages_and_writes():
+    rows = ({"meta": {"id": i}, "name": "row {}".format(i)} for i in range(10))
+    written = []
+    count = (
+        _pipeline.Pipeline(rows)
+        .filter(lambda row: row["meta"]["id"] % 2 == 0)
+        .extract(SCHEMA)
+        .map(lambda row: dict(row, upper=row["name"].upper()))
+        .write_to(written.append)
+    )
+    assert count == 5
+    assert written[1] == {"id": 2, "name": "row 2", "upper": "ROW 2"}
@@ -0,0 +1,62 @@
+from toolbox import bigquery_sink as _bs
+from toolbox.bigquery_sink import profiler as _profiler
+
+
+def test_profiler_records_nested_and_repeated_fields():
+    schema = [
+        _bs.SchemaField(name="a", field_type=_bs.FieldType.INTEGER),
+        _bs.SchemaField(
+            name="s",
+            field_type=_bs.FieldType.STRUCT,
+            fields=[_bs.SchemaField(name="b", field_type=_bs.FieldType.INTEGER)],
+        ),
+        _bs.SchemaField(
+            name="r",
+            field_type=_bs.FieldType.INTEGER,
+            mode=_bs.FieldMode.REPEATED,
+            source_path=["l", _bs.SourcePathElements.LIST_INDEX, "v"],
+        ),
+    ]
+    rows = [
+        {"a": 1, "s": {"b": 2}, "l": [{"v": 1}, {"v": 2}]},
+        {"a": "x", "s": {}, "l": []},
+        {"a": 3, "s": {"b": 2}, "l": [{"v": 3}]},
+    ]
+
+    profiler = _profiler.ExtractionProfiler(sample_every=1)
+    for row in rows:
+        assert profiler.sample()
+        values = {
+            field.name: field.extract(
+                row, should_fire_exception=lambda *x: False, profiler=profiler
+            )
+            for field in schema
+        }
+    assert values == {"a": 3, "s": {"b": 2}, "r": [3]}
+
+    assert set(profiler.fields) == {"a", "s", "s.b", "r"}
+    assert profiler.fields["a"].calls == 3
+    assert profiler.fields["a"].exceptions == 1
+    assert profiler.fields["a"].missing == 1
+    assert profiler.fields["s.b"].missing == 1
+    assert profiler.fields["r"].missing == 1
+    assert profiler.current_field is None
+    assert "s.b" in profiler.report()
+
+
+def test_profiler_sampling():
+    profiler = _profiler.ExtractionProfiler(sample_every=3)
+    assert [profiler.sample() for _ in range(7)] == [True, False, False, True, False, False, True]
+    assert profiler.rows_profiled == 3
+
+
+def test_profiler_keeps_child_with_the_name_of_its_parent():
+    field = _bs.SchemaField(
+        name="item",
+        field_type=_bs.FieldType.STRUCT,
+        fields=[_bs.SchemaField(name="item", field_type=_bs.FieldType.INTEGER)],
+    )
+    profiler = _profiler.ExtractionProfiler(sample_every=1)
+    assert profiler.sample()
+    assert field.extract({"item": {"item": 1}}, profiler=profiler) == {"item": 1}
+    assert set(profiler.fields) == {"item", "item.item"}
@@ -380,5 +380,59 @@ def test_ensure_type_boolean():
     assert field._ensure_type(value=True) is True
 
 
+def test_schema_field_is_immutable():
+    field = _bs.SchemaField(name="hello", field_type=_bs.FieldType.INTEGER)
+    assert not hasattr(field, "__dict__")
+    with pytest.raises(AttributeError):
+        field.name = "world"
+
+
+def test_replace_is_memoized():
+    field = _bs.SchemaField(
+        name="hello", field_type=_bs.FieldType.INTEGER, source_path=["a", "b"]
+    )
+    replaced = field.replace(source_path=["c"])
+    assert replaced is field.replace(source_path=["c"])
+    assert replaced.source_path == ("c",)
+    assert replaced.name == "hello"
+    assert field.replace(mode=_bs.FieldMode.REPEATED) is not replaced
+
+
+def test_fingerprint_and_pickle():
+    import pickle
+
+    field = _bs.SchemaField(
+        name="hello",
+        field_type=_bs.FieldType.STRUCT,
+        source_path=["world"],
+        fields=[_bs.SchemaField(name="foo", field_type=_bs.FieldType.INTEGER)],
+    )
+    copy = pickle.loads(pickle.dumps(field))
+    assert copy.fingerprint() == field.fingerprint()
+    assert copy.extract(row={"world": {"foo": "1"}}) == {"foo": 1}
+    assert field.fingerprint() != field.replace(description="changed").fingerprint()
+
+
+def test_exception_field_path_keeps_every_level():
+    nested = _bs.SchemaField(
+        name="item",
+        field_type=_bs.FieldType.STRUCT,
+        fields=[_bs.SchemaField(name="item", field_type=_bs.FieldType.INTEGER)],
+    )
+    with pytest.raises(ValueError) as info:
+        nested.extract(row={"item": {"item": "x"}})
+    assert _bs.exception_field_path(info.value) == "item.item"
+
+    repeated = _bs.SchemaField(
+        name="v",
+        field_type=_bs.FieldType.INTEGER,
+        source_path=["l", SourcePathElements.LIST_INDEX, "m", SourcePathElements.LIST_INDEX, "v"],
+        mode=_bs.FieldMode.REPEATED,
+    )
+    with pytest.raises(ValueError) as info:
+        repeated.extract(row={"l": [{"m": [{"v": 1}, {"v": "x"}]}]})
+    assert _bs.exception_field_path(info.value) == "v"  # the element copies do not add levels
+
+
 if __name__ == "__main__":
     test_extract_repeated_unroll_with_struct_root_reference()
\ No newline at end of file
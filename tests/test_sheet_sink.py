@@ -0,0 +1,133 @@
+import re as _re
+
+import pytest
+
+from toolbox import bigquery_sink as _bs
+from toolbox.bigquery_sink import fake as _fake
+from toolbox.bigquery_sink import sheet_sink as _sheet_sink
+
+SCHEMA = [
+    _bs.SchemaField(name="key", field_type=_bs.FieldType.STRING),
+    _bs.SchemaField(name="value", field_type=_bs.FieldType.INTEGER),
+]
+
+
+def _create_sheet_sink(options):
+    return _sheet_sink.BQSheetSink(
+        table_id="config",
+        sheet_url="https://docs.google.com/spreadsheets/d/abc",
+        sheet_range=_sheet_sink.SheetRange(tab="Sheet1", first_column="A", first_row=2, last_column="B"),
+        schema=SCHEMA,
+        options=options,
+    )
+
+
+def test_materialize_only_refreshes_changed_sheets(create_options):
+    backend = _fake.FakeBackend()
+    backend.register_query(
+        r"FARM_FINGERPRINT.*FROM `([^`]+)`",
+        lambda match, job_config: [{"content_hash": hash(repr(backend.rows(match.group(1))))}],
+    )
+    sink = _create_sheet_sink(create_options(backend, create_dataset=True))
+    sink.create_bq_table()
+    backend.insert_rows("p.d.config", [{"key": "a", "value": 1}])
+
+    assert sink.materialize() is True
+    assert backend.rows("p.d.config_native") == [{"key": "a", "value": 1}]
+    native = sink.bigquery.get_table("p.d.config_native")
+    assert native.labels[_sheet_sink.CONTENT_HASH_LABEL] == str(hash(repr([{"key": "a", "value": 1}])))
+
+    assert sink.materialize() is False
+    assert sink.materialize(force=True) is True
+
+    backend.insert_rows("p.d.config", [{"key": "b", "value": 2}])
+    assert sink.materialize() is True
+    assert len(backend.rows("p.d.config_native")) == 2
+    assert sum(1 for query in backend.queries if _re.match(r"SELECT \* FROM", query)) == 3
+
+
+def test_materialize_reads_the_sheet_only_after_the_file_version_changed(create_options):
+    backend = _fake.FakeBackend()
+    backend.register_query(
+        r"FARM_FINGERPRINT.*FROM `([^`]+)`",
+        lambda match, job_config: [{"content_hash": hash(repr(backend.rows(match.group(1))))}],
+    )
+    backend.drive_files["abc"] = {"version": "1"}
+    sink = _create_sheet_sink(create_options(backend, create_dataset=True))
+    sink.create_bq_table()
+    backend.insert_rows("p.d.config", [{"key": "a", "value": 1}])
+
+    def hash_queries():
+        return sum(1 for query in backend.queries if "FARM_FINGERPRINT" in query)
+
+    assert sink.materialize() is True
+    native = sink.bigquery.get_table("p.d.config_native")
+    assert native.labels[_sheet_sink.SHEET_VERSION_LABEL] == "1"
+    assert sink.materialize() is False
+    assert hash_queries() == 1
+
+    backend.drive_files["abc"] = {"version": "2"}  # e.g. another tab changed
+    assert sink.materialize() is False
+    assert hash_queries() == 2
+    assert sink.materialize() is False
+    assert hash_queries() == 2
+
+    backend.insert_rows("p.d.config", [{"key": "b", "value": 2}])
+    backend.drive_files["abc"] = {"version": "3"}
+    assert sink.materialize() is True
+    assert len(backend.rows("p.d.config_native")) == 2
+
+
+def test_register_sheet_sinks_validates_ranges_and_patches_changes(create_options):
+    backend = _fake.FakeBackend()
+    sink = _create_sheet_sink(create_options(backend, create_dataset=True))
+
+    def other(table_id, sheet_range):
+        return _sheet_sink.BQSheetSink(
+            table_id=table_id,
+            sheet_url=sink.sheet_url,
+            sheet_range=sheet_range,
+            schema=SCHEMA,
+            options=sink.options,
+        )
+
+    overlapping = other("overlapping", _sheet_sink.SheetRange("Sheet1", "B", 10, "C", 20))
+    reversed_columns = other("reversed", _sheet_sink.SheetRange("Sheet2", "C", 1, "A"))
+    with pytest.raises(ValueError) as error:
+        _sheet_sink.register_sheet_sinks([sink, overlapping, reversed_columns])
+    assert "overlaps" in str(error.value)
+    assert "first column C is after last column A" in str(error.value)
+    assert "create_table" not in backend.calls
+
+    separate = other("separate", _sheet_sink.SheetRange("Sheet2", "A", 1, "B", 10))
+    summary = _sheet_sink.register_sheet_sinks([sink, separate])
+    assert summary.created == ["p.d.config", "p.d.separate"]
+
+    moved = other("separate", _sheet_sink.SheetRange("Sheet2", "A", 1, "B", 20))
+    summary = _sheet_sink.register_sheet_sinks([sink, moved])
+    assert summary.updated == {"p.d.separate": ["external_data_configuration"]}
+    assert summary.unchanged == ["p.d.config"]
+    table = sink.bigquery.get_table("p.d.separate")
+    assert table.external_data_configuration.options.range == "'Sheet2'!A1:B20"
+
+
+def test_register_sheet_sinks_uses_the_options_of_every_sink(create_options):
+    backend = _fake.FakeBackend()
+    sink = _create_sheet_sink(create_options(backend, create_dataset=True))
+    other_backend = _fake.FakeBackend()  # e.g. other credentials
+    options = sink.options.replace(dataset_id="d2", labels={"team": "finance"}, backend=other_backend)
+    options.get_bigquery_client().create_dataset("p.d2")
+    labelled = _sheet_sink.BQSheetSink(
+        table_id="labelled",
+        sheet_url=sink.sheet_url,
+        sheet_range=_sheet_sink.SheetRange("Sheet2", "A", 1, "B"),
+        schema=SCHEMA,
+        options=options,
+    )
+
+    summary = _sheet_sink.register_sheet_sinks([sink, labelled])
+    assert summary.created == ["p.d.config", "p.d2.labelled"]
+    assert labelled.bigquery.get_table("p.d2.labelled").labels == {"team": "finance"}
+    assert sink.bigquery.get_table("p.d.config").labels == {}
+    assert other_backend.calls["create_table"] == 1
+    assert backend.calls["create_table"] == 1
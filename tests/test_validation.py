@@ -0,0 +1,74 @@
+import datetime as _datetime
+
+from toolbox import bigquery_sink as _bs
+from toolbox.bigquery_sink import validation as _validation
+
+_FT = _bs.FieldType
+_FM = _bs.FieldMode
+
+SCHEMA = [
+    _bs.SchemaField(name="id", field_type=_FT.INTEGER, mode=_FM.REQUIRED),
+    _bs.SchemaField(name="amount", field_type=_FT.NUMERIC),
+    _bs.SchemaField(name="at", field_type=_FT.TIMESTAMP),
+    _bs.SchemaField(name="day", field_type=_FT.DATE),
+    _bs.SchemaField(name="flag", field_type=_FT.BOOLEAN),
+    _bs.SchemaField(name="tags", field_type=_FT.STRING, mode=_FM.REPEATED),
+    _bs.SchemaField(
+        name="item",
+        field_type=_FT.STRUCT,
+        fields=[_bs.SchemaField(name="price", field_type=_FT.FLOAT)],
+    ),
+]
+
+
+def test_valid_rows_pass():
+    validator = _validation.RowValidator(SCHEMA)
+    assert validator.validate(
+        {
+            "id": "12",
+            "amount": "123.123456789",
+            "at": "2020-01-01 12:00:00.123456 UTC",
+            "day": _datetime.date(2020, 1, 1),
+            "flag": 1,
+            "tags": ["a", "b"],
+            "item": {"price": 1},
+        }
+    ) == []
+    assert validator.validate({"id": 1, "at": _datetime.datetime(2020, 1, 1), "tags": None, "item": None}) == []
+
+
+def test_date_rejects_datetimes():
+    validator = _validation.RowValidator(SCHEMA)
+    assert validator.validate({"id": 1, "day": _datetime.datetime(2020, 1, 1)}) == [
+        "day: invalid date datetime.datetime(2020, 1, 1, 0, 0)"
+    ]
+
+
+def test_invalid_rows_report_all_problems():
+    validator = _validation.RowValidator(SCHEMA, max_row_bytes=100)
+    problems = validator.validate(
+        {
+            "amount": 0.1234567891,
+            "at": "01.01.2020",
+            "day": "2020-01-01T00:00:00",
+            "flag": "maybe",
+            "tags": ["a", None, 3],
+            "item": {"price": "cheap", "extra": 1},
+            "unknown": 1,
+        },
+        encoded_size=101,
+    )
+    assert problems == [
+        "id: missing value of REQUIRED field",
+        "amount: numeric 0.1234567891 has more than 29 integer or 9 fractional digits",
+        "at: invalid timestamp '01.01.2020'",
+        "day: invalid date '2020-01-01T00:00:00'",
+        "flag: invalid boolean 'maybe'",
+        "tags[1]: null element in REPEATED field",
+        "tags[2]: expected a string, got int",
+        "item.price: invalid float 'cheap'",
+        "item.extra: unknown field",
+        "unknown: unknown field",
+        "row of 101 bytes exceeds the maximum of 100 bytes",
+    ]
+    assert validator.validate({"id": 2 ** 63}) == ["id: integer 9223372036854775808 out of range"]
@@ -3,9 +3,6 @@ import enum as _enum
 import typing as _typing
 import datetime as _datetime
 import re as _re
-from google.cloud import bigquery as _bigquery
-from google.cloud import storage as _storage
-from google.oauth2 import service_account as _service_account
 from toolbox.bigquery_sink.utils import nest as _nest
 
 
@@ -22,6 +19,7 @@ class Options(object):
         now: _typing.Optional[_datetime.datetime] = None,
         labels: _typing.Optional[_typing.Dict] = None,
         bq_client_scopes: _typing.Optional[_typing.List] = None,
+        backend: _typing.Optional[_typing.Any] = None,
     ):
         """
         Reduce copy paste code: create an access config once and reuse it for multiple sinks
@@ -35,6 +33,7 @@ class Options(object):
         :param now: (optional) allows trace passed time since a process was originally started
         :param labels: A dictionary of labels that should be attached to tables and other resources
         :param bq_client_scopes: A list of client scopes for bigquery to override the default
+        :param backend: (optional) provides the clients instead of google's authenticated clients, e.g. `fake.FakeBackend()` to run sinks offline
         """
         self.project_id = project_id
         self.dataset_id = dataset_id
@@ -44,6 +43,8 @@ class Options(object):
         self.bq_location = bq_location
         self.bq_client_scopes = bq_client_scopes
         self.labels = labels
+        self.backend = backend
+        self._clients = {}
 
         if correlation_id:
             if not _re.match(r"[a-z]+", correlation_id):
@@ -55,16 +56,60 @@ class Options(object):
         self.now = now
 
     def get_bigquery_client(self, scopes=None):
+        """
+        The bigquery client is created once per options object (and scopes) and then reused
+        """
         if scopes is None:
             scopes = self.bq_client_scopes
-        return self._get_client(cls=_bigquery.Client, scopes=scopes)
+        cache_key = ("bigquery", tuple(scopes or ()))
+        client = self._clients.get(cache_key)
+        if client is None:
+            if self.backend is not None:
+                client = self.backend.get_bigquery_client(scopes=scopes)
+            else:
+                from google.cloud import bigquery as _bigquery
+
+                client = self._get_client(cls=_bigquery.Client, scopes=scopes)
+            client = self._clients.setdefault(cache_key, client)
+        return client
 
     def get_storage_client(self):
-        return self._get_client(
-            cls=_storage.Client,
-        )
+        """
+        The storage client is created once per options object and then reused
+        """
+        client = self._clients.get(("storage",))
+        if client is None:
+            if self.backend is not None:
+                client = self.backend.get_storage_client()
+            else:
+                from google.cloud import storage as _storage
+
+                client = self._get_client(
+                    cls=_storage.Client,
+                )
+            client = self._clients.setdefault(("storage",), client)
+        return client
+
+    def get_drive_client(self):
+        """
+        The (minimal) drive client is created once per options object and then reused, see `sheet_sink.DriveClient`
+        """
+        client = self._clients.get(("drive",))
+        if client is None:
+            if self.backend is not None:
+                client = self.backend.get_drive_client()
+            else:
+                from toolbox.bigquery_sink import sheet_sink as _sheet_sink
+
+                client = self._get_client(cls=_sheet_sink.DriveClient, scopes=_sheet_sink.DRIVE_SCOPES)
+            client = self._clients.setdefault(("drive",), client)
+        return client
 
     def _get_client(self, cls, scopes=None):
+        # the google libraries are imported lazily: they are slow to import and not
+        # required when only the schema / extraction layer of this package is used
+        from google.oauth2 import service_account as _service_account
+
         if self.service_account_credentials:
             project_id = self.service_account_credentials["project_id"]
         else:
@@ -90,6 +135,7 @@ class Options(object):
         now: _typing.Optional[_datetime.datetime] = None,
         labels: _typing.Optional[_typing.Dict] = None,
         bq_client_scopes: _typing.Optional[_typing.List] = None,
+        backend: _typing.Optional[_typing.Any] = None,
     ):
         """
         Return an access config with the same values but replacing the values that are not None
@@ -103,6 +149,7 @@ class Options(object):
         :param now: (optional) allows trace passed time since a process was originally started
         :param labels: A dictionary of labels that should be attached to tables and other resources
         :param bq_client_scopes: A list of client scopes for bigquery to override the default
+        :param backend: (optional) provides the clients instead of google's authenticated clients
         :return: A copy of the access config after replacing the provided fields
         """
         return self.__class__(
@@ -117,6 +164,7 @@ class Options(object):
             now=now or self.now,
             labels=labels or self.labels,
             bq_client_scopes=bq_client_scopes or self.bq_client_scopes,
+            backend=backend or self.backend,
         )
 
 
@@ -173,6 +221,8 @@ class _MissingToken(object):
     pass
 
 
+_MISSING = _MissingToken()
+
 source_fn_type = _typing.Callable[[_typing.Any, _typing.List], _typing.Any]
 
 
@@ -191,11 +241,123 @@ def _strtobool(val):
         raise ValueError("invalid truth value %r" % (val,))
 
 
+def _cast_string(value):
+    if not isinstance(value, str) and value is not None:
+        value = str(value)
+    return value
+
+
+def _cast_integer(value):
+    if value is not None:
+        value = int(value)
+    return value
+
+
+def _cast_float(value):
+    if value is not None:
+        value = float(value)
+    return value
+
+
+def _cast_numeric(value):
+    if isinstance(value, float):
+        value = str(round(value, 8))
+    return value
+
+
+def _cast_boolean(value):
+    if isinstance(value, int):
+        value = value != 0
+    elif isinstance(value, str):
+        value = _strtobool(value)
+    return value
+
+
+def _cast_date(value):
+    if isinstance(value, _datetime.datetime):
+        value = value.date()
+
+    if isinstance(value, str):
+        match = _re.match(r"(\d{4})-(\d\d)-(\d\d)", value)
+        value = _datetime.date(
+            int(match.group(1)), int(match.group(2)), int(match.group(3))
+        )
+
+    if isinstance(value, int):
+        value = _datetime.datetime.fromtimestamp(value).date()
+    return value
+
+
+def _cast_timestamp(value):
+    if isinstance(value, int):
+        value = _datetime.datetime.fromtimestamp(value, _datetime.timezone.utc).replace(
+            tzinfo=None
+        )
+    return value
+
+
+def _cast_identity(value):
+    return value
+
+
+# one caster per field type, so that the type checks do not need to be repeated for every value
+_CASTERS = {
+    FieldType.STRING: _cast_string,
+    FieldType.INTEGER: _cast_integer,
+    FieldType.FLOAT: _cast_float,
+    FieldType.NUMERIC: _cast_numeric,
+    FieldType.BOOLEAN: _cast_boolean,
+    FieldType.DATE: _cast_date,
+    FieldType.DATETIME: _cast_timestamp,
+    FieldType.TIMESTAMP: _cast_timestamp,
+}
+
+_REPLACE_CACHE_SIZE = 256
+
+
+def _annotate_field_path(exception, name):
+    """
+    Prepend the field name to the field path stored on an exception (only runs when extraction fails)
+    """
+    field_path = getattr(exception, "_bqsink_field_path", None)
+    field_path = name if field_path is None else name + "." + field_path
+    try:
+        exception._bqsink_field_path = field_path
+    except AttributeError:
+        pass
+
+
+def exception_field_path(exception):
+    """
+    :return: the path of the schema field whose extraction raised the exception, e.g. "item.price" (or None)
+    """
+    return getattr(exception, "_bqsink_field_path", None)
+
+
 class SchemaField(object):
     """
-    Used to build schemas for bigquery tables
+    Used to build schemas for bigquery tables.
+    Schema fields are immutable - use `replace` to derive modified copies.
     """
 
+    __slots__ = (
+        "name",
+        "field_type",
+        "description",
+        "source_path",
+        "source_fn",
+        "fields",
+        "mode",
+        "_relative_path",
+        "_is_absolute_path",
+        "_has_path_fns",
+        "_caster",
+        "_getter",
+        "_bq_field",
+        "_fingerprint",
+        "_replace_cache",
+    )
+
     def __init__(
         self,
         name: str,
@@ -211,43 +373,133 @@ class SchemaField(object):
         :param name: Name of the field in bigquery
         :param field_type: Type of field, pick from any bigquery compatible type, e.g. STRING, TIMESTAMP, INTEGER, FLOAT
         :param description: Describe the content of this field
-        :param source_path: Can be used to easily extract data from a data source row. Should be a list of keys
-        :param fields: If the field_type is RECORD you can specify fields for the "sub document" of the record
+        :param source_path: Can be used to easily extract data from a data source row. Should be a list of keys (stored as tuple)
+        :param fields: If the field_type is RECORD you can specify fields for the "sub document" of the record (stored as tuple)
         :param mode: pick from NULLABLE, REQUIRED, REPEATED (view bigquery docs for meaning)
         """
-        self.name = name
-        self.field_type = field_type
-        self.description = description
-        self.source_path = source_path
-        self.source_fn = source_fn
-        self.fields = fields
-        self.mode = mode or FieldMode.NULLABLE
+        set_attr = super().__setattr__
+        set_attr("name", name)
+        set_attr("field_type", field_type)
+        set_attr("description", description)
+        set_attr("source_path", None if source_path is None else tuple(source_path))
+        set_attr("source_fn", source_fn)
+        set_attr("fields", None if fields is None else tuple(fields))
+        set_attr("mode", mode or FieldMode.NULLABLE)
+
+        # derived data, computed once per field instead of once per extracted value
+        if self.source_path is None:
+            relative_path = (name,)
+            is_absolute_path = False
+        elif len(self.source_path) and self.source_path[0] == SourcePathElements.ROOT:
+            relative_path = self.source_path[1:]
+            is_absolute_path = True
+        else:
+            relative_path = self.source_path
+            is_absolute_path = False
+        set_attr("_relative_path", relative_path)
+        set_attr("_is_absolute_path", is_absolute_path)
+        set_attr(
+            "_has_path_fns",
+            any(isinstance(element, _typing.Callable) for element in relative_path),
+        )
+        set_attr("_caster", _CASTERS.get(field_type, _cast_identity))
+        if (
+            source_fn is None
+            and not is_absolute_path
+            and not self._has_path_fns
+            and self.mode != FieldMode.REPEATED
+            and field_type != FieldType.STRUCT
+        ):
+            set_attr("_getter", _nest.compile_getter(relative_path, default=_MISSING))
+        else:
+            set_attr("_getter", None)
+        set_attr("_bq_field", None)
+        set_attr("_fingerprint", None)
+        set_attr("_replace_cache", None)
+
+    def __setattr__(self, key, value):
+        raise AttributeError(
+            "SchemaField is immutable, use `replace` to create a modified copy"
+        )
+
+    def __delattr__(self, key):
+        raise AttributeError(
+            "SchemaField is immutable, use `replace` to create a modified copy"
+        )
+
+    def __reduce__(self):
+        return (
+            self.__class__,
+            (
+                self.name,
+                self.field_type,
+                self.description,
+                self.source_path,
+                self.source_fn,
+                self.fields,
+                self.mode,
+            ),
+        )
 
     def __str__(self):
         return "<Field:{name} {type} {mode}>".format(
             name=self.name, type=self.field_type.name, mode=self.mode.name
         )
 
+    def source_column(self):
+        """
+        :return: the key this field reads from the top level of a row,
+            None if the field needs more than a plain key lookup (source_fn, nested path, REPEATED, STRUCT)
+        """
+        if self._getter is not None and len(self._relative_path) == 1 and isinstance(self._relative_path[0], str):
+            return self._relative_path[0]
+        return None
+
     def to_bq_field(self):
         """
         Creates a SchemaField compatible with bigquery's python library
         :return: SchemaField from original google lib
         """
-        return _bigquery.schema.SchemaField(
-            name=self.name,
-            field_type=self.field_type.value,
-            mode=self.mode.value or "NULLABLE",
-            description=self.description,
-            fields=[f.to_bq_field() for f in self.fields or ()],
-        )
+        if self._bq_field is None:
+            from google.cloud import bigquery as _bigquery
+
+            bq_field = _bigquery.schema.SchemaField(
+                name=self.name,
+                field_type=self.field_type.value,
+                mode=self.mode.value or "NULLABLE",
+                description=self.description,
+                fields=[f.to_bq_field() for f in self.fields or ()],
+            )
+            super().__setattr__("_bq_field", bq_field)
+        return self._bq_field
+
+    def fingerprint(self):
+        """
+        A hashable representation of everything that ends up in the bigquery table schema.
+        Two fields with the same fingerprint produce the same bigquery schema field.
+        :return: tuple of (name, type, mode, description, fingerprints of sub fields)
+        """
+        if self._fingerprint is None:
+            fingerprint = (
+                self.name,
+                self.field_type.value,
+                self.mode.value,
+                self.description,
+                tuple(f.fingerprint() for f in self.fields or ()),
+            )
+            super().__setattr__("_fingerprint", fingerprint)
+        return self._fingerprint
 
-    def extract(self, row, should_ensure_type=True, should_fire_exception=None):
+    def extract(
+        self, row, should_ensure_type=True, should_fire_exception=None, profiler=None
+    ):
         """
         Extracts the field value from row given source_path
         :param row: the row to extract from
         :param should_ensure_type: Should the types be casted into the output types?
         :param should_fire_exception:
             Pass in fn to check whether an exception should be fired. fn(row, path, exception) -> Boolean
+        :param profiler: (optional) a `profiler.ExtractionProfiler` that records time spent per field
         :return: The field value that was extracted
         """
 
@@ -256,9 +508,12 @@ class SchemaField(object):
             path=[],
             should_ensure_type=should_ensure_type,
             should_fire_exception=should_fire_exception,
+            profiler=profiler,
         )
 
-    def _extract_inner(self, row, path, should_ensure_type, should_fire_exception):
+    def _extract_inner(
+        self, row, path, should_ensure_type, should_fire_exception, profiler=None, repeated_copy=False
+    ):
         """
         Helper function of extract.
         Extracts the value from the row according to the source definition on the schema field and the provided path.
@@ -268,10 +523,30 @@ class SchemaField(object):
         :param should_ensure_type: Should the types be casted into the output types?
         :param should_fire_exception:
             Pass in fn to check whether an exception should be fired. fn(row, path, exception) -> Boolean
+        :param profiler: (optional) a `profiler.ExtractionProfiler` that records time spent per field
+        :param repeated_copy: whether this is a per element copy of a REPEATED field (created via `replace`),
+            the field path of exceptions and the profile belong to the original field
         :return: Returns the value of this field extracted from the row
         """
+        if profiler is not None and profiler.current_field is not self:
+            return profiler.profile_field(
+                self, row, path, should_ensure_type, should_fire_exception, repeated_copy=repeated_copy
+            )
+
         try:
-            missing_token = _MissingToken()
+            if self._getter is not None:
+                # fast path for plain fields with a static source path: no path building required
+                if path:
+                    value = _nest.get(obj=row, path=path, default=_MISSING)
+                    if value is not _MISSING:
+                        value = self._getter(value)
+                else:
+                    value = self._getter(row)
+                if value is _MISSING:
+                    value = None
+                if should_ensure_type:
+                    value = self._caster(value)
+                return value
 
             source_path = self._create_source_path(path=path, row=row)
 
@@ -280,7 +555,7 @@ class SchemaField(object):
 
             if self.mode == FieldMode.REPEATED:
                 return self._extract_inner_repeated(
-                    row, source_path, should_ensure_type, should_fire_exception
+                    row, source_path, should_ensure_type, should_fire_exception, profiler
                 )
 
             if self.field_type == FieldType.STRUCT:
@@ -290,18 +565,23 @@ class SchemaField(object):
                         path=source_path,
                         should_ensure_type=should_ensure_type,
                         should_fire_exception=should_fire_exception,
+                        profiler=profiler,
                     )
                     for field in self.fields
                 }
             else:
-                value = _nest.get(obj=row, path=source_path, default=missing_token)
-                if value == missing_token:
+                value = _nest.get(obj=row, path=source_path, default=_MISSING)
+                if value is _MISSING:
                     value = None
                 if should_ensure_type:
-                    value = self._ensure_type(value=value)
+                    value = self._caster(value)
 
             return value
         except Exception as exception:
+            if profiler is not None:
+                profiler.record_exception(self)
+            if not repeated_copy:
+                _annotate_field_path(exception, self.name)
             if should_fire_exception:
                 should_fire = should_fire_exception(row, path, exception)
                 if should_fire:
@@ -310,24 +590,24 @@ class SchemaField(object):
                 raise
 
     def _create_source_path(self, path, row):
-        if self.source_path is not None:
-            if len(self.source_path) and self.source_path[0] == SourcePathElements.ROOT:
-                source_path = self.source_path[1:]
-
-                # replace LIST_INDEX elements in source path, if they follow the same path!
-                for idx, (source_path_item, path_item) in enumerate(
-                    list(zip(source_path, path))
-                ):
-                    if source_path_item == path:
-                        continue
-                    if source_path_item == SourcePathElements.LIST_INDEX:
-                        source_path[idx] = path_item
-                    if source_path_item != path_item:
-                        break
-            else:
-                source_path = path + self.source_path
+        if self._is_absolute_path:
+            source_path = list(self._relative_path)
+
+            # replace LIST_INDEX elements in source path, if they follow the same path!
+            for idx, (source_path_item, path_item) in enumerate(
+                list(zip(source_path, path))
+            ):
+                if source_path_item == path:
+                    continue
+                if source_path_item == SourcePathElements.LIST_INDEX:
+                    source_path[idx] = path_item
+                if source_path_item != path_item:
+                    break
         else:
-            source_path = path + [self.name]
+            source_path = path + list(self._relative_path)
+
+        if not self._has_path_fns:
+            return source_path
 
         path_so_far = []
         for element in source_path:
@@ -339,7 +619,7 @@ class SchemaField(object):
         return path_so_far
 
     def _extract_inner_repeated(
-        self, row, source_path, should_ensure_type, should_fire_exception
+        self, row, source_path, should_ensure_type, should_fire_exception, profiler=None
     ):
         if SourcePathElements.LIST_INDEX in source_path:
             # if there is a LIST_INDEX value in the path,
@@ -360,6 +640,8 @@ class SchemaField(object):
                         path=path_to + [idx],
                         should_ensure_type=should_ensure_type,
                         should_fire_exception=should_fire_exception,
+                        profiler=profiler,
+                        repeated_copy=True,
                     )
                 return next_inner_list
             else:
@@ -374,6 +656,8 @@ class SchemaField(object):
                             path=path_to + [idx],
                             should_ensure_type=should_ensure_type,
                             should_fire_exception=should_fire_exception,
+                            profiler=profiler,
+                            repeated_copy=True,
                         )
                     )
                 return next_inner_list
@@ -390,6 +674,7 @@ class SchemaField(object):
                         path=source_path + [idx],
                         should_ensure_type=should_ensure_type,
                         should_fire_exception=should_fire_exception,
+                        profiler=profiler,
                     )
                     for field in self.fields
                 }
@@ -399,7 +684,7 @@ class SchemaField(object):
             value = []
             for idx, inner_value in enumerate(inner_list):
                 if should_ensure_type:
-                    value.append(self._ensure_type(value=inner_value))
+                    value.append(self._caster(inner_value))
                 else:
                     value.append(inner_value)
         return value
@@ -411,49 +696,7 @@ class SchemaField(object):
         :param value: Input value that should be checked and casted
         :return: A type-casted value that BigQuery should be able to read it
         """
-        if isinstance(value, float) and self.field_type == FieldType.NUMERIC:
-            value = str(round(value, 8))
-
-        if isinstance(value, int) and self.field_type == FieldType.BOOLEAN:
-            value = value != 0
-
-        if isinstance(value, str) and self.field_type == FieldType.BOOLEAN:
-            value = _strtobool(value)
-
-        if isinstance(value, _datetime.datetime) and self.field_type == FieldType.DATE:
-            value = value.date()
-
-        if isinstance(value, str) and self.field_type == FieldType.DATE:
-            match = _re.match(r"(\d{4})-(\d\d)-(\d\d)", value)
-            value = _datetime.date(
-                int(match.group(1)), int(match.group(2)), int(match.group(3))
-            )
-
-        if (
-            not isinstance(value, str)
-            and value is not None
-            and self.field_type == FieldType.STRING
-        ):
-            value = str(value)
-
-        if self.field_type == FieldType.INTEGER and value is not None:
-            value = int(value)
-
-        if self.field_type == FieldType.FLOAT and value is not None:
-            value = float(value)
-
-        if self.field_type == FieldType.DATE and isinstance(value, int):
-            value = _datetime.datetime.fromtimestamp(value).date()
-
-        if (
-            self.field_type == FieldType.DATETIME
-            or self.field_type == FieldType.TIMESTAMP
-        ) and isinstance(value, int):
-            value = _datetime.datetime.fromtimestamp(value, _datetime.timezone.utc).replace(
-                tzinfo=None
-            )
-
-        return value
+        return self._caster(value)
 
     def replace(
         self,
@@ -475,15 +718,39 @@ class SchemaField(object):
         :param fields: If the field_type is RECORD you can specify fields for the "sub document" of the record
         :param mode: pick from NULLABLE, REQUIRED, REPEATED (view bigquery docs for meaning)
         """
-        return SchemaField(
-            name=name if name is not None else self.name,
-            field_type=field_type if field_type is not None else self.field_type,
-            description=description if description is not None else self.description,
-            source_path=source_path if source_path is not None else self.source_path,
-            source_fn=source_fn if source_fn is not None else self.source_fn,
-            fields=fields if fields is not None else self.fields,
-            mode=mode if mode is not None else self.mode,
-        )
+        # replace is called for every list element during the extraction of REPEATED fields,
+        # therefore the copies are memoized (in a bounded cache) instead of being rebuilt every time
+        try:
+            cache_key = (
+                name,
+                field_type,
+                description,
+                None if source_path is None else tuple(source_path),
+                source_fn,
+                None if fields is None else tuple(fields),
+                mode,
+            )
+            replaced = self._replace_cache.get(cache_key) if self._replace_cache else None
+        except TypeError:  # unhashable path elements
+            cache_key = None
+            replaced = None
+
+        if replaced is None:
+            replaced = SchemaField(
+                name=name if name is not None else self.name,
+                field_type=field_type if field_type is not None else self.field_type,
+                description=description if description is not None else self.description,
+                source_path=source_path if source_path is not None else self.source_path,
+                source_fn=source_fn if source_fn is not None else self.source_fn,
+                fields=fields if fields is not None else self.fields,
+                mode=mode if mode is not None else self.mode,
+            )
+            if cache_key is not None:
+                if self._replace_cache is None or len(self._replace_cache) >= _REPLACE_CACHE_SIZE:
+                    super().__setattr__("_replace_cache", {})
+                self._replace_cache[cache_key] = replaced
+
+        return replaced
 
 
 def create_view(name: str, query: str, options: Options, description: str = None):
@@ -495,6 +762,8 @@ def create_view(name: str, query: str, options: Options, description: str = None
     :param query: The SQL query that specifies the content of the view
     :param options: The access config object that defines project_id and other common parameters
     """
+    from google.cloud import bigquery as _bigquery
+
     bigquery = options.get_bigquery_client()
     view_ref = "{}.{}.{}".format(options.project_id, options.dataset_id, name)
 
@@ -544,6 +813,26 @@ def check_and_update_description(table, table_description, bigquery):
     return table
 
 
+def check_and_update_clustering(table, clustering_fields, bigquery):
+    """
+    Make sure the table is clustered by the given fields (None: leave the clustering untouched)
+    """
+    if clustering_fields is not None and list(table.clustering_fields or []) != list(clustering_fields):
+        table.clustering_fields = list(clustering_fields) or None
+        return bigquery.update_table(table=table, fields=["clustering_fields"])
+    return table
+
+
+def check_and_update_require_partition_filter(table, require_partition_filter, bigquery):
+    """
+    Make sure the partition filter requirement is up2date (None: leave it untouched)
+    """
+    if require_partition_filter is not None and bool(table.require_partition_filter) != require_partition_filter:
+        table.require_partition_filter = require_partition_filter
+        return bigquery.update_table(table=table, fields=["require_partition_filter"])
+    return table
+
+
 def check_and_update_external_config(table, external_config, bigquery):
     """
     update the external config
@@ -556,6 +845,27 @@ def check_and_update_external_config(table, external_config, bigquery):
     return table
 
 
+def schema_repr(bq_schema):
+    """
+    Comparable representation of a list of bigquery schema fields.
+    The ordering is NOT taken into account.
+    """
+    if not bq_schema:
+        return None
+
+    def field_type(f):
+        if f.field_type.upper() == "RECORD":
+            return "STRUCT"
+        return f.field_type.upper()
+
+    return sorted(
+        [
+            (f.name.upper(), field_type(f), f.mode.upper(), f.description, schema_repr(f.fields))
+            for f in bq_schema
+        ]
+    )
+
+
 def check_and_update_schema(table, schema, bigquery, auto_update_table_schema=True):
     """
     Make sure that the schema of table matches the one provided.
@@ -566,31 +876,7 @@ def check_and_update_schema(table, schema, bigquery, auto_update_table_schema=Tr
         return table
 
     bq_schema = None if schema is None else [f.to_bq_field() for f in schema]
-
-    def extra_schema_field_type(field_type):
-        if field_type == "RECORD":
-            return "STRUCT"
-        return field_type
-
-    def extract_schema_fields(schema):
-        if not schema:
-            return None
-        return sorted(
-            [
-                (
-                    f.name.upper(),
-                    extra_schema_field_type(f.field_type.upper()),
-                    f.mode.upper(),
-                    f.description,
-                    extract_schema_fields(f.fields),
-                )
-                for f in schema
-            ]
-        )
-
-    current_schema_repr = extract_schema_fields(table.schema)
-    new_schema_repr = extract_schema_fields(bq_schema)
-    schema_up2date = current_schema_repr == new_schema_repr
+    schema_up2date = schema_repr(table.schema) == schema_repr(bq_schema)
 
     if not schema_up2date:
         if auto_update_table_schema:
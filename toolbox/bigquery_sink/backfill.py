@@ -0,0 +1,273 @@
+"""
+Backfill many partitions of a table concurrently, with retries, progress reporting and resume
+"""
+
+import concurrent.futures as _futures
+import datetime as _datetime
+import os as _os
+import threading as _threading
+import time as _time
+import typing as _typing
+
+from google.api_core import exceptions as _exceptions
+from google.cloud import bigquery as _bigquery
+
+from toolbox import bigquery_sink as _bigquery_sink
+from toolbox.bigquery_sink import bulk_sink as _bulk_sink
+
+_RANGE = "RANGE"
+
+
+def _partition_type(table_partitioning):
+    """
+    :return: HOUR, DAY, MONTH or YEAR (see `bigquery.TimePartitioningType`) or "RANGE" (DAY if not partitioned)
+    """
+    if not table_partitioning:
+        return _bigquery.TimePartitioningType.DAY
+    if table_partitioning["type"] == "range_partitioning":
+        return _RANGE
+    return table_partitioning["definition"].type_ or _bigquery.TimePartitioningType.DAY
+
+
+def _partition_start(value, table_partitioning):
+    """
+    :return: the start of the partition that contains `value`
+    """
+    partition_type = _partition_type(table_partitioning)
+    if partition_type == _RANGE:
+        range_ = table_partitioning["definition"].range_
+        value = max(int(value), range_.start)
+        return range_.start + (value - range_.start) // range_.interval * range_.interval
+    if partition_type == _bigquery.TimePartitioningType.HOUR:
+        if not isinstance(value, _datetime.datetime):
+            value = _datetime.datetime(value.year, value.month, value.day)
+        return value.replace(minute=0, second=0, microsecond=0)
+    if isinstance(value, _datetime.datetime):
+        value = value.date()
+    if partition_type == _bigquery.TimePartitioningType.MONTH:
+        return value.replace(day=1)
+    if partition_type == _bigquery.TimePartitioningType.YEAR:
+        return value.replace(month=1, day=1)
+    return value
+
+
+def partition_end(partition, table_partitioning: dict = None):
+    """
+    :param partition: the start of a partition (see `partition_dates`)
+    :param table_partitioning: (optional) the partitioning of the table, default: DAY
+    :return: the start of the next partition (exclusive end of `partition`)
+    """
+    partition_type = _partition_type(table_partitioning)
+    if partition_type == _RANGE:
+        return partition + table_partitioning["definition"].range_.interval
+    if partition_type == _bigquery.TimePartitioningType.HOUR:
+        return partition + _datetime.timedelta(hours=1)
+    if partition_type == _bigquery.TimePartitioningType.MONTH:
+        return _datetime.date(partition.year + partition.month // 12, partition.month % 12 + 1, 1)
+    if partition_type == _bigquery.TimePartitioningType.YEAR:
+        return _datetime.date(partition.year + 1, 1, 1)
+    return partition + _datetime.timedelta(days=1)
+
+
+def partition_dates(start_date, end_date, table_partitioning: dict = None) -> list:
+    """
+    :param start_date: a date (datetime for HOUR partitioning, integer for integer range partitioning)
+    :param end_date: like `start_date`, a date includes all hours of the day for HOUR partitioning
+    :param table_partitioning: (optional) the partitioning of the table
+        (see `bulk_sink.create_table_time_partitioning`, `bulk_sink.create_table_range_partitioning`), default: DAY
+    :return: the starts of all partitions from the one of `start_date` to the one of `end_date` (both inclusive):
+        days, hours, first days of months / years or the starts of the integer ranges
+    """
+    partition_type = _partition_type(table_partitioning)
+    if partition_type == _bigquery.TimePartitioningType.HOUR and not isinstance(end_date, _datetime.datetime):
+        end_date = _datetime.datetime(end_date.year, end_date.month, end_date.day, 23)
+    start, end = _partition_start(start_date, table_partitioning), _partition_start(end_date, table_partitioning)
+    if end < start:
+        raise ValueError("end_date must not be before start_date")
+    if partition_type == _RANGE:
+        end = min(end, table_partitioning["definition"].range_.end - 1)
+
+    partitions = []
+    partition = start
+    while partition <= end:
+        partitions.append(partition)
+        partition = partition_end(partition, table_partitioning)
+    return partitions
+
+
+def _existing_partitioning(options, table_id):
+    """
+    :return: the partitioning of the existing table in the format of `bulk_sink.create_table_time_partitioning`
+        (None if the table does not exist or is not partitioned)
+    """
+    try:
+        table = options.get_bigquery_client().get_table(
+            "{}.{}.{}".format(options.project_id, options.dataset_id, table_id)
+        )
+    except _exceptions.NotFound:
+        return None
+    if table.time_partitioning is not None:
+        return {"type": "time_partitioning", "definition": table.time_partitioning}
+    if table.range_partitioning is not None:
+        return {"type": "range_partitioning", "definition": table.range_partitioning}
+    return None
+
+
+def _state_key(partition):
+    return partition.isoformat() if hasattr(partition, "isoformat") else str(partition)
+
+
+class BackfillSummary(object):
+    def __init__(self, partitions):
+        self.partitions = list(partitions)
+        self.completed = {}  # partition start -> rows written
+        self.skipped = []  # partitions completed by an earlier run (see `state_path`)
+        self.failed = {}  # partition start -> exception of the last attempt
+        self.attempts = {}  # partition start -> number of attempts
+
+    @property
+    def done(self):
+        return len(self.completed) + len(self.skipped) + len(self.failed)
+
+    @property
+    def total(self):
+        return len(self.partitions)
+
+    def raise_for_errors(self):
+        if self.failed:
+            partition, error = sorted(self.failed.items())[0]
+            raise RuntimeError(
+                "Backfill of {} partition(s) failed, e.g. {}: {}".format(len(self.failed), partition, error)
+            ) from error
+
+    def __str__(self):
+        lines = [
+            "{}/{} partitions: completed {} ({} rows), skipped {}, failed {}".format(
+                self.done,
+                self.total,
+                len(self.completed),
+                sum(rows or 0 for rows in self.completed.values()),
+                len(self.skipped),
+                len(self.failed),
+            )
+        ]
+        lines += ["  failed {}: {}".format(partition, error) for partition, error in sorted(self.failed.items())]
+        return "\n".join(lines)
+
+
+def _read_state(state_path):
+    if not state_path or not _os.path.exists(state_path):
+        return set()
+    with open(state_path, "r", encoding="utf-8") as file_obj:
+        return {line.strip() for line in file_obj if line.strip()}
+
+
+def backfill(
+    table_id: str,
+    options: _bigquery_sink.Options,
+    start_date: _datetime.date,
+    end_date: _datetime.date,
+    query_template: str = None,
+    rows_fn: _typing.Callable[[_typing.Any], _typing.Iterable] = None,
+    parallelism: int = 8,
+    retries: int = 2,
+    retry_wait_s: float = 5.0,
+    state_path: str = None,
+    progress_fn: _typing.Callable[[BackfillSummary], None] = None,
+    **sink_kwargs
+) -> BackfillSummary:
+    """
+    (Re-)write the partitions from `start_date` to `end_date`, each one through the partition decorator
+    (e.g. `table$YYYYMMDD`) of its own `bulk_sink.BQBulkSink` (WriteDisposition.REPLACE unless given otherwise).
+    The partitions follow the partitioning of the table (`table_partitioning`, else the one of the existing table,
+    else DAY): one per hour, day, month, year or integer range.
+    The table is created and its metadata (labels, schema, description, ...) updated once up front,
+    then up to `parallelism` partitions are written concurrently without touching the metadata.
+
+    Failures do not stop the backfill of other partitions, they are reported in the summary
+    (see `BackfillSummary.raise_for_errors`).
+
+    :param table_id: the (partitioned) table
+    :param options: the access config object, all partitions share its clients
+    :param start_date: a value of the first partition (see `partition_dates`)
+    :param end_date: a value of the last partition (inclusive)
+    :param query_template: the query of a partition, formatted with `partition_date` (its start, e.g. "2020-01-31"),
+        `partition_end` (the start of the next partition) and `partition_suffix` (the partition decorator, e.g.
+        "20200131"), e.g. "SELECT * FROM src WHERE day >= '{partition_date}' AND day < '{partition_end}'"
+    :param rows_fn: alternative to `query_template`: fn(partition start) -> the (extracted) rows of the partition
+    :param parallelism: maximal number of partitions written concurrently
+    :param retries: number of retries of a failed partition
+    :param retry_wait_s: wait before the first retry, doubled for every further retry
+    :param state_path: (optional) file that records the completed partitions, they are skipped when the
+        backfill is started again (resume)
+    :param progress_fn: (optional) fn(summary) called after every finished partition
+    :param sink_kwargs: further arguments of `BQBulkSink`, e.g. schema, table_partitioning (required to create the table)
+    :return: the summary of the backfill
+    """
+    if (query_template is None) == (rows_fn is None):
+        raise ValueError("Provide either query_template or rows_fn")
+    if parallelism < 1:
+        raise ValueError("parallelism must be >= 1")
+    sink_kwargs.setdefault("write_disposition", _bulk_sink.WriteDisposition.REPLACE)
+
+    if sink_kwargs.get("table_partitioning") is None:
+        sink_kwargs["table_partitioning"] = _existing_partitioning(options, table_id)
+    table_partitioning = sink_kwargs["table_partitioning"]
+
+    summary = BackfillSummary(partition_dates(start_date, end_date, table_partitioning=table_partitioning))
+    completed_before = _read_state(state_path)
+    summary.skipped = [partition for partition in summary.partitions if _state_key(partition) in completed_before]
+    pending = [partition for partition in summary.partitions if _state_key(partition) not in completed_before]
+    if not pending:
+        return summary
+
+    table_sink = _bulk_sink.BQBulkSink(table_id=table_id, options=options, **sink_kwargs)
+    table_sink._create_bq_dataset(exists_ok=True)
+    table_sink._create_bq_table(exists_ok=True)  # once, instead of one (racing) create per partition
+    # the metadata is reconciled once above: concurrent updates per partition hit the rate limit of bigquery
+    partition_kwargs = dict(sink_kwargs, update_table_metadata=False)
+
+    lock = _threading.Lock()
+
+    def write_partition(partition):
+        sink = _bulk_sink.BQBulkSink(
+            table_id=table_id, options=options, table_partition_date=partition, **partition_kwargs
+        )
+        if query_template is not None:
+            sink.from_query(
+                query=query_template.format(
+                    partition_date=_state_key(partition),
+                    partition_end=_state_key(partition_end(partition, table_partitioning)),
+                    partition_suffix=sink._partition_table_ref("").lstrip("$"),
+                )
+            )
+            return sink.rows_written
+        return sink.from_iterable(rows_fn(partition))
+
+    def run(partition):
+        for attempt in range(retries + 1):
+            with lock:
+                summary.attempts[partition] = attempt + 1
+            try:
+                return write_partition(partition)
+            except Exception:
+                if attempt == retries:
+                    raise
+                _time.sleep(retry_wait_s * 2 ** attempt)
+
+    with _futures.ThreadPoolExecutor(max_workers=parallelism) as executor:
+        futures = {executor.submit(run, partition): partition for partition in pending}
+        for future in _futures.as_completed(futures):
+            partition = futures[future]
+            try:
+                summary.completed[partition] = future.result()
+            except Exception as error:
+                summary.failed[partition] = error
+            else:
+                if state_path:
+                    with open(state_path, "a", encoding="utf-8") as file_obj:
+                        file_obj.write(_state_key(partition) + "\n")
+            if progress_fn is not None:
+                progress_fn(summary)
+
+    return summary
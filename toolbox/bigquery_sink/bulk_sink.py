@@ -6,28 +6,126 @@ import tempfile as _tempfile
 import contextlib as _contextlib
 import enum as _enum
 import gzip as _gzip
+import hashlib as _hashlib
+import io as _io
+import os as _os
+import time as _time
 import typing as _typing
 
+from google.api_core import exceptions as _exceptions
 from google.cloud import bigquery as _bigquery
 
+from toolbox.bigquery_sink.utils import dedup as _dedup
 from toolbox.bigquery_sink.utils import generate_id as _generate_id
 from toolbox import bigquery_sink as _bigquery_sink
+from toolbox.bigquery_sink import column_stats as _column_stats
+from toolbox.bigquery_sink import compression as _compression
+from toolbox.bigquery_sink import dead_letter as _dead_letter
+from toolbox.bigquery_sink import file_reader as _file_reader
+from toolbox.bigquery_sink import pipeline as _pipeline
+from toolbox.bigquery_sink import stats as _stats
+from toolbox.bigquery_sink import validation as _validation
+
+
+# label on tables written with `from_query(..., skip_if_unchanged=True)` that identifies the query
+QUERY_HASH_LABEL = "bqsink_query_hash"
+# label next to the query hash: latest modification time (epoch ms) of the input tables before the query was submitted
+INPUTS_MODIFIED_LABEL = "bqsink_inputs_modified"
+_LINEAGE_LABELS = (QUERY_HASH_LABEL, INPUTS_MODIFIED_LABEL)
+
+
+# format of the partition decorators per time partitioning type, e.g. "table$2020013115" for HOUR
+_PARTITION_DECORATOR_FORMATS = {
+    _bigquery.TimePartitioningType.HOUR: "%Y%m%d%H",
+    _bigquery.TimePartitioningType.DAY: "%Y%m%d",
+    _bigquery.TimePartitioningType.MONTH: "%Y%m",
+    _bigquery.TimePartitioningType.YEAR: "%Y",
+}
 
 
 def create_table_date_partitioning(field, expiration_ms=None):
     """
     Utility function to create date(time) partitioned tables
     """
+    return create_table_time_partitioning(field=field, expiration_ms=expiration_ms)
+
+
+def create_table_time_partitioning(field, partition_type=_bigquery.TimePartitioningType.DAY, expiration_ms=None):
+    """
+    Utility function to create time partitioned tables
+    :param field: the DATE, TIMESTAMP or DATETIME column (None: ingestion time)
+    :param partition_type: HOUR, DAY, MONTH or YEAR (see `bigquery.TimePartitioningType`)
+    :param expiration_ms: (optional) partitions are deleted after this time
+    """
+    if partition_type not in _PARTITION_DECORATOR_FORMATS:
+        raise ValueError(
+            "Unknown partition type {}, use one of {}".format(partition_type, list(_PARTITION_DECORATOR_FORMATS))
+        )
     return {
         "type": "time_partitioning",
         "definition": _bigquery.TimePartitioning(
-            type_=_bigquery.TimePartitioningType.DAY,
+            type_=partition_type,
             field=field,
             expiration_ms=expiration_ms,
         ),
     }
 
 
+def create_table_range_partitioning(field, start, end, interval):
+    """
+    Utility function to create integer range partitioned tables
+    :param field: the INTEGER column
+    :param start: start of the first partition (inclusive)
+    :param end: end of the last partition (exclusive)
+    :param interval: width of each partition
+    """
+    return {
+        "type": "range_partitioning",
+        "definition": _bigquery.RangePartitioning(
+            field=field,
+            range_=_bigquery.PartitionRange(start=start, end=end, interval=interval),
+        ),
+    }
+
+
+def _partitioning_repr(table):
+    """
+    Comparable representation of the partitioning of a table (None if it is not partitioned)
+    """
+    if table.time_partitioning is not None:
+        partitioning = table.time_partitioning
+        return ("time", partitioning.type_ or _bigquery.TimePartitioningType.DAY, partitioning.field)
+    if table.range_partitioning is not None:
+        partitioning = table.range_partitioning
+        return (
+            "range",
+            partitioning.field,
+            partitioning.range_.start,
+            partitioning.range_.end,
+            partitioning.range_.interval,
+        )
+    return None
+
+
+def _copied_rows(copy_job):
+    """
+    :return: the number of rows copied by a finished copy job (statistics.copy.copiedRows), None if not reported
+    """
+    # google-cloud-bigquery has no public accessor for the copy statistics (a `CopyJob` only exposes its
+    # configuration): the private job resource is read here and nowhere else, callers handle None
+    statistics = getattr(copy_job, "_properties", None) or {}
+    copied_rows = statistics.get("statistics", {}).get("copy", {}).get("copiedRows")
+    return None if copied_rows is None else int(copied_rows)
+
+
+def _query_hash(query):
+    return _hashlib.sha1(query.encode("utf-8")).hexdigest()[:16]
+
+
+def _epoch_ms(timestamp):
+    return int(round(timestamp.timestamp() * 1000))
+
+
 class WriteDisposition(_enum.Enum):
     """
     Allows controlling whether table should be appended/overwritten/only written to if empty
@@ -35,11 +133,47 @@ class WriteDisposition(_enum.Enum):
     APPEND: append to the table (creates table if it does not exist)
     IF_EMPTY: will only write if the table is empty (or does not exist)
     REPLACE: replaces table content in atomic operation
+    UPSERT: updates rows with matching `upsert_keys` and inserts the others (loads into a staging table and runs a MERGE)
     """
 
     APPEND = _bigquery.WriteDisposition.WRITE_APPEND
     IF_EMPTY = _bigquery.WriteDisposition.WRITE_EMPTY
     REPLACE = _bigquery.WriteDisposition.WRITE_TRUNCATE
+    UPSERT = "UPSERT"
+
+
+def build_merge_query(target_table_ref, source, keys, columns, partition_filter=None):
+    """
+    Create a MERGE statement that updates rows of the target with matching keys and inserts the others
+    :param target_table_ref: "project.dataset.table" of the target (alias T)
+    :param source: "project.dataset.table" of the source table, or a sql query in parentheses (alias S)
+    :param keys: the column names that identify a row
+    :param columns: all column names that should be written
+    :param partition_filter: (optional) sql condition on T, allows bigquery to prune partitions of the target.
+        It is part of the ON clause: target rows outside of the filter never match, a source row with the key
+        of such a row is inserted as a second row. The filter has to cover all rows the keys of the source can match.
+    :return: the MERGE statement
+    """
+    if not source.startswith("("):
+        source = "`{}`".format(source)
+
+    conditions = ["T.`{0}` = S.`{0}`".format(key) for key in keys]
+    if partition_filter:
+        conditions.append("({})".format(partition_filter))
+
+    update_columns = [column for column in columns if column not in keys]
+    query = "MERGE `{target}` T\nUSING {source} S\nON {conditions}\n".format(
+        target=target_table_ref, source=source, conditions=" AND ".join(conditions),
+    )
+    if update_columns:
+        query += "WHEN MATCHED THEN\n  UPDATE SET {}\n".format(
+            ", ".join("`{0}` = S.`{0}`".format(column) for column in update_columns)
+        )
+    query += "WHEN NOT MATCHED THEN\n  INSERT ({}) VALUES ({})".format(
+        ", ".join("`{}`".format(column) for column in columns),
+        ", ".join("S.`{}`".format(column) for column in columns),
+    )
+    return query
 
 
 class BQBulkSink(object):
@@ -57,19 +191,53 @@ class BQBulkSink(object):
         schema: _typing.List[_bigquery_sink.SchemaField] = None,
         write_disposition: WriteDisposition = WriteDisposition.IF_EMPTY,
         auto_update_table_schema: bool = False,
-        compressed_upload: bool = False,
+        compressed_upload: _typing.Union[bool, str] = False,
+        metrics_hooks: _typing.List[_stats.metrics_hook_type] = None,
+        upsert_keys: _typing.List[str] = None,
+        upsert_partition_filter: str = None,
+        validate_rows: bool = False,
+        dead_letter_path: str = None,
+        dead_letter_max_rows: int = None,
+        dead_letter_sample_rate: float = 1.0,
+        spool=None,
+        dedup_key: _typing.Union[_typing.List[str], _typing.Callable[[dict], _typing.Any]] = None,
+        dedup_memory_bytes: int = 64 * 1024 * 1024,
+        dedup_bloom_capacity: int = 10000000,
+        dedup_bloom_error_rate: float = 0.001,
+        collect_column_stats: bool = False,
+        clustering_fields: _typing.List[str] = None,
+        require_partition_filter: bool = None,
+        bq_client_scopes: _typing.List[str] = None,
+        update_table_metadata: bool = True,
     ):
         """
         :param table_id: the table id where the data should be stored. This should not contain project_id or dataset_id
         :param dataset_id: the dataset id where the destination table is located, you can overwrite the dataset_id provided from the options
         :param project_id: the project id where the destination table is located, you can overwrite the project_id provided from the options
-        :param table_partitioning: BigQuery table partitioning information, use `create_table_date_partitioning` method to create correct values
-        :param table_partition_date: If you want to (over-) write a specific partition, you can specify a date(time) object. This only works for date partitioned tables. If you pass in a datetime object, it will still replace the entire DATE partition.
+        :param table_partitioning: BigQuery table partitioning information, use `create_table_date_partitioning`, `create_table_time_partitioning` or `create_table_range_partitioning` to create correct values. The partitioning of existing tables can not be changed (ValueError).
+        :param table_partition_date: If you want to (over-) write a specific partition, you can specify a date(time) object (for integer range partitioned tables: the start of the range). The partition decorator follows the partitioning type, e.g. if you pass in a datetime object for a DAY partitioned table, it will still replace the entire DATE partition.
         :param table_description: You can provide a description of the table.
         :param schema: The schema of the table
         :param write_disposition: Specify whether you want to only write if the table is empty or append or replace table content
         :param auto_update_table_schema: Should the schema be automatically updated when uploading content?
-        :param compressed_upload: Allows compression upload to BigQuery via GZIP, if data volume is a concern. Generally this is slower than uncompressed uploads to BigQuery
+        :param compressed_upload: Allows compression upload to BigQuery via GZIP, if data volume is a concern. Generally this is slower than uncompressed uploads to BigQuery. `compression.AUTO` chooses uncompressed or a gzip level per load from the measured compression speed and upload bandwidth
+        :param metrics_hooks: Functions fn(metric_name, value, tags) that receive the metrics of `self.stats` after each load, e.g. to forward them to prometheus / statsd
+        :param upsert_keys: For WriteDisposition.UPSERT: the fields that identify a row. Rows in a batch must be unique per key.
+        :param upsert_partition_filter: For WriteDisposition.UPSERT: (optional) sql condition on the target table (alias T) to let bigquery prune partitions, e.g. "T.day >= '2020-01-01'". Rows outside of the filter are not matched, so it has to include every row a key of the batch can match (see `build_merge_query`)
+        :param validate_rows: Check the rows written through `open` / `from_iterable` against the schema (types, modes, size) before they are uploaded, invalid rows are written into the dead letter file instead of failing the load job
+        :param dead_letter_path: (optional) file for the rejected rows (default: a new temp file per load, which is kept for the caller: remove it with `self.dead_letters.remove()`), see `self.dead_letters`
+        :param dead_letter_max_rows: (optional) maximal number of rejected rows stored in the dead letter file (all are counted)
+        :param dead_letter_sample_rate: fraction of the rejected rows that are stored in the dead letter file
+        :param spool: (optional) a `coalesce.ChunkSpool`: `open` / `from_*` drop their file into the spool instead of loading it, a `coalesce.Coalescer` loads the chunks of many writers with few load jobs (only WriteDisposition.APPEND)
+        :param dedup_key: (optional) field names or fn(extracted row) -> key: rows written through `open` / `from_iterable` with a key that was already written in the same load are dropped (counted as rows_duplicate)
+        :param dedup_memory_bytes: For dedup_key: memory budget of the exact key set, beyond it a Bloom filter is used (it may drop rare false duplicates, counted as rows_duplicate_probable)
+        :param dedup_bloom_capacity: For dedup_key: expected number of keys of the Bloom filter
+        :param dedup_bloom_error_rate: For dedup_key: false positive rate of the Bloom filter at its capacity
+        :param collect_column_stats: Collect statistics per field (nulls, min / max, approximate distinct values) and the touched partitions of the rows written through `open` / `from_iterable`, see `self.column_stats`
+        :param clustering_fields: (optional) up to four columns the table is clustered by, applied on creation and updated on existing tables
+        :param require_partition_filter: (optional) whether queries on the (partitioned) table must filter on the partition column, applied on creation and updated on existing tables
+        :param bq_client_scopes: (optional) scopes of the bigquery client instead of the ones of the options, e.g. to query external tables of google sheets (see `sheet_sink.SHEET_SCOPES`)
+        :param update_table_metadata: Whether labels, schema, description, clustering and require_partition_filter of the table are brought up2date with every write. Disable it for many concurrent writes into the same table (e.g. the partitions of a backfill) after updating it once: bigquery limits the metadata updates per table to a few per 10 seconds
         """
 
         self.options = options
@@ -82,6 +250,9 @@ class BQBulkSink(object):
         self.table_partitioning = table_partitioning
         self.table_partition_date = table_partition_date
         self.table_description = table_description
+        self.clustering_fields = list(clustering_fields) if clustering_fields else None
+        self.require_partition_filter = require_partition_filter
+        self.update_table_metadata = update_table_metadata
         self.schema = schema
         self.bq_schema = (
             None if self.schema is None else [f.to_bq_field() for f in self.schema]
@@ -90,14 +261,47 @@ class BQBulkSink(object):
         self.write_disposition = write_disposition.value
         self.auto_update_table_schema = auto_update_table_schema
         self.bq_location = options.bq_location or "US"
-        self.bigquery = options.get_bigquery_client()
+        self.bigquery = options.get_bigquery_client(scopes=bq_client_scopes)
         self.storage = options.get_storage_client()
         self.temp_bucket_name = options.temp_bucket_name
         self.temp_bucket_root_path = options.temp_bucket_root_path
         self.now = options.now or _datetime.datetime.now(_datetime.timezone.utc).replace(tzinfo=None)
         self.correlation_id = options.correlation_id
         self.compressed_upload = compressed_upload
+        self._compression_profile = None  # see `_choose_compression_level`
+        self.metrics_hooks = metrics_hooks or []
+        self.upsert_keys = upsert_keys
+        self.upsert_partition_filter = upsert_partition_filter
+        if validate_rows and not schema:
+            raise ValueError("validate_rows requires a schema")
+        self.validator = _validation.RowValidator(schema=schema) if validate_rows else None
+        self.dead_letter_path = dead_letter_path
+        self.dead_letter_max_rows = dead_letter_max_rows
+        self.dead_letter_sample_rate = dead_letter_sample_rate
+        self.dead_letters = None  # `dead_letter.DeadLetterSpool` of the last load (if rows were rejected)
+        if write_disposition == WriteDisposition.UPSERT:
+            if not upsert_keys or not schema:
+                raise ValueError("WriteDisposition.UPSERT requires upsert_keys and a schema")
+            if table_partition_date is not None:
+                raise ValueError("WriteDisposition.UPSERT can not be combined with table_partition_date")
+        if spool is not None:
+            if write_disposition != WriteDisposition.APPEND:
+                raise ValueError("A spool requires WriteDisposition.APPEND")
+            if table_partition_date is not None:
+                raise ValueError("A spool can not be combined with table_partition_date")
+        self.spool = spool
+        self.dedup_key = dedup_key
+        self._dedup_key_fn = None if dedup_key is None else _dedup.key_encoder(dedup_key)
+        self.dedup_memory_bytes = dedup_memory_bytes
+        self.dedup_bloom_capacity = dedup_bloom_capacity
+        self.dedup_bloom_error_rate = dedup_bloom_error_rate
+        if collect_column_stats and not schema:
+            raise ValueError("collect_column_stats requires a schema")
+        self.collect_column_stats = collect_column_stats
+        self.column_stats = None  # `column_stats.ColumnStatsCollector` of the last load
         self.rows_written = 0
+        self.stats = _stats.SinkStats()  # stats of the last load
+        self.lineage = {}  # input tables -> modification time, see `_query_is_unchanged`
 
     @_contextlib.contextmanager
     def open(self):
@@ -109,29 +313,231 @@ class BQBulkSink(object):
         3.2) loads bq table from google storage (and ensures that dataset & table exist in bq)
         :return: None
         """
-        with _tempfile.TemporaryFile() as tmp_file:
-            if self.compressed_upload:
-                gzip_file = _gzip.GzipFile(mode='wb', fileobj=tmp_file, compresslevel=9)
+        clock = _time.perf_counter
+        rows = 0
+        validated = 0  # rows checked by the validator (rows rejected by the extraction never get there)
+        encode_s = 0.0
+        validate_s = 0.0
+        dedup_s = 0.0
+        column_stats_s = 0.0
+        validator = self.validator
+        self.dead_letters = None
+        column_stats = self.column_stats = None
+        if self.collect_column_stats:
+            column_stats = self.column_stats = _column_stats.ColumnStatsCollector(
+                schema=self.schema, partition_id_fn=self._partition_id_fn()
+            )
+        dedup_key_fn = self._dedup_key_fn
+        deduplicator = None
+        if dedup_key_fn is not None:
+            deduplicator = _dedup.Deduplicator(
+                memory_bytes=self.dedup_memory_bytes,
+                bloom_capacity=self.dedup_bloom_capacity,
+                bloom_error_rate=self.dedup_bloom_error_rate,
+            )
 
-                def __write(row):
-                    to_write = _json.dumps(row, default=self._json_default_fn) + "\n"
-                    gzip_file.write(to_write.encode("utf-8"))
+        try:
+            with self._open_raw() as write_raw:
 
-                yield __write
-                gzip_file.close()
-            else:
                 def __write(row):
-                    to_write = _json.dumps(row, default=self._json_default_fn) + "\n"
-                    tmp_file.write(to_write.encode("utf-8"))
+                    nonlocal rows, validated, encode_s, validate_s, dedup_s, column_stats_s
+                    if deduplicator is not None:
+                        start = clock()
+                        key = dedup_key_fn(row)
+                        is_duplicate = deduplicator.is_duplicate(key)
+                        dedup_s += clock() - start
+                        if is_duplicate:
+                            return
+                    start = clock()
+                    to_write = (_json.dumps(row, default=self._json_default_fn) + "\n").encode("utf-8")
+                    encoded = clock()
+                    encode_s += encoded - start
+                    if validator is not None:
+                        problems = validator.validate(row, encoded_size=len(to_write))
+                        validate_s += clock() - encoded
+                        validated += 1
+                        if problems:
+                            self._reject(
+                                offset=rows + self._rejected_rows() + (deduplicator.duplicates if deduplicator else 0),
+                                row=row,
+                                reasons=problems,
+                                field=problems[0].partition(":")[0],
+                                error_type="ValidationError",
+                            )
+                            return
+                    if column_stats is not None:
+                        start = clock()
+                        column_stats.add(row)
+                        column_stats_s += clock() - start
+                    write_raw(to_write)
+                    rows += 1
+                    if deduplicator is not None:  # rejected rows must not hide later valid rows with their key
+                        start = clock()
+                        deduplicator.add(key)
+                        dedup_s += clock() - start
+
                 yield __write
+                self.stats.add_wall_time("encode", encode_s, calls=rows)
+                if validator is not None:
+                    self.stats.add_wall_time("validate", validate_s, calls=validated)
+                if deduplicator is not None:
+                    self.stats.add_wall_time(
+                        "dedup", dedup_s, calls=rows + self._rejected_rows() + deduplicator.duplicates
+                    )
+                    self.stats.increment("rows_duplicate", deduplicator.duplicates)
+                    self.stats.increment("rows_duplicate_probable", deduplicator.probable_duplicates)
+                if column_stats is not None:
+                    self.stats.add_wall_time("column_stats", column_stats_s, calls=rows)
+                if self.dead_letters is not None:
+                    self.stats.increment("rows_rejected", self.dead_letters.count)
+                    for (_, error_type), count in self.dead_letters.error_counts.items():
+                        self.stats.increment("rows_rejected.{}".format(error_type), count)
+        finally:
+            if self.dead_letters is not None:
+                self.dead_letters.close()
+
+    def _rejected_rows(self):
+        return 0 if self.dead_letters is None else self.dead_letters.count
+
+    def _reject(self, offset, row, reasons, field=None, error_type=None):
+        """
+        Put a row into the dead letter spool of the current load (opened with the first rejected row)
+        """
+        if self.dead_letters is None:
+            path = self.dead_letter_path
+            if path is None:
+                handle, path = _tempfile.mkstemp(prefix="bqsink_dead_letters_", suffix=".jsonl")
+                _os.close(handle)
+            self.dead_letters = _dead_letter.DeadLetterSpool(
+                path=path,
+                json_default_fn=self._json_default_fn,
+                max_entries=self.dead_letter_max_rows,
+                sample_rate=self.dead_letter_sample_rate,
+            ).open()
+        self.dead_letters.add(offset=offset, row=row, reasons=reasons, field=field, error_type=error_type)
+
+    @_contextlib.contextmanager
+    def _open_raw(self):
+        """
+        Like `open`, but the writer takes already encoded newline delimited json: fn(data: bytes, rows: int = 1)
+        """
+        stats = self.stats = _stats.SinkStats()
+        clock = _time.perf_counter
+        rows = 0
+        writes = 0
+        uncompressed_bytes = 0
+        file_write_s = 0.0
+        adaptive = self.compressed_upload == _compression.AUTO
+        compress_level = 0 if adaptive or not self.compressed_upload else 9
+        sample = []  # adaptive: the data is kept until the compression is chosen
+
+        with _tempfile.TemporaryFile() as tmp_file:
+
+            def __open_out_file():
+                if compress_level:
+                    return _gzip.GzipFile(mode='wb', fileobj=tmp_file, compresslevel=compress_level)
+                return tmp_file
+
+            out_file = None if adaptive else __open_out_file()
+
+            def __flush_sample(sample_data):
+                nonlocal out_file, file_write_s
+                out_file = __open_out_file()
+                start = clock()
+                out_file.write(sample_data)
+                file_write_s += clock() - start
+
+            def __write_raw(data, rows_in_data=1):
+                nonlocal rows, writes, uncompressed_bytes, file_write_s, compress_level
+                if out_file is None:
+                    sample.append(data)
+                    if uncompressed_bytes + len(data) >= _compression.SAMPLE_BYTES:
+                        sample_data = b"".join(sample)
+                        sample.clear()
+                        compress_level = self._choose_compression_level(sample_data)
+                        __flush_sample(sample_data)
+                else:
+                    start = clock()
+                    out_file.write(data)
+                    file_write_s += clock() - start
+                rows += rows_in_data
+                writes += 1
+                uncompressed_bytes += len(data)
+
+            with stats.measure("write"):
+                yield __write_raw
+                if out_file is None:  # less than a sample: not worth compressing
+                    stats.increment("compression_level", 0)
+                    __flush_sample(b"".join(sample))
+                if compress_level:
+                    out_file.close()
+
+            stats.add_wall_time(
+                "compress" if compress_level else "file_write", file_write_s, calls=writes
+            )
+            stats.increment("rows", rows)
+            stats.increment("bytes_uncompressed", uncompressed_bytes)
+            stats.increment("bytes_compressed", tmp_file.tell())
+            self.rows_written += rows
 
             tmp_file.seek(0)
 
-            self._create_bq_dataset(exists_ok=True)  # ensures that dataset exists
-            table = self._create_bq_table(exists_ok=True)  # ensures that table exists
+            if self.spool is not None:
+                with stats.measure("spool"):
+                    self.spool.put(table_ref=self.table_ref, file_obj=tmp_file, compressed=bool(compress_level))
+                self._emit_metrics()
+                return
+
+            with stats.measure("metadata"):
+                self._create_bq_dataset(exists_ok=True)  # ensures that dataset exists
+                table = self._create_bq_table(exists_ok=True)  # ensures that table exists
+
+            with stats.measure("upload"):
+                upload_start = clock()
+                storage_uri = self._upload_file_obj_to_storage(file_obj=tmp_file, compressed=bool(compress_level))
+                _compression.record_upload(self.temp_bucket_name, tmp_file.tell(), clock() - upload_start)
+
+            if self.write_disposition == WriteDisposition.UPSERT.value:
+                self._upsert_from_storage(storage_uri=storage_uri)
+            else:
+                with stats.measure("load"):
+                    load_job = self._load_bq_table_from_storage(storage_uri=storage_uri, table=table)
+                stats.record_job(load_job)
+            self._emit_metrics()
+
+    def _choose_compression_level(self, sample):
+        """
+        Adaptive compression: pick the gzip level (0: none) with the highest throughput of compression + upload.
+        The compression ratio / speed is measured once per sink, the upload bandwidth of the bucket is
+        estimated from previous uploads of the process (or probed with the sample).
+        The decision is recorded in the counters compression_level, compression_ratio and upload_bytes_per_s.
+        """
+        stats = self.stats
+        with stats.measure("compression_probe"):
+            if self._compression_profile is None:
+                self._compression_profile = _compression.measure_levels(sample)
+            upload_bytes_per_s = _compression.upload_bandwidth(self.temp_bucket_name)
+            if upload_bytes_per_s is None:
+                upload_bytes_per_s = self._probe_upload_bandwidth(sample)
+            level = _compression.choose_level(self._compression_profile, upload_bytes_per_s=upload_bytes_per_s)
 
-            storage_uri = self._upload_file_obj_to_storage(file_obj=tmp_file)
-            self._load_bq_table_from_storage(storage_uri=storage_uri, table=table)
+        stats.increment("compression_level", level)
+        stats.increment("compression_ratio", self._compression_profile[level][0])
+        stats.increment("upload_bytes_per_s", upload_bytes_per_s)
+        return level
+
+    def _probe_upload_bandwidth(self, sample):
+        """
+        Upload the sample into the temp bucket (deleted afterwards) to measure the bandwidth
+        :return: bytes / s
+        """
+        start = _time.perf_counter()
+        storage_uri = self._upload_file_obj_to_storage(file_obj=_io.BytesIO(sample), compressed=False)
+        seconds = _time.perf_counter() - start
+        _compression.record_upload(self.temp_bucket_name, len(sample), seconds)
+        blob_name = storage_uri[len("gs://{}/".format(self.temp_bucket_name)):]
+        self.storage.get_bucket(bucket_or_name=self.temp_bucket_name).blob(blob_name).delete()
+        return len(sample) / max(seconds, 1e-9)
 
     def from_iterable(
         self,
@@ -139,6 +545,8 @@ class BQBulkSink(object):
         force_values=None,
         should_ensure_type=True,
         should_fire_exception=False,
+        profiler=None,
+        dead_letter_errors=False,
     ):
         """
         Read from an iterable and directly upload.
@@ -148,34 +556,272 @@ class BQBulkSink(object):
         :param force_values: Provide a dict of key value pairs that is going to be written into the sink for each row
         :param should_ensure_type: whether the types should be cast so that BigQuery can understand them
         :param should_fire_exception: whether exceptions should be fired or caught silently
+        :param profiler: (optional) a `profiler.ExtractionProfiler` to record time spent per field (on sampled rows)
+        :param dead_letter_errors:
+            Rows whose extraction raises (the exceptions that `should_fire_exception` lets fire) are not written,
+            but put into the dead letter spool (`self.dead_letters`) with the failing field and the exception type
+        :return: Nr of rows written (without rejected and duplicate rows)
+        """
+
+        def on_error(row, offset, exception):
+            self._reject(
+                offset=offset,
+                row=row,
+                reasons=["{}: {}".format(type(exception).__name__, exception)],
+                field=_bigquery_sink.exception_field_path(exception),
+                error_type=type(exception).__name__,
+            )
+
+        with self.open() as sink_write:
+            rows = _pipeline.iter_extracted(
+                schema=self.schema,
+                rows=iterable,
+                force_values=force_values,
+                should_ensure_type=should_ensure_type,
+                should_fire_exception=should_fire_exception,
+                profiler=profiler,
+                stats=self.stats,
+                on_error=on_error if dead_letter_errors else None,
+            )
+            for to_write in rows:
+                sink_write(to_write)
+
+        return self.stats.counters.get("rows", 0)
+
+    def from_dataframe(self, dataframe, force_values=None, should_fire_exception=False, chunk_rows=100000):
+        """
+        Upload a pandas DataFrame.
+        Columns are matched to schema fields by their source key (the field name unless a `source_path` of a
+        single key is given) and cast column-wise: timestamps to UTC, floats to NUMERIC strings, numbers to booleans, ...
+        Fields with a `source_fn`, nested paths, REPEATED or STRUCT fields are extracted row by row.
+        :param dataframe: the pandas DataFrame
+        :param force_values: Provide a dict of key value pairs that is going to be written into the sink for each row
+        :param should_fire_exception: whether exceptions of row by row extraction should be fired or caught silently
+        :param chunk_rows: number of rows that are cast & encoded at once
         :return: Nr of rows written
         """
+        from toolbox.bigquery_sink import dataframe as _dataframe
+
+        self._check_row_options("from_dataframe")
         rows_written = 0
-        with self.open() as sink_write:
-            for row in iterable:
-                to_write = {}
-                for field in self.schema:
-                    to_write[field.name] = field.extract(
-                        row,
-                        should_ensure_type=should_ensure_type,
-                        should_fire_exception=should_fire_exception,
-                    )
+        with self._open_raw() as write_raw:
+            chunks = _dataframe.iter_encoded_chunks(
+                dataframe,
+                schema=self.schema,
+                force_values=force_values,
+                json_default_fn=self._json_default_fn,
+                chunk_rows=chunk_rows,
+                should_fire_exception=should_fire_exception,
+                timer=self.stats.measure,
+            )
+            for data, rows in chunks:
+                write_raw(data, rows)
+                rows_written += rows
 
-                if force_values:
-                    for key, val in force_values.items():
-                        to_write[key] = val
-                sink_write(to_write)
-                rows_written += 1
+        return rows_written
+
+    def _check_row_options(self, method):
+        """
+        Column-wise / pre-encoded writes bypass the per row steps of `open`
+        :raises ValueError: if validate_rows, dedup_key or collect_column_stats is set
+        """
+        row_options = [
+            name
+            for name, is_set in (
+                ("validate_rows", self.validator is not None),
+                ("dedup_key", self._dedup_key_fn is not None),
+                ("collect_column_stats", self.collect_column_stats),
+            )
+            if is_set
+        ]
+        if row_options:
+            raise ValueError(
+                "{} does not support {}, use from_iterable".format(method, ", ".join(row_options))
+            )
+
+    def from_jsonl_file(
+        self,
+        path,
+        force_values=None,
+        should_ensure_type=True,
+        should_fire_exception=False,
+        workers=None,
+        chunk_bytes=_file_reader.DEFAULT_CHUNK_BYTES,
+        encoding="utf-8",
+    ):
+        """
+        Read a newline delimited json file and upload it.
+        The file is split into chunks on line boundaries that are parsed and extracted in parallel processes
+        (see `file_reader.iter_encoded_chunks`), the results are written in file order.
+        :param path: path of the file
+        :param force_values: Provide a dict of key value pairs that is going to be written into the sink for each row
+        :param should_ensure_type: whether the types should be cast so that BigQuery can understand them
+        :param should_fire_exception: whether exceptions should be fired or caught silently
+        :param workers: number of worker processes (default: number of cpus), 0 or 1 to parse in this process
+        :param chunk_bytes: target size of the chunks
+        :param encoding: encoding of the file
+        :return: Nr of rows written
+        """
+        return self._from_file(
+            path=path,
+            file_format="jsonl",
+            force_values=force_values,
+            should_ensure_type=should_ensure_type,
+            should_fire_exception=should_fire_exception,
+            workers=workers,
+            chunk_bytes=chunk_bytes,
+            encoding=encoding,
+        )
+
+    def from_csv_file(
+        self,
+        path,
+        force_values=None,
+        should_ensure_type=True,
+        should_fire_exception=False,
+        workers=None,
+        chunk_bytes=_file_reader.DEFAULT_CHUNK_BYTES,
+        encoding="utf-8",
+        delimiter=",",
+    ):
+        """
+        Read a csv file with header line and upload it, see `from_jsonl_file`.
+        Rows are dicts header -> value, empty values are read as None.
+        Quoted values must not contain line breaks (the file is split on line boundaries).
+        :param delimiter: the delimiter of the csv file
+        :return: Nr of rows written
+        """
+        return self._from_file(
+            path=path,
+            file_format="csv",
+            force_values=force_values,
+            should_ensure_type=should_ensure_type,
+            should_fire_exception=should_fire_exception,
+            workers=workers,
+            chunk_bytes=chunk_bytes,
+            encoding=encoding,
+            csv_delimiter=delimiter,
+        )
+
+    def _from_file(self, path, file_format, **kwargs):
+        self._check_row_options("from_{}_file".format(file_format))
+        rows_written = 0
+        extract_s = 0.0
+        with self._open_raw() as write_raw:
+            chunks = _file_reader.iter_encoded_chunks(
+                path=path,
+                file_format=file_format,
+                schema=self.schema,
+                json_default_fn=self._json_default_fn,
+                **kwargs,
+            )
+            for data, rows, seconds in chunks:
+                write_raw(data, rows)
+                rows_written += rows
+                extract_s += seconds
+
+            self.stats.add_wall_time("extract", extract_s, calls=rows_written)
 
-        self.rows_written += rows_written
         return rows_written
 
-    def from_query(self, query, labels=None):
-        self._create_bq_dataset(exists_ok=True)  # ensures that dataset exists
-        if self.table_partition_date:
-            table_ref = "{}${:%Y%m%d}".format(self.table_ref, self.table_partition_date)
-        else:
-            table_ref = self.table_ref
+    def from_query(self, query, labels=None, skip_if_unchanged=False):
+        """
+        Write the result of a query into the table of this sink
+        :param query: the SQL query (standard sql)
+        :param labels: (optional) labels attached to the query job
+        :param skip_if_unchanged:
+            Don't run the query if the destination table was written by the same query and none of the
+            tables referenced by the query were modified since then (see `_query_is_unchanged`).
+        :return: the query result, None if the query was skipped
+        """
+        table_labels = None
+        if skip_if_unchanged:
+            if self._query_is_unchanged(query=query):
+                self.stats = _stats.SinkStats()
+                self.stats.increment("skipped")
+                self.rows_written = 0
+                self._emit_metrics()
+                return None
+            table_labels = self._lineage_labels(query=query)
+
+        query_job = self._submit_query(query=query, labels=labels)
+        return self._finish_query(query_job=query_job, table_labels=table_labels)
+
+    def _query_is_unchanged(self, query):
+        """
+        Checks whether writing the query result would change the destination table:
+        1) a dry run of the query returns the referenced (input) tables
+        2) the destination must have been written by the same query (hash stored as table label)
+        3) none of the input tables must have been modified after the snapshot of their modification times that
+           was taken before that query was submitted (stored as table label, see `_lineage_labels`).
+           The modification time of the destination is not used: an input that changed while the query was
+           running is older than the end of the write, but newer than the snapshot.
+
+        The referenced tables and their modification times are kept in `self.lineage`.
+        :return: True if the query does not need to run
+        """
+        if self.table_partition_date is not None:
+            raise ValueError(
+                "skip_if_unchanged can not be used for partition writes: "
+                "modification times are only available per table"
+            )
+
+        dry_run_job = self.bigquery.query(
+            query=query,
+            job_config=_bigquery.QueryJobConfig(dry_run=True, use_query_cache=False),
+        )
+        self.lineage = {}
+        for reference in dry_run_job.referenced_tables or []:
+            table_ref = "{}.{}.{}".format(reference.project, reference.dataset_id, reference.table_id)
+            self.lineage[table_ref] = self.bigquery.get_table(reference).modified
+
+        try:
+            destination = self.bigquery.get_table(self.table_ref)
+        except _exceptions.NotFound:
+            return False
+
+        labels = destination.labels
+        if labels.get(QUERY_HASH_LABEL) != _query_hash(query) or not labels.get(INPUTS_MODIFIED_LABEL, "").isdigit():
+            return False
+
+        inputs_modified = int(labels[INPUTS_MODIFIED_LABEL])
+        return all(
+            modified is not None and _epoch_ms(modified) <= inputs_modified
+            for modified in self.lineage.values()
+        )
+
+    def _lineage_labels(self, query):
+        """
+        :return: the labels of the table written by the query: the labels of the sink, the query hash and the latest
+            modification time of the inputs in `self.lineage` (of `_query_is_unchanged`, before the query is submitted)
+        """
+        modified = [_epoch_ms(modified) for modified in self.lineage.values() if modified is not None]
+        return dict(
+            self.labels,
+            **{QUERY_HASH_LABEL: _query_hash(query), INPUTS_MODIFIED_LABEL: str(max(modified, default=0))}
+        )
+
+    def _submit_query(self, query, labels=None):
+        """
+        Start the query job that writes into the table of this sink, without waiting for it
+        :return: the running query job
+        """
+        stats = self.stats = _stats.SinkStats()
+        with stats.measure("metadata"):
+            self._create_bq_dataset(exists_ok=True)  # ensures that dataset exists
+            if self.write_disposition == WriteDisposition.UPSERT.value:
+                self._create_bq_table(exists_ok=True)  # the MERGE target has to exist
+
+        if self.write_disposition == WriteDisposition.UPSERT.value:
+            job_config = _bigquery.QueryJobConfig(labels=labels or {})
+            with stats.measure("submit"):
+                return self.bigquery.query(
+                    query=self._merge_query(source="(\n{}\n)".format(query)),
+                    job_config=job_config,
+                    job_id=self._generate_job_id(),
+                )
+
+        table_ref = self._partition_table_ref(self.table_ref)
 
         job_config = _bigquery.QueryJobConfig(
             allow_large_results=True,
@@ -197,16 +843,94 @@ class BQBulkSink(object):
                 self.table_partitioning["definition"],
             )
 
-        query_job = self.bigquery.query(
-            query=query, job_config=job_config, job_id=self._generate_job_id(),
-        )
-        result = query_job.result()
+        if self.clustering_fields:
+            job_config.clustering_fields = self.clustering_fields
 
-        table = _bigquery.Table(table_ref=self.table_ref, schema=self.bq_schema)
-        self._update_table(table=table)  # ensures that table information is up2date
-        self.rows_written = result.total_rows
+        with stats.measure("submit"):
+            return self.bigquery.query(
+                query=query, job_config=job_config, job_id=self._generate_job_id(),
+            )
+
+    def _finish_query(self, query_job, table_labels=None):
+        """
+        Wait for a query job started with `_submit_query` and bring the table information up2date
+        :param table_labels: (optional) the labels of the table instead of the ones of the sink, see `_lineage_labels`
+        :return: the query result
+        """
+        stats = self.stats
+        with stats.measure("query"):
+            result = query_job.result()
+        stats.record_job(query_job)
+
+        with stats.measure("metadata"):
+            table = _bigquery.Table(table_ref=self.table_ref, schema=self.bq_schema)
+            self._update_table(table=table, labels=table_labels)  # ensures that table information is up2date
+        if self.write_disposition == WriteDisposition.UPSERT.value:
+            self.rows_written = query_job.num_dml_affected_rows
+        else:
+            self.rows_written = result.total_rows
+        stats.increment("rows", self.rows_written or 0)
+        self._emit_metrics()
         return result
 
+    def from_table(self, source_table_refs, source_partition_date=None):
+        """
+        Copy one or more tables into the table of this sink using a copy job.
+        Copy jobs are free of charge and usually much faster than `from_query("SELECT * FROM ...")`.
+        The write disposition of the sink is respected; if `table_partition_date` is set,
+        only that partition is copied (from the same partition of the source tables, unless `source_partition_date` is given).
+        Afterwards labels, schema and description of the destination are brought up2date.
+
+        :param source_table_refs: "project.dataset.table" of the source table or a list of them
+        :param source_partition_date: (optional) copy from this partition of the source tables
+        :return: the finished copy job
+        """
+        if self.write_disposition == WriteDisposition.UPSERT.value:
+            raise ValueError("Copy jobs do not support WriteDisposition.UPSERT, use from_query")
+        if isinstance(source_table_refs, str):
+            source_table_refs = [source_table_refs]
+
+        stats = self.stats = _stats.SinkStats()
+        with stats.measure("metadata"):
+            self._create_bq_dataset(exists_ok=True)  # ensures that dataset exists
+            if self.table_partition_date is not None and self.table_partitioning:
+                self._create_bq_table(exists_ok=True)  # partitions can only be copied into existing tables
+
+        if self.table_partition_date is not None:
+            source_date = self.table_partition_date if source_partition_date is None else source_partition_date
+            sources = [
+                self._partition_table_ref(source_table_ref, partition_date=source_date)
+                for source_table_ref in source_table_refs
+            ]
+        else:
+            sources = list(source_table_refs)
+
+        source_rows = None
+        if self.table_partition_date is None:
+            with stats.measure("metadata"):
+                source_rows = sum(self.bigquery.get_table(source).num_rows or 0 for source in sources)
+
+        job_config = _bigquery.CopyJobConfig(write_disposition=self.write_disposition)
+        with stats.measure("copy"):
+            copy_job = self.bigquery.copy_table(
+                sources=sources,
+                destination=self._partition_table_ref(self.table_ref),
+                job_config=job_config,
+                job_id=self._generate_job_id(),
+            )
+            copy_job.result()
+        stats.record_job(copy_job)
+
+        with stats.measure("metadata"):
+            table = self.bigquery.get_table(self.table_ref)
+            self._update_table(table=table)  # ensures that table information is up2date
+        # the destination may hold more rows (WriteDisposition.APPEND): count the copied rows of the job
+        # (or of whole source tables, partitions have no row count in the table metadata)
+        copied_rows = _copied_rows(copy_job)
+        self.rows_written = source_rows if copied_rows is None else copied_rows
+        self._emit_metrics()
+        return copy_job
+
     def create_related_view(self, name, sql_template, options=None, description=None):
         if "{TABLE}" in sql_template:
             sql_template = sql_template.format(TABLE="`{}`".format(self.table_ref))
@@ -218,6 +942,58 @@ class BQBulkSink(object):
             options=options or self.options,
         )
 
+    def _partition_table_ref(self, table_ref, partition_date=None):
+        """
+        :param table_ref: "project.dataset.table"
+        :param partition_date: defaults to `self.table_partition_date`
+        :return: the table ref with partition decorator (if a partition is written), e.g. "project.dataset.table$20200101"
+            (formatted according to the partitioning type of the sink: HOUR, DAY, MONTH, YEAR or integer range)
+        """
+        partition_date = self.table_partition_date if partition_date is None else partition_date
+        if partition_date is None:
+            return table_ref
+        if self.table_partitioning and self.table_partitioning["type"] == "range_partitioning":
+            return "{}${}".format(table_ref, int(partition_date))
+        partition_type = _bigquery.TimePartitioningType.DAY
+        if self.table_partitioning and self.table_partitioning["type"] == "time_partitioning":
+            partition_type = self.table_partitioning["definition"].type_ or partition_type
+        return "{}${}".format(table_ref, partition_date.strftime(_PARTITION_DECORATOR_FORMATS[partition_type]))
+
+    def _partition_id_fn(self):
+        """
+        :return: fn(row) -> id of the partition the row is written to (like the partition decorator), None if the table is not partitioned
+        """
+        if self.table_partition_date is not None:
+            partition_id = self._partition_table_ref("").lstrip("$")
+            return lambda row: partition_id
+        if not self.table_partitioning:
+            return None
+
+        definition = self.table_partitioning["definition"]
+        if self.table_partitioning["type"] == "range_partitioning":
+            return _column_stats.range_partition_id_fn(
+                field=definition.field,
+                start=definition.range_.start,
+                end=definition.range_.end,
+                interval=definition.range_.interval,
+            )
+        partition_format = _PARTITION_DECORATOR_FORMATS[definition.type_ or _bigquery.TimePartitioningType.DAY]
+        if definition.field is None:  # ingestion time
+            partition_id = self.now.strftime(partition_format)
+            return lambda row: partition_id
+        return _column_stats.time_partition_id_fn(field=definition.field, partition_format=partition_format)
+
+    def _emit_metrics(self):
+        if self.metrics_hooks:
+            self.stats.emit(
+                hooks=self.metrics_hooks,
+                tags={
+                    "project": self.project_id,
+                    "dataset": self.dataset_id,
+                    "table": self.table_id,
+                },
+            )
+
     def _generate_job_id(self):
         job_id = "{runner}--{project}--{dataset}--{table}--{date}-{time}-{correlation_id}-{random}".format(
             runner="lh-dwh-etl",
@@ -242,12 +1018,13 @@ class BQBulkSink(object):
         if isinstance(obj, _decimal.Decimal):
             return str(obj)
 
-    def _upload_file_obj_to_storage(self, file_obj, rewind=True):
+    def _upload_file_obj_to_storage(self, file_obj, rewind=True, compressed=None):
         """
         Upload content of a file_obj into google cloud storage.
 
         :param file_obj: The file object to upload
         :param rewind: Whether or not to rewind the provided file
+        :param compressed: Whether the content is gzip compressed (default: `self.compressed_upload`)
         :return: the google cloud storage uri (e.g. 'gs://BUCKET/FILE_PATH')
         """
         bucket = self.storage.get_bucket(bucket_or_name=self.temp_bucket_name)
@@ -270,7 +1047,7 @@ class BQBulkSink(object):
             ti=self.now.strftime("%H-%M-%S"),
             c=self.correlation_id,
             r=_generate_id.generate_id(),
-            e='.gz' if self.compressed_upload else ''
+            e='.gz' if (self.compressed_upload if compressed is None else compressed) else ''
         )
 
         blob = bucket.blob(file_path)
@@ -306,22 +1083,42 @@ class BQBulkSink(object):
                 self.table_partitioning["type"],
                 self.table_partitioning["definition"],
             )
+        if self.clustering_fields:
+            table.clustering_fields = self.clustering_fields
+        if self.require_partition_filter is not None:
+            table.require_partition_filter = self.require_partition_filter
+        desired_partitioning = _partitioning_repr(table)
         table = self.bigquery.create_table(table=table, exists_ok=exists_ok)
+        if desired_partitioning is not None and _partitioning_repr(table) != desired_partitioning:
+            raise ValueError(
+                "Partitioning of {} can not be changed: {} (table) vs {} (sink)".format(
+                    self.table_ref, _partitioning_repr(table), desired_partitioning
+                )
+            )
         table = self._update_table(table=table)
 
-        if self.table_partition_date:
+        if self.table_partition_date is not None:
             table = _bigquery.Table(
-                table_ref="{}${:%Y%m%d}".format(
-                    self.table_ref, self.table_partition_date
-                ),
+                table_ref=self._partition_table_ref(self.table_ref),
                 schema=self.bq_schema,
             )
 
         return table
 
-    def _update_table(self, table):
+    def _update_table(self, table, labels=None):
+        """
+        :param labels: the labels of the table, default: the labels of the sink. Other writes than the ones of
+            `from_query(..., skip_if_unchanged=True)` remove the query hash, so that the query is not skipped
+        """
+        if not self.update_table_metadata:
+            return table
+        if labels is None:
+            labels = self.labels
+            if any(label in (table.labels or {}) for label in _LINEAGE_LABELS):
+                table.labels = dict({label: None for label in table.labels}, **labels)
+                table = self.bigquery.update_table(table=table, fields=["labels"])
         table = _bigquery_sink.check_and_update_labels(
-            table=table, labels=self.labels, bigquery=self.bigquery
+            table=table, labels=labels, bigquery=self.bigquery
         )
         table = _bigquery_sink.check_and_update_schema(
             table=table,
@@ -334,18 +1131,70 @@ class BQBulkSink(object):
             table_description=self.table_description,
             bigquery=self.bigquery,
         )
+        table = _bigquery_sink.check_and_update_clustering(
+            table=table, clustering_fields=self.clustering_fields, bigquery=self.bigquery
+        )
+        table = _bigquery_sink.check_and_update_require_partition_filter(
+            table=table, require_partition_filter=self.require_partition_filter, bigquery=self.bigquery
+        )
         return table
 
-    def _load_bq_table_from_storage(self, storage_uri, table):
+    def _upsert_from_storage(self, storage_uri):
+        """
+        Load the file into a (temporary) staging table and MERGE it into the table of the sink.
+        The staging table is deleted afterwards (and expires after a day in any case).
+        :param storage_uri: The source uri where to get the data from, e.g. 'gs://BUCKET/FILE_PATH'
+        """
+        stats = self.stats
+        staging_table_ref = "{}__upsert_{}".format(self.table_ref, _generate_id.generate_id().lower())
+        staging_table = _bigquery.Table(table_ref=staging_table_ref, schema=self.bq_schema)
+        # relative to the current time, `self.now` may be a logical date in the past (e.g. of a backfill)
+        staging_table.expires = _datetime.datetime.now(_datetime.timezone.utc) + _datetime.timedelta(days=1)
+
+        try:
+            with stats.measure("metadata"):
+                staging_table = self.bigquery.create_table(table=staging_table)
+            with stats.measure("load"):
+                load_job = self._load_bq_table_from_storage(
+                    storage_uri=storage_uri,
+                    table=staging_table,
+                    write_disposition=WriteDisposition.REPLACE.value,
+                )
+            stats.record_job(load_job)
+            with stats.measure("merge"):
+                merge_job = self.bigquery.query(
+                    query=self._merge_query(source=staging_table_ref), job_id=self._generate_job_id(),
+                )
+                merge_job.result()
+            stats.increment("rows_merged", merge_job.num_dml_affected_rows or 0)
+        finally:
+            with stats.measure("metadata"):
+                self.bigquery.delete_table(table=staging_table_ref, not_found_ok=True)
+
+    def _merge_query(self, source):
+        """
+        :param source: a table ref or a query in parentheses
+        :return: the MERGE statement of `source` into the table of this sink on `self.upsert_keys`
+        """
+        return build_merge_query(
+            target_table_ref=self.table_ref,
+            source=source,
+            keys=self.upsert_keys,
+            columns=[field.name for field in self.schema],
+            partition_filter=self.upsert_partition_filter,
+        )
+
+    def _load_bq_table_from_storage(self, storage_uri, table, write_disposition=None):
         """
         Create/Update a bigquery table given a google cloud storage uri
         :param storage_uri: The source uri where to get the data from, e.g. 'gs://BUCKET/FILE_PATH'
-        :return: None
+        :param write_disposition: overrides the write disposition of the sink
+        :return: the finished load job
         """
         job_config = _bigquery.LoadJobConfig(
             schema=self.bq_schema,
             source_format=_bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
-            write_disposition=self.write_disposition,
+            write_disposition=write_disposition or self.write_disposition,
         )
         load_job = self.bigquery.load_table_from_uri(
             source_uris=storage_uri,
@@ -354,6 +1203,7 @@ class BQBulkSink(object):
             job_id=self._generate_job_id(),
         )
         load_job.result()  # Waits for table load to complete.
+        return load_job
 
 
 def query_write_to_table(
@@ -0,0 +1,283 @@
+"""
+Coalesce many small loads into few load jobs: writers drop finished chunks into a shared spool,
+a coalescer loads all pending chunks of a table with one (multi uri) load job per window
+"""
+
+import collections as _collections
+import datetime as _datetime
+import gzip as _gzip
+import os as _os
+import re as _re
+import shutil as _shutil
+import tempfile as _tempfile
+import threading as _threading
+import time as _time
+import typing as _typing
+
+from toolbox.bigquery_sink import bulk_sink as _bulk_sink
+from toolbox.bigquery_sink import stats as _stats
+from toolbox.bigquery_sink.utils import generate_id as _generate_id
+
+# maximal number of source uris of a load job
+MAX_SOURCE_URIS = 10000
+
+_CHUNK_NAME_PATTERN = _re.compile(r"^\d{8}T\d{12}-[0-9A-Z]+\.nljson(\.gz)?$")
+
+Chunk = _collections.namedtuple("Chunk", ["table_ref", "name", "uri"])
+
+
+class ChunkSpool(object):
+    """
+    Shared place for finished newline delimited json chunks: a bucket prefix ("gs://bucket/prefix")
+    or a local directory (e.g. a shared volume). The layout is <location>/<project.dataset.table>/<chunk>,
+    chunk names start with their creation time (utc) so that they sort chronologically.
+    Chunks appear atomically (objects / renamed files), so writers and the coalescer need no coordination.
+    """
+
+    def __init__(self, location: str, options=None):
+        """
+        :param location: "gs://bucket/prefix" or the path of a local directory
+        :param options: the access config object, required for bucket locations
+        """
+        self.location = location.rstrip("/")
+        self.options = options
+        if self.is_storage:
+            if options is None:
+                raise ValueError("A spool in google cloud storage requires options")
+            self.bucket_name, _, self.prefix = self.location[len("gs://"):].partition("/")
+        else:
+            _os.makedirs(self.location, exist_ok=True)
+
+    @property
+    def is_storage(self) -> bool:
+        return self.location.startswith("gs://")
+
+    def _bucket(self):
+        return self.options.get_storage_client().bucket(self.bucket_name)
+
+    def _blob_name(self, table_ref, name):
+        return "/".join(part for part in (self.prefix, table_ref, name) if part)
+
+    def put(self, table_ref: str, file_obj, compressed: bool = False) -> Chunk:
+        """
+        Store a finished chunk
+        :param table_ref: "project.dataset.table" of the destination
+        :param file_obj: file object with the newline delimited json (read from the start)
+        :param compressed: whether the content is gzip compressed
+        :return: the stored chunk
+        """
+        name = "{:%Y%m%dT%H%M%S%f}-{}.nljson{}".format(
+            _datetime.datetime.now(_datetime.timezone.utc), _generate_id.generate_id(), ".gz" if compressed else ""
+        )
+        file_obj.seek(0)
+        if self.is_storage:
+            blob_name = self._blob_name(table_ref, name)
+            self._bucket().blob(blob_name).upload_from_file(file_obj=file_obj, rewind=True)
+            return Chunk(table_ref=table_ref, name=name, uri="gs://{}/{}".format(self.bucket_name, blob_name))
+
+        directory = _os.path.join(self.location, table_ref)
+        _os.makedirs(directory, exist_ok=True)
+        path = _os.path.join(directory, name)
+        tmp_path = _os.path.join(directory, "." + name + ".tmp")  # hidden until it is complete
+        with open(tmp_path, "wb") as out_file:
+            _shutil.copyfileobj(file_obj, out_file)
+        _os.replace(tmp_path, path)
+        return Chunk(table_ref=table_ref, name=name, uri=path)
+
+    def pending(self) -> _typing.Dict[str, _typing.List[Chunk]]:
+        """
+        :return: table ref -> its chunks, oldest first
+        """
+        chunks = _collections.defaultdict(list)
+        if self.is_storage:
+            prefix = self.prefix + "/" if self.prefix else ""
+            for blob in self._bucket().list_blobs(prefix=prefix):
+                table_ref, _, name = blob.name[len(prefix):].rpartition("/")
+                if table_ref and "/" not in table_ref and _CHUNK_NAME_PATTERN.match(name):
+                    uri = "gs://{}/{}".format(self.bucket_name, blob.name)
+                    chunks[table_ref].append(Chunk(table_ref=table_ref, name=name, uri=uri))
+        else:
+            for table_ref in _os.listdir(self.location):
+                directory = _os.path.join(self.location, table_ref)
+                if not _os.path.isdir(directory):
+                    continue
+                for name in _os.listdir(directory):
+                    if _CHUNK_NAME_PATTERN.match(name):
+                        chunks[table_ref].append(
+                            Chunk(table_ref=table_ref, name=name, uri=_os.path.join(directory, name))
+                        )
+
+        return {table_ref: sorted(table_chunks) for table_ref, table_chunks in chunks.items()}
+
+    def remove(self, chunks: _typing.List[Chunk]):
+        for chunk in chunks:
+            if self.is_storage:
+                self._bucket().blob(self._blob_name(chunk.table_ref, chunk.name)).delete()
+            elif _os.path.exists(chunk.uri):
+                _os.remove(chunk.uri)
+
+
+class WindowSummary(object):
+    """
+    What one window of the coalescer did
+    """
+
+    def __init__(self):
+        self.loaded = {}  # table ref -> (number of chunks, number of rows)
+        self.deferred = []  # table refs without job budget, their chunks are loaded in a later window
+        self.failed = {}  # table ref -> exception, the chunks stay in the spool
+        self.unknown = []  # table refs with chunks but without sink
+        self.jobs = 0  # number of load jobs
+
+    def __str__(self):
+        return "loaded {} table(s) ({} chunks, {} rows), deferred {}, failed {}, unknown {}".format(
+            len(self.loaded),
+            sum(chunks for chunks, _ in self.loaded.values()),
+            sum(rows for _, rows in self.loaded.values()),
+            len(self.deferred),
+            len(self.failed),
+            len(self.unknown),
+        )
+
+
+class Coalescer(object):
+    """
+    Loads the pending chunks of a `ChunkSpool` per destination table with one load job per window,
+    while staying within a budget of load jobs per table and hour (bigquery limits the load jobs per table and day).
+    Chunks are removed after their load job succeeded (at least once delivery).
+    """
+
+    def __init__(
+        self,
+        spool: ChunkSpool,
+        sinks: _typing.List[_bulk_sink.BQBulkSink],
+        jobs_per_hour: int = 60,
+        max_chunks_per_job: int = MAX_SOURCE_URIS,
+    ):
+        """
+        :param spool: the spool the writers drop their chunks into
+        :param sinks: the destinations (WriteDisposition.APPEND), they provide schema, table settings and metrics hooks
+        :param jobs_per_hour: maximal number of load jobs per table within any hour
+        :param max_chunks_per_job: maximal number of chunks of a load job, further chunks wait for the next window
+        """
+        for sink in sinks:
+            if sink.write_disposition != _bulk_sink.WriteDisposition.APPEND.value:
+                raise ValueError("Coalesced loads append, {} has to use WriteDisposition.APPEND".format(sink.table_ref))
+        if jobs_per_hour < 1:
+            raise ValueError("jobs_per_hour has to be positive")
+        self.spool = spool
+        self.sinks = {sink.table_ref: sink for sink in sinks}
+        self.jobs_per_hour = jobs_per_hour
+        self.max_chunks_per_job = min(max_chunks_per_job, MAX_SOURCE_URIS)
+        self._job_times = _collections.defaultdict(_collections.deque)  # table ref -> start times of recent jobs
+
+    def _has_budget(self, table_ref, now):
+        job_times = self._job_times[table_ref]
+        while job_times and job_times[0] <= now - 3600:
+            job_times.popleft()
+        return len(job_times) < self.jobs_per_hour
+
+    def run_once(self, now: float = None) -> WindowSummary:
+        """
+        Issue one load job for every table with pending chunks (and budget left).
+        Chunks in google cloud storage are loaded as they are, so gzip compressed and plain chunks of a table
+        (e.g. from writers with `compressed_upload=compression.AUTO`) are loaded with one job each.
+        :param now: (optional) the current time as unix timestamp
+        """
+        now = _time.time() if now is None else now
+        summary = WindowSummary()
+        for table_ref, chunks in sorted(self.spool.pending().items()):
+            sink = self.sinks.get(table_ref)
+            if sink is None:
+                summary.unknown.append(table_ref)
+                continue
+
+            chunks = chunks[:self.max_chunks_per_job]
+            if self.spool.is_storage:
+                groups = [
+                    [chunk for chunk in chunks if chunk.name.endswith(".gz") == compressed]
+                    for compressed in sorted({chunk.name.endswith(".gz") for chunk in chunks})
+                ]
+            else:
+                groups = [chunks]  # local chunks are concatenated (and compressed like the sink) for the upload
+            for group in groups:
+                if not self._has_budget(table_ref, now):
+                    summary.deferred.append(table_ref)
+                    break
+                self._job_times[table_ref].append(now)
+                summary.jobs += 1
+                try:
+                    rows = self._load(sink, group)
+                except Exception as exception:
+                    summary.failed[table_ref] = exception
+                    break
+                self.spool.remove(group)
+                loaded_chunks, loaded_rows = summary.loaded.get(table_ref, (0, 0))
+                summary.loaded[table_ref] = (loaded_chunks + len(group), loaded_rows + rows)
+        return summary
+
+    def run(self, window_s: float = 60.0, stop: _threading.Event = None, max_windows: int = None):
+        """
+        Run a window every `window_s` seconds until `stop` is set (or `max_windows` ran)
+        :return: the summary of the last window
+        """
+        stop = stop or _threading.Event()
+        summary = None
+        windows = 0
+        while not stop.is_set():
+            started = _time.time()
+            summary = self.run_once(now=started)
+            windows += 1
+            if max_windows is not None and windows >= max_windows:
+                break
+            stop.wait(max(0.0, window_s - (_time.time() - started)))
+        return summary
+
+    def _load(self, sink, chunks):
+        """
+        Load the chunks into the table of the sink, the timings end up in `sink.stats`
+        :return: the number of loaded rows
+        """
+        stats = sink.stats = _stats.SinkStats()
+        stats.increment("chunks_coalesced", len(chunks))
+        with stats.measure("metadata"):
+            sink._create_bq_dataset(exists_ok=True)
+            table = sink._create_bq_table(exists_ok=True)
+
+        if self.spool.is_storage:
+            storage_uris = [chunk.uri for chunk in chunks]
+        else:
+            with stats.measure("upload"):
+                storage_uris = [self._upload_local_chunks(sink, chunks)]
+
+        with stats.measure("load"):
+            load_job = sink._load_bq_table_from_storage(storage_uri=storage_uris, table=table)
+        stats.record_job(load_job)
+        rows = load_job.output_rows or 0
+        stats.increment("rows", rows)
+        sink.rows_written += rows
+        sink._emit_metrics()
+        return rows
+
+    @staticmethod
+    def _upload_local_chunks(sink, chunks):
+        """
+        Concatenate local chunks into one file (compressed like the uploads of the sink) and upload it
+        """
+        with _tempfile.TemporaryFile() as tmp_file:
+            if sink.compressed_upload:
+                out_file = _gzip.GzipFile(mode="wb", fileobj=tmp_file)
+            else:
+                out_file = tmp_file
+            for chunk in chunks:
+                opener = _gzip.open if chunk.name.endswith(".gz") else open
+                with opener(chunk.uri, "rb") as in_file:
+                    last = b"\n"
+                    for block in iter(lambda: in_file.read(1024 * 1024), b""):
+                        out_file.write(block)
+                        last = block[-1:]
+                    if last != b"\n":  # keep the rows of consecutive chunks apart
+                        out_file.write(b"\n")
+            if sink.compressed_upload:
+                out_file.close()
+            return sink._upload_file_obj_to_storage(file_obj=tmp_file)
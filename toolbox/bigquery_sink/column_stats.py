@@ -0,0 +1,200 @@
+"""
+Lightweight statistics per field of the rows written by a sink: nulls, min / max, approximate distinct values
+and the touched partitions - without a query after the load
+"""
+
+import datetime as _datetime
+import decimal as _decimal
+import typing as _typing
+
+from toolbox import bigquery_sink as _bigquery_sink
+from toolbox.bigquery_sink.utils import hll as _hll
+
+_FieldType = _bigquery_sink.FieldType
+
+# partition ids of bigquery for rows without partition value / outside of the integer ranges
+NULL_PARTITION = "__NULL__"
+UNPARTITIONED = "__UNPARTITIONED__"
+
+
+def parse_datetime(value) -> _datetime.datetime:
+    """
+    :param value: datetime, date or iso formatted string (e.g. "2020-01-31 12:00:00 UTC")
+    :return: naive datetime in UTC
+    """
+    if isinstance(value, str):
+        text = value.strip()
+        for suffix in (" UTC", "UTC", "Z"):
+            if text.endswith(suffix):
+                text = text[:-len(suffix)].rstrip() + "+00:00"
+                break
+        value = _datetime.datetime.fromisoformat(text)
+    if isinstance(value, _datetime.datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(_datetime.timezone.utc).replace(tzinfo=None)
+        return value
+    if isinstance(value, _datetime.date):
+        return _datetime.datetime(value.year, value.month, value.day)
+    raise TypeError("Can not parse {!r} as datetime".format(value))
+
+
+def _parse_date(value):
+    if isinstance(value, _datetime.date) and not isinstance(value, _datetime.datetime):
+        return value
+    return parse_datetime(value).date()
+
+
+def _parse_numeric(value):
+    return _decimal.Decimal(str(value))
+
+
+def _parse_boolean(value):
+    """
+    Like the json loads of bigquery: "true" / "false" (any case) and "1" / "0" are booleans as well
+    """
+    if isinstance(value, str):
+        text = value.lower()
+        if text in ("true", "1"):
+            return True
+        if text in ("false", "0"):
+            return False
+        raise ValueError("Can not parse {!r} as boolean".format(value))
+    return bool(value)
+
+
+# how values are made comparable per field type, types without entry are not ordered
+_NORMALIZERS = {
+    _FieldType.STRING: str,
+    _FieldType.INTEGER: int,
+    _FieldType.FLOAT: float,
+    _FieldType.NUMERIC: _parse_numeric,
+    _FieldType.BOOLEAN: _parse_boolean,
+    _FieldType.DATE: _parse_date,
+    _FieldType.DATETIME: parse_datetime,
+    _FieldType.TIMESTAMP: parse_datetime,
+}
+
+
+class ColumnStats(object):
+    """
+    Statistics of one field. min / max are normalized per type (NUMERIC as Decimal, TIMESTAMP / DATETIME
+    as naive UTC datetime) and only kept for scalar fields of orderable types.
+    REPEATED and STRUCT fields only count nulls (an empty list counts as null).
+    """
+
+    def __init__(self, field: _bigquery_sink.SchemaField, hll_precision: int = 12):
+        self.name = field.name
+        self.field_type = field.field_type
+        self.count = 0  # non null values
+        self.nulls = 0
+        self.min = None
+        self.max = None
+        scalar = field.mode != _bigquery_sink.FieldMode.REPEATED and field.field_type != _FieldType.STRUCT
+        self._normalize = _NORMALIZERS.get(field.field_type) if scalar else None
+        self._hll = _hll.HyperLogLog(precision=hll_precision) if scalar else None
+
+    @property
+    def distinct(self) -> _typing.Optional[int]:
+        """
+        Approximate number of distinct non null values (None for REPEATED / STRUCT fields)
+        """
+        return None if self._hll is None else self._hll.count()
+
+    def add(self, value):
+        if value is None or (isinstance(value, (list, tuple)) and not value):
+            self.nulls += 1
+            return
+        self.count += 1
+        if self._normalize is not None:
+            try:
+                normalized = self._normalize(value)
+                if self.min is None or normalized < self.min:
+                    self.min = normalized
+                if self.max is None or normalized > self.max:
+                    self.max = normalized
+                value = normalized  # distinct values are counted normalized as well, e.g. "false" == False
+            except (TypeError, ValueError, ArithmeticError):  # values that can not be compared: stop ordering
+                self._normalize = None
+                self.min = self.max = None
+        if self._hll is not None:
+            self._hll.add(repr(value).encode("utf-8"))
+
+    def to_dict(self) -> dict:
+        return {"count": self.count, "nulls": self.nulls, "min": self.min, "max": self.max, "distinct": self.distinct}
+
+    def __repr__(self):
+        return "<ColumnStats {} {}>".format(self.name, self.to_dict())
+
+
+class ColumnStatsCollector(object):
+    """
+    Collects `ColumnStats` for the top level fields of a schema and the ids of the partitions the rows belong to
+    """
+
+    def __init__(
+        self,
+        schema: _typing.List[_bigquery_sink.SchemaField],
+        partition_id_fn: _typing.Callable[[dict], str] = None,
+        hll_precision: int = 12,
+    ):
+        """
+        :param schema: the schema of the rows
+        :param partition_id_fn: (optional) fn(row) -> partition id (like the partition decorator, e.g. "20200131")
+        :param hll_precision: precision of the distinct counts, see `utils.hll.HyperLogLog`
+        """
+        self.rows = 0
+        self.columns = {field.name: ColumnStats(field, hll_precision=hll_precision) for field in schema}
+        self.partitions = set()
+        self._partition_id_fn = partition_id_fn
+        self._items = list(self.columns.items())
+
+    def add(self, row: dict):
+        self.rows += 1
+        for name, column in self._items:
+            column.add(row.get(name))
+        if self._partition_id_fn is not None:
+            self.partitions.add(self._partition_id_fn(row))
+
+    def to_dict(self) -> dict:
+        return {
+            "rows": self.rows,
+            "partitions": sorted(self.partitions),
+            "columns": {name: column.to_dict() for name, column in self.columns.items()},
+        }
+
+
+def time_partition_id_fn(field: str, partition_format: str):
+    """
+    :return: fn(row) -> id of the time partition of the row
+    """
+
+    def partition_id(row):
+        value = row.get(field)
+        if value is None:
+            return NULL_PARTITION
+        try:
+            return parse_datetime(value).strftime(partition_format)
+        except (TypeError, ValueError):  # bigquery rejects the row, it must not break the statistics
+            return UNPARTITIONED
+
+    return partition_id
+
+
+def range_partition_id_fn(field: str, start: int, end: int, interval: int):
+    """
+    :return: fn(row) -> id of the integer range partition of the row (the start of its range)
+    """
+
+    def partition_id(row):
+        value = row.get(field)
+        if value is None:
+            return NULL_PARTITION
+        try:
+            value = int(value)
+        except (TypeError, ValueError):  # bigquery rejects the row, it must not break the statistics
+            return UNPARTITIONED
+        if not start <= value < end:
+            return UNPARTITIONED
+        return str(start + (value - start) // interval * interval)
+
+    return partition_id
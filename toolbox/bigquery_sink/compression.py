@@ -0,0 +1,76 @@
+"""
+Choice of the gzip level of uploads from the measured compression speed / ratio and upload bandwidth
+"""
+
+import threading as _threading
+import time as _time
+import typing as _typing
+import zlib as _zlib
+
+# `BQBulkSink(compressed_upload=AUTO)` chooses the compression per load
+AUTO = "auto"
+SAMPLE_BYTES = 1024 * 1024  # the decision is made on the first MB of a load
+CANDIDATE_LEVELS = (1, 6, 9)
+MIN_MEASURED_UPLOAD_BYTES = 256 * 1024  # smaller uploads are dominated by latency
+_SMOOTHING = 0.3
+
+_upload_bytes_per_s = {}  # bucket name -> smoothed upload bandwidth (shared by all sinks of the process)
+_lock = _threading.Lock()
+
+
+def record_upload(bucket_name: str, size: int, seconds: float):
+    """
+    Feed the bandwidth estimate of a bucket with a finished upload
+    """
+    if size < MIN_MEASURED_UPLOAD_BYTES or seconds <= 0:
+        return
+    bytes_per_s = size / seconds
+    with _lock:
+        previous = _upload_bytes_per_s.get(bucket_name)
+        if previous is not None:
+            bytes_per_s = previous + _SMOOTHING * (bytes_per_s - previous)
+        _upload_bytes_per_s[bucket_name] = bytes_per_s
+
+
+def upload_bandwidth(bucket_name: str) -> _typing.Optional[float]:
+    """
+    :return: the estimated upload bandwidth to the bucket in bytes / s, None if nothing was measured yet
+    """
+    with _lock:
+        return _upload_bytes_per_s.get(bucket_name)
+
+
+def measure_levels(sample: bytes, levels=CANDIDATE_LEVELS) -> _typing.Dict[int, _typing.Tuple[float, float]]:
+    """
+    Compress the sample with every level
+    :return: level -> (compression ratio, compressed bytes per second of cpu time), level 0 is no compression
+    """
+    profile = {0: (1.0, float("inf"))}
+    if not sample:
+        return profile
+    for level in levels:
+        start = _time.thread_time()
+        compressor = _zlib.compressobj(level, _zlib.DEFLATED, 31)  # 31: gzip container
+        size = len(compressor.compress(sample)) + len(compressor.flush())
+        seconds = max(_time.thread_time() - start, 1e-9)
+        profile[level] = (size / len(sample), len(sample) / seconds)
+    return profile
+
+
+def estimated_s_per_byte(ratio: float, compress_bytes_per_s: float, upload_bytes_per_s: float) -> float:
+    """
+    Time to compress (while writing) and upload one uncompressed byte
+    """
+    return 1.0 / compress_bytes_per_s + ratio / upload_bytes_per_s
+
+
+def choose_level(profile: _typing.Dict[int, _typing.Tuple[float, float]], upload_bytes_per_s: float) -> int:
+    """
+    :param profile: see `measure_levels`
+    :param upload_bytes_per_s: the upload bandwidth
+    :return: the level with the highest end to end throughput (0: no compression)
+    """
+    return min(
+        sorted(profile),
+        key=lambda level: estimated_s_per_byte(profile[level][0], profile[level][1], upload_bytes_per_s),
+    )
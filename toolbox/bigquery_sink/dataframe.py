@@ -0,0 +1,191 @@
+"""
+Column oriented encoding of pandas DataFrames into newline delimited json (pandas is an optional dependency)
+"""
+
+import contextlib as _contextlib
+import json as _json
+import typing as _typing
+
+from toolbox import bigquery_sink as _bigquery_sink
+
+_FieldType = _bigquery_sink.FieldType
+_INF = float("inf")
+
+
+def _dumps_fn(json_default_fn):
+    encoder = _json.JSONEncoder(default=json_default_fn)
+
+    def dumps(value):
+        return encoder.encode(value)
+
+    return dumps
+
+
+def _fallback_column(series, field, dumps):
+    """
+    Cast + encode value by value (for dtypes without vectorized cast)
+    """
+    caster = field._ensure_type
+    return [dumps(None if _is_null(value) else caster(value)) for value in series.tolist()]
+
+
+def _is_null(value):
+    import pandas as _pandas
+
+    try:
+        return value is None or bool(_pandas.isna(value))
+    except (TypeError, ValueError):  # lists, arrays
+        return False
+
+
+def _with_nulls(values: list, null_mask) -> list:
+    if null_mask.any():
+        values = ["null" if is_null else value for value, is_null in zip(values, null_mask.tolist())]
+    return values
+
+
+def _encode_timestamps(series, unit, to_utc=True):
+    import numpy as _numpy
+
+    if getattr(series.dt, "tz", None) is not None:
+        if to_utc:
+            series = series.dt.tz_convert("UTC")
+        series = series.dt.tz_localize(None)
+    values = series.to_numpy(dtype="datetime64[us]")
+    strings = ['"' + value + '"' for value in _numpy.datetime_as_string(values, unit=unit).tolist()]
+    return _with_nulls(strings, _numpy.isnat(values))
+
+
+def encode_column(series, field: _bigquery_sink.SchemaField, dumps) -> list:
+    """
+    Cast a whole column according to the field type and encode it as json values
+    :param series: the pandas Series of the column
+    :param field: the schema field of the column
+    :param dumps: fn(value) -> json string, used for values that can not be encoded vectorized
+    :return: list of json encoded values (one per row)
+    """
+    import numpy as _numpy
+    from pandas.api import types as _types
+
+    field_type = field.field_type
+    null_mask = series.isna().to_numpy()
+    dtype = series.dtype
+
+    if field_type in (_FieldType.TIMESTAMP, _FieldType.DATETIME):
+        if _types.is_datetime64_any_dtype(dtype):
+            return _encode_timestamps(series, unit="us")
+        if _types.is_integer_dtype(dtype):  # epoch seconds, like `_cast_timestamp`
+            import pandas as _pandas
+
+            return _encode_timestamps(_pandas.to_datetime(series, unit="s"), unit="us")
+
+    elif field_type == _FieldType.DATE:
+        if _types.is_datetime64_any_dtype(dtype):
+            return _encode_timestamps(series, unit="D", to_utc=False)  # like `_cast_date`
+
+    elif field_type == _FieldType.INTEGER:
+        if _types.is_integer_dtype(dtype) or _types.is_bool_dtype(dtype):
+            values = series.to_numpy(dtype="int64", na_value=0)
+            return _with_nulls(list(map(str, values.tolist())), null_mask)
+        if _types.is_float_dtype(dtype):
+            values = series.to_numpy(dtype="float64", na_value=0)
+            # the int64 cast wraps infinity and values beyond its range silently: those columns are cast value
+            # by value, which raises for infinity like the row path
+            if _numpy.isfinite(values).all() and (_numpy.abs(values) < 2.0 ** 63).all():
+                return _with_nulls(list(map(str, _numpy.trunc(values).astype("int64").tolist())), null_mask)
+
+    elif field_type == _FieldType.FLOAT:
+        if _types.is_numeric_dtype(dtype) and not _types.is_bool_dtype(dtype):
+            values = series.to_numpy(dtype="float64", na_value=_numpy.nan)
+            null_mask = ~_numpy.isfinite(values)
+            strings = _with_nulls(list(map(repr, values.tolist())), null_mask)
+            if _numpy.isinf(values).any():  # encoded like the json module does
+                strings = [
+                    "Infinity" if value == _INF else "-Infinity" if value == -_INF else string
+                    for value, string in zip(values.tolist(), strings)
+                ]
+            return strings
+
+    elif field_type == _FieldType.NUMERIC:
+        if _types.is_float_dtype(dtype):
+            values = series.to_numpy(dtype="float64", na_value=0.0).tolist()
+            return _with_nulls(['"' + repr(round(value, 8)) + '"' for value in values], null_mask)
+        if _types.is_integer_dtype(dtype):
+            values = series.to_numpy(dtype="int64", na_value=0)
+            return _with_nulls(list(map(str, values.tolist())), null_mask)
+
+    elif field_type == _FieldType.BOOLEAN:
+        if _types.is_bool_dtype(dtype) or _types.is_numeric_dtype(dtype):
+            values = series.to_numpy(dtype="float64", na_value=0) != 0
+            return _with_nulls(["true" if value else "false" for value in values.tolist()], null_mask)
+
+    elif field_type == _FieldType.STRING:
+        if _types.is_numeric_dtype(dtype) or _types.is_string_dtype(series):
+            strings = list(map(dumps, series.astype(str).tolist()))
+            return _with_nulls(strings, null_mask)
+
+    return _fallback_column(series, field, dumps)
+
+
+def iter_encoded_chunks(
+    dataframe,
+    schema: _typing.List[_bigquery_sink.SchemaField],
+    force_values: dict = None,
+    json_default_fn=None,
+    chunk_rows: int = 100000,
+    should_fire_exception: bool = False,
+    timer=None,
+):
+    """
+    Encode a DataFrame into newline delimited json, column by column.
+    Fields that read a top level key (see `SchemaField.source_column`) are cast vectorized from the column
+    of the same name, all other fields (source_fn, nested paths, REPEATED, STRUCT) are extracted row by row.
+
+    :param dataframe: the pandas DataFrame
+    :param schema: the schema fields to write
+    :param force_values: static values added to every row
+    :param json_default_fn: fn to encode values the json module does not know
+    :param chunk_rows: number of rows encoded at once (bounds the memory)
+    :param should_fire_exception: see `SchemaField.extract` (only for row by row extraction)
+    :param timer: (optional) fn(stage_name) -> context manager, to measure the "extract" and "encode" stages
+    :return: generator of (bytes, number of rows)
+    """
+    dumps = _dumps_fn(json_default_fn)
+    fields = [field for field in schema if not force_values or field.name not in force_values]
+
+    # one template per line, e.g. '{"a":%s,"b":%s,"forced":"value"}\n'
+    parts = [dumps(field.name).replace("%", "%%") + ":%s" for field in fields]
+    parts += [
+        (dumps(key) + ":" + dumps(value)).replace("%", "%%") for key, value in (force_values or {}).items()
+    ]
+    template = "{" + ",".join(parts) + "}\n"
+
+    def measure(stage):
+        return _contextlib.nullcontext() if timer is None else timer(stage)
+
+    for start in range(0, len(dataframe), chunk_rows):
+        chunk = dataframe.iloc[start:start + chunk_rows]
+        with measure("extract"):
+            columns = []
+            records = None
+            for field in fields:
+                column_name = field.source_column()
+                if column_name is not None and column_name in chunk.columns:
+                    values = encode_column(chunk[column_name], field, dumps)
+                elif column_name is not None:
+                    values = ["null"] * len(chunk)
+                else:
+                    if records is None:
+                        records = chunk.astype(object).where(chunk.notna(), None).to_dict("records")
+                    values = [
+                        dumps(field.extract(record, should_fire_exception=should_fire_exception))
+                        for record in records
+                    ]
+                columns.append(values)
+
+        with measure("encode"):
+            if columns:
+                data = "".join([template % row for row in zip(*columns)]).encode("utf-8")
+            else:
+                data = (template * len(chunk)).encode("utf-8")
+        yield data, len(chunk)
@@ -0,0 +1,138 @@
+"""
+Spool for rows that can not be loaded, so that they can be inspected and replayed
+"""
+
+import json as _json
+import os as _os
+import random as _random
+import typing as _typing
+
+from toolbox import bigquery_sink as _bigquery_sink
+
+# schema of the table created by `DeadLetterSpool.upload`
+DEAD_LETTER_SCHEMA = [
+    _bigquery_sink.SchemaField(name="offset", field_type=_bigquery_sink.FieldType.INTEGER),
+    _bigquery_sink.SchemaField(name="field", field_type=_bigquery_sink.FieldType.STRING),
+    _bigquery_sink.SchemaField(name="error_type", field_type=_bigquery_sink.FieldType.STRING),
+    _bigquery_sink.SchemaField(
+        name="reasons", field_type=_bigquery_sink.FieldType.STRING, mode=_bigquery_sink.FieldMode.REPEATED
+    ),
+    _bigquery_sink.SchemaField(
+        name="row", field_type=_bigquery_sink.FieldType.STRING, description="the original row as json"
+    ),
+]
+
+
+class DeadLetterSpool(object):
+    """
+    Newline delimited json file with one entry per rejected row:
+    {"offset": <index of the row in the batch>, "field": <field path>, "error_type": <exception class>,
+    "reasons": [...], "row": <the row>}
+
+    Counters cover all rejected rows, the stored entries can be bounded and sampled.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        json_default_fn=None,
+        max_entries: int = None,
+        sample_rate: float = 1.0,
+        seed: int = None,
+    ):
+        """
+        :param path: the file to write to (truncated when the spool is opened)
+        :param json_default_fn: fn to encode values the json module does not know
+        :param max_entries: (optional) maximal number of stored entries
+        :param sample_rate: fraction of the rejected rows that are stored
+        :param seed: seed for the sampling
+        """
+        self.path = path
+        self.json_default_fn = json_default_fn
+        self.max_entries = max_entries
+        self.sample_rate = sample_rate
+        self.count = 0  # all rejected rows
+        self.stored = 0  # stored entries
+        self.error_counts = {}  # (field, error_type) -> number of rejected rows
+        self._random = _random.Random(seed)
+        self._file = None
+
+    def open(self):
+        self._file = open(self.path, "w", encoding="utf-8")
+        self.count = 0
+        self.stored = 0
+        self.error_counts = {}
+        return self
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def remove(self):
+        """
+        Close the spool and delete its file (e.g. the temp file of a sink without `dead_letter_path`)
+        """
+        self.close()
+        if _os.path.exists(self.path):
+            _os.remove(self.path)
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def add(self, offset: int, row, reasons: _typing.List[str], field: str = None, error_type: str = None):
+        """
+        Count a rejected row and store it (if it is sampled and the spool is not full)
+        :param offset: index of the row in the batch
+        :param row: the row (original or extracted)
+        :param reasons: human readable reasons
+        :param field: (optional) path of the failing field
+        :param error_type: (optional) class name of the exception
+        """
+        self.count += 1
+        key = (field, error_type)
+        self.error_counts[key] = self.error_counts.get(key, 0) + 1
+
+        if self.max_entries is not None and self.stored >= self.max_entries:
+            return
+        if self.sample_rate < 1.0 and self._random.random() >= self.sample_rate:
+            return
+        entry = {"offset": offset, "field": field, "error_type": error_type, "reasons": reasons, "row": row}
+        self._file.write(_json.dumps(entry, default=self._default) + "\n")
+        self.stored += 1
+
+    def _default(self, obj):
+        if self.json_default_fn is not None:
+            value = self.json_default_fn(obj)
+            if value is not None:
+                return value
+        return repr(obj)  # the spool must never fail on odd source values
+
+    def entries(self) -> _typing.Iterator[dict]:
+        """
+        Read the stored entries back (e.g. to replay the rows after fixing them)
+        """
+        with open(self.path, "r", encoding="utf-8") as file_obj:
+            for line in file_obj:
+                if line.strip():
+                    yield _json.loads(line)
+
+    def upload(self, options: _bigquery_sink.Options, table_id: str, **sink_kwargs) -> int:
+        """
+        Append the stored entries to a table with `DEAD_LETTER_SCHEMA` (the rows are stored as json strings)
+        :param options: the access config object
+        :param table_id: the table of the dead letters
+        :param sink_kwargs: further arguments of `BQBulkSink`
+        :return: the number of uploaded entries
+        """
+        from toolbox.bigquery_sink import bulk_sink as _bulk_sink
+
+        sink_kwargs.setdefault("write_disposition", _bulk_sink.WriteDisposition.APPEND)
+        sink = _bulk_sink.BQBulkSink(
+            table_id=table_id, options=options, schema=DEAD_LETTER_SCHEMA, **sink_kwargs
+        )
+        entries = (dict(entry, row=_json.dumps(entry["row"])) for entry in self.entries())
+        return sink.from_iterable(entries)
@@ -0,0 +1,340 @@
+"""
+Declarative, concurrent deployment of views and tables: only objects that differ from their spec are touched
+"""
+
+import concurrent.futures as _futures
+import copy as _copy
+import re as _re
+import typing as _typing
+
+from google.api_core import exceptions as _exceptions
+from google.cloud import bigquery as _bigquery
+
+from toolbox import bigquery_sink as _bigquery_sink
+
+
+class ViewSpec(object):
+    """
+    The desired state of a view
+    """
+
+    table_type = "VIEW"
+
+    def __init__(
+        self,
+        name: str,
+        query: str,
+        description: str = None,
+        labels: _typing.Dict[str, str] = None,
+    ):
+        """
+        :param name: the table id of the view
+        :param query: the SQL query of the view
+        :param description: (optional) description text, left untouched if not given
+        :param labels: (optional) labels, defaults to the labels of the options
+        """
+        self.name = name
+        self.query = query
+        self.description = description
+        self.labels = labels
+        self.auto_update_table_schema = False
+
+    def to_table(self, table_ref: str) -> _bigquery.Table:
+        table = _bigquery.Table(table_ref)
+        table.view_query = self.query
+        return table
+
+
+class TableSpec(object):
+    """
+    The desired state of a (native) table, the content is not touched
+    """
+
+    table_type = "TABLE"
+
+    def __init__(
+        self,
+        name: str,
+        schema: _typing.List[_bigquery_sink.SchemaField],
+        description: str = None,
+        labels: _typing.Dict[str, str] = None,
+        table_partitioning: dict = None,
+        auto_update_table_schema: bool = True,
+        clustering_fields: _typing.List[str] = None,
+        require_partition_filter: bool = None,
+    ):
+        """
+        :param name: the table id
+        :param schema: the schema of the table
+        :param description: (optional) description text, left untouched if not given
+        :param labels: (optional) labels, defaults to the labels of the options
+        :param table_partitioning: (optional) see `bulk_sink.BQBulkSink`, only applied when the table is created
+        :param auto_update_table_schema: if False, a schema change is reported as failure instead of applied
+        :param clustering_fields: (optional) the columns the table is clustered by
+        :param require_partition_filter: (optional) whether queries have to filter on the partition column
+        """
+        self.name = name
+        self.schema = schema
+        self.description = description
+        self.labels = labels
+        self.table_partitioning = table_partitioning
+        self.auto_update_table_schema = auto_update_table_schema
+        self.clustering_fields = clustering_fields
+        self.require_partition_filter = require_partition_filter
+
+    def to_table(self, table_ref: str) -> _bigquery.Table:
+        table = _bigquery.Table(table_ref, schema=[f.to_bq_field() for f in self.schema])
+        if self.table_partitioning:
+            setattr(table, self.table_partitioning["type"], self.table_partitioning["definition"])
+        if self.clustering_fields:
+            table.clustering_fields = self.clustering_fields
+        if self.require_partition_filter is not None:
+            table.require_partition_filter = self.require_partition_filter
+        return table
+
+
+class DeploymentSummary(object):
+    def __init__(self):
+        self.created = []
+        self.updated = {}  # name -> list of changed fields
+        self.unchanged = []
+        self.failed = {}  # name -> exception
+        self.tables = {}  # name -> deployed (or planned) table
+
+    @property
+    def changed(self):
+        return sorted(self.created + list(self.updated))
+
+    def update(self, other: "DeploymentSummary"):
+        """
+        Add the results of another deployment (e.g. with other options)
+        """
+        self.created += other.created
+        self.updated.update(other.updated)
+        self.unchanged += other.unchanged
+        self.failed.update(other.failed)
+        self.tables.update(other.tables)
+
+    def raise_for_errors(self):
+        if self.failed:
+            name, error = sorted(self.failed.items())[0]
+            raise RuntimeError(
+                "Deployment of {} object(s) failed, e.g. {}: {}".format(len(self.failed), name, error)
+            ) from error
+
+    def __str__(self):
+        lines = [
+            "created {}, updated {}, unchanged {}, failed {}".format(
+                len(self.created), len(self.updated), len(self.unchanged), len(self.failed)
+            )
+        ]
+        lines += ["  created {}".format(name) for name in sorted(self.created)]
+        lines += [
+            "  updated {}: {}".format(name, ", ".join(fields)) for name, fields in sorted(self.updated.items())
+        ]
+        lines += ["  failed {}: {}".format(name, error) for name, error in sorted(self.failed.items())]
+        return "\n".join(lines)
+
+
+def _is_subset(desired, current):
+    """
+    True if all values of the (api repr) `desired` are equal in `current`
+    """
+    if isinstance(desired, dict):
+        return isinstance(current, dict) and all(
+            _is_subset(value, current.get(key)) for key, value in desired.items()
+        )
+    return desired == current
+
+
+def changed_fields(current: _bigquery.Table, desired: _bigquery.Table, spec) -> _typing.List[str]:
+    """
+    Compare the existing table with the desired one
+    :return: the table properties that have to be updated (in the order they are compared)
+    """
+    current_type = current.table_type or "TABLE"
+    if current_type != spec.table_type:
+        raise ValueError(
+            "{} is a {}, can not be deployed as {}".format(current.table_id, current_type, spec.table_type)
+        )
+
+    fields = []
+    if desired.view_query is not None and current.view_query != desired.view_query:
+        fields.append("view_query")
+
+    if desired.external_data_configuration is not None and (
+        current.external_data_configuration is None
+        or not _is_subset(
+            desired.external_data_configuration.to_api_repr(),
+            current.external_data_configuration.to_api_repr(),
+        )
+    ):
+        fields.append("external_data_configuration")
+
+    if desired.schema and _bigquery_sink.schema_repr(current.schema) != _bigquery_sink.schema_repr(
+        desired.schema
+    ):
+        if not spec.auto_update_table_schema:
+            raise ValueError("Schema not up-to-date")
+        fields.append("schema")
+
+    if desired.description is not None and current.description != desired.description:
+        fields.append("description")
+
+    if desired.labels and current.labels != desired.labels:
+        fields.append("labels")
+
+    if desired.clustering_fields is not None and current.clustering_fields != desired.clustering_fields:
+        fields.append("clustering_fields")
+
+    if desired.require_partition_filter is not None and bool(current.require_partition_filter) != bool(
+        desired.require_partition_filter
+    ):
+        fields.append("require_partition_filter")
+    return fields
+
+
+def _apply_fields(current: _bigquery.Table, desired: _bigquery.Table, fields: _typing.List[str]):
+    table = _copy.deepcopy(current)
+    for field in fields:
+        if field == "labels":
+            labels = {k: None for k in table.labels.keys()}  # make sure "old" labels are actually removed
+            labels.update(desired.labels)
+            table.labels = labels
+        else:
+            setattr(table, field, getattr(desired, field))
+    return table
+
+
+def _referenced_table_refs(query: str, default_project: str) -> _typing.Set[str]:
+    """
+    :return: the "project.dataset.table" refs of the tables / views quoted with backticks in the query
+        (`dataset.table` is completed with the default project)
+    """
+    table_refs = set()
+    for quoted in _re.findall(r"`([\w.$-]+)`", query):
+        parts = quoted.split(".")
+        if len(parts) == 2:
+            parts = [default_project] + parts
+        if len(parts) == 3:
+            table_refs.add(".".join(parts))
+    return table_refs
+
+
+def deploy(
+    specs: list,
+    options: _bigquery_sink.Options,
+    parallelism: int = 16,
+    dry_run: bool = False,
+    scopes: _typing.List[str] = None,
+) -> DeploymentSummary:
+    """
+    Bring views and tables in line with their specs:
+    1) the current state of all objects is fetched in parallel
+    2) the differences to the specs are computed (query, external config, schema, description, labels)
+    3) only missing objects are created and only changed properties are updated, concurrently:
+       tables first, then the views in the order of the objects they reference (quoted with backticks),
+       as bigquery rejects a view whose referenced objects don't exist yet
+
+    Failures do not stop the deployment of other objects, they are reported in the summary
+    (see `DeploymentSummary.raise_for_errors`).
+
+    :param specs: `ViewSpec`s and `TableSpec`s (or any object with `name`, `description`, `labels`,
+        `table_type`, `auto_update_table_schema` and `to_table(table_ref)`; an optional `table_ref`
+        attribute overrides the project & dataset of the options)
+    :param options: the access config object (project & dataset of the objects), all requests share its client
+    :param parallelism: maximal number of concurrent requests
+    :param dry_run: only compute what would change
+    :param scopes: (optional) scopes of the bigquery client
+    :return: the summary of what changed
+    """
+    if parallelism < 1:
+        raise ValueError("parallelism must be >= 1")
+    names = [spec.name for spec in specs]
+    if len(set(names)) != len(names):
+        raise ValueError("Names must be unique")
+
+    bigquery = options.get_bigquery_client(scopes=scopes)
+    summary = DeploymentSummary()
+
+    def desired_table(spec):
+        table_ref = getattr(spec, "table_ref", None) or "{}.{}.{}".format(
+            options.project_id, options.dataset_id, spec.name
+        )
+        table = spec.to_table(table_ref)
+        if spec.description is not None:
+            table.description = spec.description
+        labels = options.labels if spec.labels is None else spec.labels
+        if labels:
+            table.labels = labels
+        return table
+
+    def fetch(spec):
+        try:
+            return bigquery.get_table(desired_table(spec).reference)
+        except _exceptions.NotFound:
+            return None
+
+    def plan(spec, current):
+        desired = desired_table(spec)
+        if current is None:
+            return desired, None
+        return desired, changed_fields(current=current, desired=desired, spec=spec)
+
+    def apply(spec, current, desired, fields):
+        if dry_run:
+            return desired if current is None else _apply_fields(current, desired, fields)
+        if current is None:
+            return bigquery.create_table(desired)
+        return bigquery.update_table(table=_apply_fields(current, desired, fields), fields=fields)
+
+    with _futures.ThreadPoolExecutor(max_workers=parallelism) as executor:
+        fetches = {spec.name: executor.submit(fetch, spec) for spec in specs}
+
+        applies = {}  # name -> (spec, current, desired, fields)
+        for spec in specs:
+            try:
+                current = fetches[spec.name].result()
+                desired, fields = plan(spec, current)
+            except Exception as error:
+                summary.failed[spec.name] = error
+                continue
+            if fields == []:
+                summary.unchanged.append(spec.name)
+                summary.tables[spec.name] = current
+                continue
+            applies[spec.name] = (spec, current, desired, fields)
+
+        # views wait for all tables and the views they reference
+        names_by_ref = {
+            "{}.{}.{}".format(desired.project, desired.dataset_id, desired.table_id): name
+            for name, (_, _, desired, _) in applies.items()
+        }
+        tables = {name for name, (_, _, desired, _) in applies.items() if desired.view_query is None}
+        dependencies = {
+            name: set() if name in tables else tables | {
+                names_by_ref[table_ref]
+                for table_ref in _referenced_table_refs(desired.view_query, default_project=options.project_id)
+                if names_by_ref.get(table_ref, name) != name
+            }
+            for name, (_, _, desired, _) in applies.items()
+        }
+
+        while applies:
+            ready = [name for name in applies if not dependencies[name] & set(applies)]
+            if not ready:  # a cycle: bigquery reports the failures
+                ready = list(applies)
+            futures = {name: (applies[name][3], executor.submit(apply, *applies.pop(name))) for name in ready}
+
+            for name, (fields, future) in futures.items():
+                try:
+                    summary.tables[name] = future.result()
+                except Exception as error:
+                    summary.failed[name] = error
+                    continue
+                if fields is None:
+                    summary.created.append(name)
+                else:
+                    summary.updated[name] = fields
+
+    return summary
@@ -0,0 +1,737 @@
+"""
+In-process stand-in for the google cloud storage and bigquery clients.
+
+It implements the parts of the client surfaces that the sinks of this package use, so that
+sinks can be tested, benchmarked and stress-tested without network access:
+
+    backend = fake.FakeBackend(latency_s={"upload": 0.05, "load": 0.5}, failure_rate={"load": 0.01})
+    options = Options(project_id="project", dataset_id="dataset", temp_bucket_name="bucket", backend=backend)
+    sink = bulk_sink.BQBulkSink(table_id="table", options=options, schema=...)
+    sink.from_iterable(rows)
+    backend.rows("project.dataset.table")
+
+Queries can not be executed: `SELECT * FROM <table>` returns the rows of that table,
+anything else returns no rows unless a handler is registered with `register_query`.
+"""
+
+import copy as _copy
+import datetime as _datetime
+import gzip as _gzip
+import json as _json
+import random as _random
+import re as _re
+import threading as _threading
+import time as _time
+import typing as _typing
+
+from google.api_core import exceptions as _exceptions
+from google.cloud import bigquery as _bigquery
+
+from toolbox.bigquery_sink.utils import generate_id as _generate_id
+
+_TABLE_REF_PATTERN = r"`?([\w-]+\.[\w-]+\.[\w$-]+)`?"
+_MERGE_PATTERN = _re.compile(
+    r"^\s*MERGE\s+`([^`]+)`\s+T\s+USING\s+(?:`([^`]+)`|\((.*)\))\s+S\s+ON\s+(.*?)\s+WHEN",
+    _re.IGNORECASE | _re.DOTALL,
+)
+
+
+def _now_ms():
+    return str(int(_time.time() * 1000))
+
+
+def _table_key(table) -> _typing.Tuple[str, _typing.Optional[str]]:
+    """
+    :return: ("project.dataset.table", partition decorator or None)
+    """
+    if isinstance(table, str):
+        ref = table
+    else:  # Table or TableReference
+        ref = "{}.{}.{}".format(table.project, table.dataset_id, table.table_id)
+    ref, _, partition = ref.partition("$")
+    return ref, partition or None
+
+
+def _infer_schema(rows) -> _typing.List[_bigquery.SchemaField]:
+    """
+    Derive a schema from result rows, like bigquery does for query destination tables
+    """
+    fields = {}
+    for row in rows:
+        for key, value in row.items():
+            if key in fields or value is None:
+                continue
+            mode = "NULLABLE"
+            if isinstance(value, list):
+                if not value:
+                    continue
+                mode = "REPEATED"
+                value = value[0]
+            if isinstance(value, dict):
+                fields[key] = _bigquery.SchemaField(
+                    key, "RECORD", mode=mode, fields=_infer_schema([value])
+                )
+                continue
+            if isinstance(value, bool):
+                field_type = "BOOLEAN"
+            elif isinstance(value, int):
+                field_type = "INTEGER"
+            elif isinstance(value, float):
+                field_type = "FLOAT"
+            else:
+                field_type = "STRING"
+            fields[key] = _bigquery.SchemaField(key, field_type, mode=mode)
+    return list(fields.values())
+
+
+class FakeRow(dict):
+    """
+    Row of a query result, supports item and attribute access like bigquery's Row
+    """
+
+    def __getattr__(self, item):
+        try:
+            return self[item]
+        except KeyError:
+            raise AttributeError(item)
+
+
+class FakeRowIterator(object):
+    def __init__(self, rows):
+        self._rows = [FakeRow(row) for row in rows]
+        self.total_rows = len(self._rows)
+
+    def __iter__(self):
+        return iter(self._rows)
+
+
+class FakeJob(object):
+    """
+    A load / query / copy job. Jobs finish `latency_s` after they were created.
+    """
+
+    def __init__(self, job_id, job_type, latency_s=0.0, exception=None, **statistics):
+        self.job_id = job_id
+        self.job_type = job_type
+        self.created = _datetime.datetime.now(_datetime.timezone.utc)
+        self._finishes_at = _time.monotonic() + latency_s
+        self._exception = exception
+        self._result = statistics.pop("rows", None)
+        self.output_rows = statistics.get("output_rows")
+        self.output_bytes = statistics.get("output_bytes")
+        self.input_file_bytes = statistics.get("input_file_bytes")
+        self.total_bytes_processed = statistics.get("total_bytes_processed")
+        self.referenced_tables = statistics.get("referenced_tables", [])
+        self.destination = statistics.get("destination")
+        self.slot_millis = statistics.get("slot_millis", 0)
+        self.num_dml_affected_rows = statistics.get("num_dml_affected_rows")
+        self._properties = {"statistics": {"totalSlotMs": str(self.slot_millis)}}
+        if job_type == "copy" and self.output_rows is not None:
+            self._properties["statistics"]["copy"] = {"copiedRows": str(self.output_rows)}
+
+    @property
+    def state(self):
+        return "DONE" if self.done() else "RUNNING"
+
+    @property
+    def errors(self):
+        if self.done() and self._exception is not None:
+            return [{"reason": "backendError", "message": str(self._exception)}]
+        return None
+
+    @property
+    def error_result(self):
+        errors = self.errors
+        return errors[0] if errors else None
+
+    def done(self, *args, **kwargs):
+        return _time.monotonic() >= self._finishes_at
+
+    def running(self):
+        return not self.done()
+
+    def exception(self, timeout=None):
+        try:
+            self.result(timeout=timeout)
+        except Exception as exception:
+            return exception
+        return None
+
+    def reload(self, *args, **kwargs):
+        return self
+
+    def result(self, *args, timeout=None, **kwargs):
+        remaining = self._finishes_at - _time.monotonic()
+        if remaining > 0:
+            _time.sleep(remaining)
+        if self._exception is not None:
+            raise self._exception
+        if self.job_type == "query":
+            return FakeRowIterator(self._result or [])
+        return self
+
+
+class FakeBlob(object):
+    def __init__(self, backend, bucket_name, name):
+        self._backend = backend
+        self.bucket_name = bucket_name
+        self.name = name
+
+    @property
+    def size(self):
+        data = self._backend._blobs.get((self.bucket_name, self.name))
+        return None if data is None else len(data)
+
+    def exists(self, client=None):
+        return (self.bucket_name, self.name) in self._backend._blobs
+
+    def upload_from_file(self, file_obj, rewind=False, **kwargs):
+        if rewind:
+            file_obj.seek(0)
+        self.upload_from_string(file_obj.read())
+
+    def upload_from_filename(self, filename, **kwargs):
+        with open(filename, "rb") as file_obj:
+            self.upload_from_string(file_obj.read())
+
+    def upload_from_string(self, data, **kwargs):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self._backend._call("upload", size=len(data))
+        with self._backend._lock:
+            self._backend._blobs[(self.bucket_name, self.name)] = bytes(data)
+
+    def download_as_bytes(self, **kwargs):
+        self._backend._call("download")
+        try:
+            return self._backend._blobs[(self.bucket_name, self.name)]
+        except KeyError:
+            raise _exceptions.NotFound("gs://{}/{}".format(self.bucket_name, self.name))
+
+    def delete(self, **kwargs):
+        self._backend._call("delete_blob")
+        with self._backend._lock:
+            if self._backend._blobs.pop((self.bucket_name, self.name), None) is None:
+                raise _exceptions.NotFound("gs://{}/{}".format(self.bucket_name, self.name))
+
+
+class FakeBucket(object):
+    def __init__(self, backend, name):
+        self._backend = backend
+        self.name = name
+
+    def blob(self, blob_name, **kwargs):
+        return FakeBlob(backend=self._backend, bucket_name=self.name, name=blob_name)
+
+    def get_blob(self, blob_name, **kwargs):
+        blob = self.blob(blob_name)
+        return blob if blob.exists() else None
+
+    def list_blobs(self, prefix=None, **kwargs):
+        return self._backend.get_storage_client().list_blobs(self.name, prefix=prefix)
+
+
+class FakeStorageClient(object):
+    def __init__(self, backend):
+        self._backend = backend
+
+    def get_bucket(self, bucket_or_name, **kwargs):
+        name = getattr(bucket_or_name, "name", bucket_or_name)
+        self._backend._call("get_bucket")
+        return FakeBucket(backend=self._backend, name=name)
+
+    def bucket(self, bucket_name, **kwargs):
+        return FakeBucket(backend=self._backend, name=bucket_name)
+
+    def list_blobs(self, bucket_or_name, prefix=None, **kwargs):
+        name = getattr(bucket_or_name, "name", bucket_or_name)
+        self._backend._call("list_blobs")
+        with self._backend._lock:
+            names = sorted(
+                blob_name
+                for bucket_name, blob_name in self._backend._blobs
+                if bucket_name == name and blob_name.startswith(prefix or "")
+            )
+        return [FakeBlob(backend=self._backend, bucket_name=name, name=n) for n in names]
+
+
+class FakeDriveClient(object):
+    def __init__(self, backend):
+        self._backend = backend
+
+    def get_file(self, file_id, fields=None, **kwargs):
+        self._backend._call("get_file")
+        with self._backend._lock:
+            try:
+                return dict(self._backend.drive_files[file_id])
+            except KeyError:
+                raise _exceptions.NotFound("File not found: {}".format(file_id))
+
+
+class FakeBigQueryClient(object):
+    def __init__(self, backend, project=None):
+        self._backend = backend
+        self.project = project
+
+    # datasets
+
+    def create_dataset(self, dataset, exists_ok=False, **kwargs):
+        self._backend._call("create_dataset")
+        if isinstance(dataset, str):
+            dataset = _bigquery.Dataset(dataset)
+        ref = "{}.{}".format(dataset.project, dataset.dataset_id)
+        with self._backend._lock:
+            if ref in self._backend._datasets:
+                if not exists_ok:
+                    raise _exceptions.Conflict("Already Exists: Dataset {}".format(ref))
+                return self._backend._datasets[ref]
+            self._backend._datasets[ref] = dataset
+        return dataset
+
+    def get_dataset(self, dataset_ref, **kwargs):
+        self._backend._call("get_dataset")
+        ref = str(dataset_ref) if not hasattr(dataset_ref, "dataset_id") else "{}.{}".format(
+            dataset_ref.project, dataset_ref.dataset_id
+        )
+        try:
+            return self._backend._datasets[ref]
+        except KeyError:
+            raise _exceptions.NotFound("Not found: Dataset {}".format(ref))
+
+    # tables
+
+    def create_table(self, table, exists_ok=False, **kwargs):
+        self._backend._call("create_table")
+        if isinstance(table, (str, _bigquery.TableReference)):
+            table = _bigquery.Table(table)
+        ref, _ = _table_key(table)
+        with self._backend._lock:
+            self._backend._check_dataset(ref)
+            if ref in self._backend._tables:
+                if not exists_ok:
+                    raise _exceptions.Conflict("Already Exists: Table {}".format(ref))
+                return self._backend._copy_table(ref)
+            self._backend._check_view_query(table.view_query)
+            self._backend._store_table(ref, table, created=True)
+            self._backend._rows.setdefault(ref, [])
+            return self._backend._copy_table(ref)
+
+    def get_table(self, table, **kwargs):
+        self._backend._call("get_table")
+        ref, _ = _table_key(table)
+        with self._backend._lock:
+            if ref not in self._backend._tables:
+                raise _exceptions.NotFound("Not found: Table {}".format(ref))
+            return self._backend._copy_table(ref)
+
+    def update_table(self, table, fields, **kwargs):
+        self._backend._call("update_table")
+        ref, _ = _table_key(table)
+        with self._backend._lock:
+            if ref not in self._backend._tables:
+                raise _exceptions.NotFound("Not found: Table {}".format(ref))
+            stored = self._backend._tables[ref]
+            if "view_query" in fields:
+                self._backend._check_view_query(table.view_query)
+            new_properties = table.to_api_repr()
+            for field in fields:
+                api_field = _bigquery.Table._PROPERTY_TO_API_FIELD.get(field, field)
+                if isinstance(api_field, list):
+                    api_field = api_field[0]
+                if api_field in new_properties:
+                    stored._properties[api_field] = _copy.deepcopy(new_properties[api_field])
+                else:
+                    stored._properties.pop(api_field, None)
+                if api_field == "labels":
+                    stored._properties["labels"] = {
+                        k: v for k, v in stored._properties["labels"].items() if v is not None
+                    }
+            stored._properties["lastModifiedTime"] = _now_ms()
+            stored._properties["etag"] = _generate_id.generate_id()
+            return self._backend._copy_table(ref)
+
+    def delete_table(self, table, not_found_ok=False, **kwargs):
+        self._backend._call("delete_table")
+        ref, _ = _table_key(table)
+        with self._backend._lock:
+            if self._backend._tables.pop(ref, None) is None and not not_found_ok:
+                raise _exceptions.NotFound("Not found: Table {}".format(ref))
+            self._backend._rows.pop(ref, None)
+
+    def list_tables(self, dataset, **kwargs):
+        self._backend._call("list_tables")
+        prefix = (
+            str(dataset) if not hasattr(dataset, "dataset_id")
+            else "{}.{}".format(dataset.project, dataset.dataset_id)
+        ) + "."
+        with self._backend._lock:
+            return [
+                self._backend._copy_table(ref)
+                for ref in sorted(self._backend._tables)
+                if ref.startswith(prefix)
+            ]
+
+    # jobs
+
+    def load_table_from_uri(self, source_uris, destination, job_id=None, job_config=None, **kwargs):
+        job_id = job_id or _generate_id.generate_id()
+        if isinstance(source_uris, str):
+            source_uris = [source_uris]
+        job_config = job_config or _bigquery.LoadJobConfig()
+
+        def run():
+            rows = []
+            output_rows = 0
+            output_bytes = 0
+            input_bytes = 0
+            for uri in source_uris:
+                data = self._backend.read_uri(uri)
+                input_bytes += len(data)
+                if data[:2] == b"\x1f\x8b":
+                    data = _gzip.decompress(data)
+                output_bytes += len(data)
+                if self._backend.store_rows:
+                    rows.extend(
+                        _json.loads(line) for line in data.decode("utf-8").splitlines() if line.strip()
+                    )
+                else:
+                    output_rows += data.count(b"\n")
+            self._backend._write_rows(
+                destination=destination,
+                rows=rows,
+                write_disposition=job_config.write_disposition,
+                schema=job_config.schema,
+            )
+            return {
+                "output_rows": len(rows) if self._backend.store_rows else output_rows,
+                "output_bytes": output_bytes,
+                "input_file_bytes": input_bytes,
+                "destination": destination,
+            }
+
+        return self._backend._submit_job(job_id=job_id, job_type="load", run=run)
+
+    def copy_table(self, sources, destination, job_id=None, job_config=None, **kwargs):
+        job_id = job_id or _generate_id.generate_id()
+        if not isinstance(sources, (list, tuple)):
+            sources = [sources]
+        job_config = job_config or _bigquery.CopyJobConfig()
+
+        def run():
+            rows = []
+            for source in sources:
+                ref, partition = _table_key(source)
+                with self._backend._lock:
+                    if ref not in self._backend._tables:
+                        raise _exceptions.NotFound("Not found: Table {}".format(ref))
+                    rows.extend(
+                        row for row_partition, row in self._backend._rows.get(ref, [])
+                        if partition is None or row_partition == partition
+                    )
+            schema = None
+            first_ref, _ = _table_key(sources[0])
+            with self._backend._lock:
+                schema = self._backend._tables[first_ref].schema
+            self._backend._write_rows(
+                destination=destination,
+                rows=_copy.deepcopy(rows),
+                write_disposition=job_config.write_disposition,
+                schema=schema,
+            )
+            return {"output_rows": len(rows), "destination": destination}
+
+        return self._backend._submit_job(job_id=job_id, job_type="copy", run=run)
+
+    def query(self, query, job_config=None, job_id=None, **kwargs):
+        job_id = job_id or _generate_id.generate_id()
+        job_config = job_config or _bigquery.QueryJobConfig()
+        referenced_tables = [
+            _bigquery.TableReference.from_string(ref.partition("$")[0])
+            for ref in _re.findall(_TABLE_REF_PATTERN, query)
+        ]
+
+        def run():
+            with self._backend._lock:
+                for reference in referenced_tables:
+                    ref, _ = _table_key(reference)
+                    if ref not in self._backend._tables:
+                        raise _exceptions.NotFound("Not found: Table {}".format(ref))
+            statistics = {
+                "referenced_tables": referenced_tables,
+                "total_bytes_processed": 0,
+            }
+            if job_config.dry_run:
+                return statistics
+
+            self._backend.queries.append(query)
+            if _MERGE_PATTERN.match(query):
+                statistics["num_dml_affected_rows"] = self._backend._run_merge(
+                    query=query, job_config=job_config
+                )
+                return statistics
+            rows = self._backend._run_query(query=query, job_config=job_config)
+            statistics["rows"] = rows
+            if job_config.destination is not None:
+                self._backend._write_rows(
+                    destination=job_config.destination,
+                    rows=rows,
+                    write_disposition=job_config.write_disposition or "WRITE_EMPTY",
+                    schema=_infer_schema(rows) or None,
+                )
+                statistics["destination"] = job_config.destination
+            return statistics
+
+        return self._backend._submit_job(
+            job_id=job_id, job_type="query", run=run, dry_run=bool(job_config.dry_run)
+        )
+
+    def get_job(self, job_id, **kwargs):
+        self._backend._call("get_job")
+        job_id = getattr(job_id, "job_id", job_id)
+        try:
+            return self._backend.jobs[job_id]
+        except KeyError:
+            raise _exceptions.NotFound("Not found: Job {}".format(job_id))
+
+
+class FakeBackend(object):
+    """
+    Shared state of the fake storage and bigquery clients.
+
+    :param latency_s: seconds of latency per operation, either a float for all operations or a dict
+        operation -> seconds. Operations: upload, download, delete_blob, list_blobs, get_bucket,
+        create_dataset, get_dataset, create_table, get_table, update_table, delete_table, list_tables,
+        get_job, load, query, copy, get_file (drive). For uploads an additional `upload_bytes_per_s` can be given.
+    :param failure_rate: probability that an operation fails with `ServiceUnavailable`,
+        a float for all operations or a dict operation -> probability. Jobs fail when their result is requested.
+    :param upload_bytes_per_s: simulated upload bandwidth (None for unlimited)
+    :param store_rows: if False, loaded rows are only counted and not parsed / kept (for benchmarks and stress tests)
+    :param seed: seed for the failure injection
+    """
+
+    def __init__(
+        self,
+        latency_s: _typing.Union[float, _typing.Dict[str, float]] = 0.0,
+        failure_rate: _typing.Union[float, _typing.Dict[str, float]] = 0.0,
+        upload_bytes_per_s: _typing.Optional[float] = None,
+        store_rows: bool = True,
+        seed: _typing.Optional[int] = None,
+    ):
+        self.latency_s = latency_s
+        self.failure_rate = failure_rate
+        self.upload_bytes_per_s = upload_bytes_per_s
+        self.store_rows = store_rows
+        self.jobs = {}
+        self.queries = []
+        self.calls = {}
+        self.drive_files = {}  # file id -> metadata of the drive api, e.g. {"version": "3"}
+        self._random = _random.Random(seed)
+        self._lock = _threading.RLock()
+        self._blobs = {}
+        self._datasets = {}
+        self._tables = {}
+        self._rows = {}
+        self._query_handlers = []
+
+    # client factories, same signature as on `Options`
+
+    def get_bigquery_client(self, scopes=None):
+        return FakeBigQueryClient(backend=self)
+
+    def get_storage_client(self):
+        return FakeStorageClient(backend=self)
+
+    def get_drive_client(self):
+        return FakeDriveClient(backend=self)
+
+    # inspection & seeding
+
+    def rows(self, table_ref, partition=None) -> _typing.List[dict]:
+        """
+        :return: the rows stored in the table (optionally only the rows of the partition decorator value)
+        """
+        with self._lock:
+            return [
+                row for row_partition, row in self._rows.get(table_ref, [])
+                if partition is None or row_partition == partition
+            ]
+
+    def insert_rows(self, table_ref, rows, partition=None):
+        """
+        Put rows into an (existing) table without running a job
+        """
+        with self._lock:
+            if table_ref not in self._tables:
+                raise _exceptions.NotFound("Not found: Table {}".format(table_ref))
+            self._rows[table_ref].extend((partition, dict(row)) for row in rows)
+            self._touch(table_ref)
+
+    def blobs(self, bucket_name, prefix="") -> _typing.Dict[str, bytes]:
+        with self._lock:
+            return {
+                name: data for (bucket, name), data in self._blobs.items()
+                if bucket == bucket_name and name.startswith(prefix)
+            }
+
+    def read_uri(self, uri) -> bytes:
+        match = _re.match(r"^gs://([^/]+)/(.+)$", uri)
+        if not match:
+            raise _exceptions.BadRequest("Invalid uri {}".format(uri))
+        try:
+            return self._blobs[(match.group(1), match.group(2))]
+        except KeyError:
+            raise _exceptions.NotFound("Not found: {}".format(uri))
+
+    def register_query(self, pattern, handler):
+        """
+        Register a handler for queries matching the regex `pattern`
+        :param handler: fn(match, job_config) -> list of row dicts
+        """
+        self._query_handlers.append((_re.compile(pattern, _re.DOTALL | _re.IGNORECASE), handler))
+
+    # internals
+
+    def _option(self, value, operation):
+        if isinstance(value, dict):
+            return value.get(operation, 0.0)
+        return value or 0.0
+
+    def _call(self, operation, size=None):
+        with self._lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+            fail = self._random.random() < self._option(self.failure_rate, operation)
+        latency = self._option(self.latency_s, operation)
+        if size and self.upload_bytes_per_s and operation == "upload":
+            latency += size / self.upload_bytes_per_s
+        if latency:
+            _time.sleep(latency)
+        if fail:
+            raise _exceptions.ServiceUnavailable("Injected failure: {}".format(operation))
+
+    def _submit_job(self, job_id, job_type, run, dry_run=False):
+        with self._lock:
+            self.calls[job_type] = self.calls.get(job_type, 0) + 1
+            if job_id in self.jobs:
+                raise _exceptions.Conflict("Already Exists: Job {}".format(job_id))
+            fail = not dry_run and self._random.random() < self._option(self.failure_rate, job_type)
+
+        exception = None
+        statistics = {}
+        if fail:
+            exception = _exceptions.ServiceUnavailable("Injected failure: {}".format(job_type))
+        else:
+            try:
+                statistics = run()
+            except _exceptions.GoogleAPICallError as error:
+                exception = error
+
+        job = FakeJob(
+            job_id=job_id,
+            job_type=job_type,
+            latency_s=0.0 if dry_run else self._option(self.latency_s, job_type),
+            exception=exception,
+            **statistics,
+        )
+        with self._lock:
+            self.jobs[job_id] = job
+        return job
+
+    def _check_dataset(self, ref):
+        dataset_ref = ref.rsplit(".", 1)[0]
+        if dataset_ref not in self._datasets:
+            raise _exceptions.NotFound("Not found: Dataset {}".format(dataset_ref))
+
+    def _check_view_query(self, view_query):
+        """
+        Like bigquery: the tables / views referenced by a view must exist
+        """
+        for reference in _re.findall(_TABLE_REF_PATTERN, view_query or ""):
+            ref, _ = _table_key(reference)
+            if ref not in self._tables:
+                raise _exceptions.NotFound("Not found: Table {}".format(ref))
+
+    def _store_table(self, ref, table, created=False):
+        stored = _bigquery.Table.from_api_repr(_copy.deepcopy(table.to_api_repr()))
+        stored._properties["tableReference"] = _bigquery.TableReference.from_string(ref).to_api_repr()
+        if created:
+            stored._properties["creationTime"] = _now_ms()
+        stored._properties["lastModifiedTime"] = _now_ms()
+        stored._properties["etag"] = _generate_id.generate_id()
+        if table.view_query:
+            stored._properties.setdefault("type", "VIEW")
+        elif table.external_data_configuration is not None:
+            stored._properties.setdefault("type", "EXTERNAL")
+        else:
+            stored._properties.setdefault("type", "TABLE")
+        self._tables[ref] = stored
+
+    def _copy_table(self, ref):
+        stored = self._tables[ref]
+        stored._properties["numRows"] = str(len(self._rows.get(ref, [])))
+        return _bigquery.Table.from_api_repr(_copy.deepcopy(stored.to_api_repr()))
+
+    def _touch(self, ref):
+        self._tables[ref]._properties["lastModifiedTime"] = _now_ms()
+
+    def _write_rows(self, destination, rows, write_disposition, schema):
+        ref, partition = _table_key(destination)
+        with self._lock:
+            self._check_dataset(ref)
+            if ref not in self._tables:
+                self._store_table(ref, _bigquery.Table(ref, schema=schema), created=True)
+                self._rows[ref] = []
+
+            existing = self._rows[ref]
+            in_scope = any(partition is None or entry[0] == partition for entry in existing)
+            if write_disposition == _bigquery.WriteDisposition.WRITE_EMPTY and in_scope:
+                raise _exceptions.BadRequest(
+                    "Table {} is not empty, write disposition WRITE_EMPTY".format(ref)
+                )
+            if write_disposition == _bigquery.WriteDisposition.WRITE_TRUNCATE:
+                existing[:] = [
+                    entry for entry in existing if partition is not None and entry[0] != partition
+                ]
+                if schema and partition is None:
+                    self._tables[ref].schema = schema
+            existing.extend((partition, dict(row)) for row in rows)
+            self._touch(ref)
+
+    def _run_merge(self, query, job_config):
+        """
+        Emulates the MERGE statements of `bulk_sink.build_merge_query` (the partition filter is ignored)
+        :return: the number of affected rows
+        """
+        target, source_ref, source_query, condition = _MERGE_PATTERN.match(query).groups()
+        keys = _re.findall(r"T\.`(\w+)` = S\.`\1`", condition)
+        if source_ref:
+            source_rows = _copy.deepcopy(self.rows(source_ref))
+        else:
+            source_rows = self._run_query(query=source_query.strip(), job_config=job_config)
+
+        with self._lock:
+            existing = self._rows[target]
+            by_key = {tuple(row.get(key) for key in keys): row for _, row in existing}
+            for row in source_rows:
+                match = by_key.get(tuple(row.get(key) for key in keys))
+                if match is not None:
+                    match.update(row)
+                else:
+                    existing.append((None, dict(row)))
+            self._touch(target)
+        return len(source_rows)
+
+    def _run_query(self, query, job_config):
+        for pattern, handler in self._query_handlers:
+            match = pattern.search(query)
+            if match:
+                return [dict(row) for row in handler(match, job_config)]
+
+        match = _re.match(
+            r"^\s*SELECT\s+\*\s+FROM\s+" + _TABLE_REF_PATTERN + r"\s*;?\s*$",
+            query,
+            _re.IGNORECASE,
+        )
+        if match:
+            ref, _, partition = match.group(1).partition("$")
+            return _copy.deepcopy(self.rows(ref, partition=partition or None))
+        return []
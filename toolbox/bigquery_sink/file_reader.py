@@ -0,0 +1,211 @@
+"""
+Parallel, chunked reading of newline delimited json and csv files into encoded rows for `BQBulkSink`
+"""
+
+import collections as _collections
+import concurrent.futures as _futures
+import csv as _csv
+import io as _io
+import json as _json
+import mmap as _mmap
+import multiprocessing as _multiprocessing
+import os as _os
+import time as _time
+import typing as _typing
+
+from toolbox import bigquery_sink as _bigquery_sink
+from toolbox.bigquery_sink import pipeline as _pipeline
+
+DEFAULT_CHUNK_BYTES = 16 * 1024 * 1024
+
+# state of a worker process, set by `_init_worker`
+_worker = {}
+
+
+def split_chunks(path: str, chunk_bytes: int = DEFAULT_CHUNK_BYTES, skip_first_line: bool = False):
+    """
+    Split a file into chunks of roughly `chunk_bytes` that end on line boundaries
+    :param path: path of the file
+    :param chunk_bytes: target size of the chunks
+    :param skip_first_line: don't include the first line (csv header)
+    :return: list of (start, end) byte offsets
+    """
+    size = _os.path.getsize(path)
+    if size == 0:
+        return []
+
+    chunks = []
+    with open(path, "rb") as file_obj:
+        with _mmap.mmap(file_obj.fileno(), 0, access=_mmap.ACCESS_READ) as mm:
+            start = 0
+            if skip_first_line:
+                newline = mm.find(b"\n")
+                start = size if newline == -1 else newline + 1
+            while start < size:
+                newline = mm.find(b"\n", min(start + chunk_bytes, size) - 1)
+                end = size if newline == -1 else newline + 1
+                chunks.append((start, end))
+                start = end
+    return chunks
+
+
+def read_csv_header(path: str, delimiter: str = ",", encoding: str = "utf-8") -> _typing.List[str]:
+    with open(path, "r", encoding=encoding, newline="") as file_obj:
+        return next(_csv.reader(file_obj, delimiter=delimiter), [])
+
+
+def _parse_jsonl(text):
+    loads = _json.loads
+    for line in text.split("\n"):  # not splitlines: json strings may contain other line separators
+        if line.strip():
+            yield loads(line)
+
+
+def _parse_csv(text):
+    fieldnames = _worker["csv_fieldnames"]
+    for values in _csv.reader(_io.StringIO(text, newline=""), delimiter=_worker["csv_delimiter"]):
+        if not values:
+            continue
+        yield {name: (value if value != "" else None) for name, value in zip(fieldnames, values)}
+
+
+_PARSERS = {"jsonl": _parse_jsonl, "csv": _parse_csv}
+
+
+def _init_worker(
+    path,
+    file_format,
+    schema,
+    force_values,
+    should_ensure_type,
+    should_fire_exception,
+    json_default_fn,
+    encoding,
+    csv_fieldnames=None,
+    csv_delimiter=",",
+):
+    _worker.clear()
+    _worker.update(
+        path=path,
+        parse=_PARSERS[file_format],
+        schema=schema,
+        force_values=force_values,
+        should_ensure_type=should_ensure_type,
+        should_fire_exception=should_fire_exception,
+        json_default_fn=json_default_fn,
+        encoding=encoding,
+        csv_fieldnames=csv_fieldnames,
+        csv_delimiter=csv_delimiter,
+    )
+
+
+def _encode_chunk(start, end):
+    """
+    Parse, extract and encode the rows of one chunk (runs in the worker processes)
+    :return: (newline delimited json bytes, number of rows, seconds spent)
+    """
+    clock = _time.perf_counter
+    begin = clock()
+    with open(_worker["path"], "rb") as file_obj:
+        with _mmap.mmap(file_obj.fileno(), 0, access=_mmap.ACCESS_READ) as mm:
+            text = mm[start:end].decode(_worker["encoding"])
+
+    dumps = _json.JSONEncoder(default=_worker["json_default_fn"]).encode
+    rows = _pipeline.iter_extracted(
+        schema=_worker["schema"],
+        rows=_worker["parse"](text),
+        force_values=_worker["force_values"],
+        should_ensure_type=_worker["should_ensure_type"],
+        should_fire_exception=_worker["should_fire_exception"],
+    )
+    lines = [dumps(row) for row in rows]
+
+    data = ("\n".join(lines) + "\n").encode("utf-8") if lines else b""
+    return data, len(lines), clock() - begin
+
+
+def _mp_context():
+    """
+    Prefer fork: the schema (incl. source_fn lambdas) is inherited by the workers instead of pickled
+    """
+    if "fork" in _multiprocessing.get_all_start_methods():
+        return _multiprocessing.get_context("fork")
+    return _multiprocessing.get_context()
+
+
+def iter_encoded_chunks(
+    path: str,
+    file_format: str,
+    schema: _typing.List[_bigquery_sink.SchemaField],
+    force_values: dict = None,
+    should_ensure_type: bool = True,
+    should_fire_exception: bool = False,
+    json_default_fn=None,
+    workers: int = None,
+    chunk_bytes: int = DEFAULT_CHUNK_BYTES,
+    encoding: str = "utf-8",
+    csv_delimiter: str = ",",
+):
+    """
+    Read a file in chunks that are parsed, extracted and encoded in parallel worker processes.
+    The chunks are yielded in file order; at most 2 chunks per worker are in flight (bounded memory).
+    On platforms without `fork` the schema, force values and `json_default_fn` have to be picklable.
+
+    :param path: path of the file
+    :param file_format: "jsonl" (newline delimited json) or "csv" (with header line,
+        quoted values must not contain line breaks, empty values are read as null)
+    :param schema: the schema fields to extract
+    :param force_values: static values added to every row
+    :param should_ensure_type: see `SchemaField.extract`
+    :param should_fire_exception: see `SchemaField.extract`
+    :param json_default_fn: fn to encode values the json module does not know
+    :param workers: number of worker processes (default: number of cpus), 0 or 1 to work in this process
+    :param chunk_bytes: target size of the chunks
+    :param encoding: encoding of the file
+    :param csv_delimiter: delimiter of csv files
+    :return: generator of (bytes, number of rows, seconds spent by the worker)
+    """
+    if file_format not in _PARSERS:
+        raise ValueError("Unknown file format {}, use one of {}".format(file_format, sorted(_PARSERS)))
+
+    init_args = (
+        path,
+        file_format,
+        list(schema),
+        force_values,
+        should_ensure_type,
+        should_fire_exception,
+        json_default_fn,
+        encoding,
+    )
+    if file_format == "csv":
+        init_args += (read_csv_header(path, delimiter=csv_delimiter, encoding=encoding), csv_delimiter)
+
+    chunks = split_chunks(path, chunk_bytes=chunk_bytes, skip_first_line=file_format == "csv")
+    if workers is None:
+        workers = _os.cpu_count() or 1
+
+    if workers <= 1 or len(chunks) <= 1:
+        _init_worker(*init_args)
+        for start, end in chunks:
+            yield _encode_chunk(start, end)
+        return
+
+    with _futures.ProcessPoolExecutor(
+        max_workers=min(workers, len(chunks)),
+        mp_context=_mp_context(),
+        initializer=_init_worker,
+        initargs=init_args,
+    ) as executor:
+        in_flight = _collections.deque()
+        pending = iter(chunks)
+        for start, end in pending:
+            in_flight.append(executor.submit(_encode_chunk, start, end))
+            if len(in_flight) >= 2 * workers:
+                break
+        while in_flight:
+            result = in_flight.popleft().result()
+            for start, end in pending:
+                in_flight.append(executor.submit(_encode_chunk, start, end))
+                break
+            yield result
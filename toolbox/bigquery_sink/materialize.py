@@ -0,0 +1,223 @@
+"""
+Concurrent, dependency aware materialization of queries into tables
+"""
+
+import datetime as _datetime
+import time as _time
+import typing as _typing
+
+from toolbox import bigquery_sink as _bigquery_sink
+from toolbox.bigquery_sink import bulk_sink as _bulk_sink
+
+
+class Materialization(object):
+    """
+    A query that should be written into a table (named like the materialization)
+    """
+
+    def __init__(
+        self,
+        name: str,
+        query: str,
+        depends_on: _typing.List[str] = None,
+        write_disposition: _bulk_sink.WriteDisposition = _bulk_sink.WriteDisposition.REPLACE,
+        table_partitioning: dict = None,
+        clustering_fields: _typing.List[str] = None,
+        table_description: str = None,
+        schema: _typing.List[_bigquery_sink.SchemaField] = None,
+        auto_update_table_schema: bool = True,
+        labels: _typing.Dict[str, str] = None,
+        skip_if_unchanged: bool = False,
+        require_partition_filter: bool = None,
+    ):
+        """
+        :param name: the table id of the destination table
+        :param query: the SQL query that creates the table content
+        :param depends_on: names of other materializations that have to be finished before this one can start
+        :param write_disposition: see `bulk_sink.WriteDisposition`
+        :param table_partitioning: see `bulk_sink.BQBulkSink`
+        :param clustering_fields: see `bulk_sink.BQBulkSink`
+        :param table_description: see `bulk_sink.BQBulkSink`
+        :param schema: see `bulk_sink.BQBulkSink`
+        :param auto_update_table_schema: see `bulk_sink.BQBulkSink`
+        :param labels: (optional) labels attached to the query job
+        :param skip_if_unchanged: don't run the query if its input tables did not change, see `BQBulkSink.from_query`
+        :param require_partition_filter: see `bulk_sink.BQBulkSink`
+        """
+        self.name = name
+        self.query = query
+        self.depends_on = list(depends_on or [])
+        self.write_disposition = write_disposition
+        self.table_partitioning = table_partitioning
+        self.clustering_fields = clustering_fields
+        self.table_description = table_description
+        self.schema = schema
+        self.auto_update_table_schema = auto_update_table_schema
+        self.labels = labels
+        self.skip_if_unchanged = skip_if_unchanged
+        self.require_partition_filter = require_partition_filter
+
+    def create_sink(self, options: _bigquery_sink.Options) -> _bulk_sink.BQBulkSink:
+        return _bulk_sink.BQBulkSink(
+            table_id=self.name,
+            options=options,
+            table_partitioning=self.table_partitioning,
+            clustering_fields=self.clustering_fields,
+            table_description=self.table_description,
+            schema=self.schema,
+            write_disposition=self.write_disposition,
+            auto_update_table_schema=self.auto_update_table_schema,
+            require_partition_filter=self.require_partition_filter,
+        )
+
+
+class MaterializationState(object):
+    PENDING = "PENDING"
+    RUNNING = "RUNNING"
+    DONE = "DONE"
+    FAILED = "FAILED"
+    SKIPPED = "SKIPPED"  # because a dependency failed
+
+
+class MaterializationResult(object):
+    def __init__(self, name):
+        self.name = name
+        self.state = MaterializationState.PENDING
+        self.rows_written = None
+        self.error = None
+        self.skipped = False  # DONE without running the query, because the inputs did not change
+        self.started = None
+        self.ended = None
+
+    def __repr__(self):
+        return "<MaterializationResult {} {}>".format(self.name, self.state)
+
+
+def _check_dependencies(materializations: _typing.List[Materialization]):
+    names = [m.name for m in materializations]
+    if len(set(names)) != len(names):
+        raise ValueError("Materialization names must be unique")
+
+    by_name = {m.name: m for m in materializations}
+    for materialization in materializations:
+        for dependency in materialization.depends_on:
+            if dependency not in by_name:
+                raise ValueError(
+                    "{} depends on unknown materialization {}".format(materialization.name, dependency)
+                )
+
+    # detect cycles (depth first search)
+    visiting, visited = set(), set()
+
+    def visit(name, chain):
+        if name in visited:
+            return
+        if name in visiting:
+            raise ValueError("Dependency cycle: {}".format(" -> ".join(chain + [name])))
+        visiting.add(name)
+        for dependency in by_name[name].depends_on:
+            visit(dependency, chain + [name])
+        visiting.discard(name)
+        visited.add(name)
+
+    for name in names:
+        visit(name, [])
+
+
+def materialize(
+    materializations: _typing.List[Materialization],
+    options: _bigquery_sink.Options,
+    parallelism: int = 8,
+    poll_interval_s: float = 1.0,
+) -> _typing.Dict[str, MaterializationResult]:
+    """
+    Run query materializations concurrently while respecting their dependencies.
+    Independent queries are submitted as soon as a slot is free (up to `parallelism` running jobs),
+    running jobs are polled together and failures mark all (transitive) dependents as SKIPPED.
+    All jobs share the clients of `options`.
+
+    :param materializations: the materializations to run
+    :param options: the access config object (project & dataset of the destination tables)
+    :param parallelism: maximal number of concurrently running query jobs
+    :param poll_interval_s: seconds to wait between polling the running jobs
+    :return: dict name -> MaterializationResult
+    """
+    if parallelism < 1:
+        raise ValueError("parallelism must be >= 1")
+    _check_dependencies(materializations)
+
+    results = {m.name: MaterializationResult(name=m.name) for m in materializations}
+    pending = list(materializations)
+    running = {}  # name -> (sink, job, labels of the table)
+
+    def finish(name, state, error=None):
+        result = results[name]
+        result.state = state
+        result.error = error
+        result.ended = _datetime.datetime.now(_datetime.timezone.utc)
+
+    while pending or running:
+        # propagate failures and start everything that is ready
+        for materialization in list(pending):
+            dependency_states = [results[d].state for d in materialization.depends_on]
+            if any(
+                state in (MaterializationState.FAILED, MaterializationState.SKIPPED)
+                for state in dependency_states
+            ):
+                pending.remove(materialization)
+                finish(materialization.name, MaterializationState.SKIPPED)
+                continue
+
+            if len(running) >= parallelism:
+                continue
+            if all(state == MaterializationState.DONE for state in dependency_states):
+                pending.remove(materialization)
+                result = results[materialization.name]
+                result.started = _datetime.datetime.now(_datetime.timezone.utc)
+                result.state = MaterializationState.RUNNING
+                try:
+                    sink = materialization.create_sink(options=options)
+                    table_labels = None
+                    if materialization.skip_if_unchanged:
+                        if sink._query_is_unchanged(query=materialization.query):
+                            result.skipped = True
+                            result.rows_written = 0
+                            finish(materialization.name, MaterializationState.DONE)
+                            continue
+                        table_labels = sink._lineage_labels(query=materialization.query)
+                    job = sink._submit_query(
+                        query=materialization.query, labels=materialization.labels
+                    )
+                except Exception as error:
+                    finish(materialization.name, MaterializationState.FAILED, error)
+                    continue
+                running[materialization.name] = (sink, job, table_labels)
+
+        if not running:
+            continue
+
+        finished = []
+        polling_failed = False
+        for name, (_, job, _) in list(running.items()):
+            try:
+                if job.done():
+                    finished.append(name)
+            except Exception as error:  # e.g. the reload of a failed job or an api error: only this one fails
+                running.pop(name)
+                finish(name, MaterializationState.FAILED, error)
+                polling_failed = True
+
+        for name in finished:
+            sink, job, table_labels = running.pop(name)
+            try:
+                sink._finish_query(query_job=job, table_labels=table_labels)
+            except Exception as error:
+                finish(name, MaterializationState.FAILED, error)
+            else:
+                results[name].rows_written = sink.rows_written
+                finish(name, MaterializationState.DONE)
+
+        if not finished and not polling_failed:
+            _time.sleep(poll_interval_s)
+
+    return results
@@ -0,0 +1,139 @@
+"""
+Lazy, streaming extraction of rows with the `SchemaField` machinery - independent of bigquery
+"""
+
+import time as _time
+import typing as _typing
+
+from toolbox import bigquery_sink as _bigquery_sink
+from toolbox.bigquery_sink import stats as _stats
+
+
+def iter_extracted(
+    schema: _typing.List[_bigquery_sink.SchemaField],
+    rows: _typing.Iterable,
+    force_values: dict = None,
+    should_ensure_type: bool = True,
+    should_fire_exception: bool = False,
+    profiler=None,
+    stats: _stats.SinkStats = None,
+    on_error: _typing.Callable[[_typing.Any, int, Exception], None] = None,
+) -> _typing.Iterator[dict]:
+    """
+    Lazily extract rows: yields one dict field name -> extracted value per source row (memory stays constant)
+    :param schema: the schema fields to extract
+    :param rows: the source rows (any iterable, consumed lazily)
+    :param force_values: Provide a dict of key value pairs that is going to be added to each row
+    :param should_ensure_type: whether the types should be cast so that BigQuery can understand them
+    :param should_fire_exception: whether exceptions should be fired or caught silently
+    :param profiler: (optional) a `profiler.ExtractionProfiler` to record time spent per field (on sampled rows)
+    :param stats: (optional) the time spent extracting is added to the "extract" stage (once the generator is done)
+    :param on_error: (optional) fn(row, offset, exception) called for rows whose extraction raised
+        (see `should_fire_exception`), these rows are skipped. Without it the exception is raised.
+        `bigquery_sink.exception_field_path(exception)` tells which field failed.
+    """
+    schema = list(schema)
+    clock = _time.perf_counter
+    extract_s = 0.0
+    extracted = 0
+    try:
+        for offset, row in enumerate(rows):
+            start = clock()
+            row_profiler = profiler if profiler is not None and profiler.sample() else None
+            to_write = {}
+            try:
+                for field in schema:
+                    to_write[field.name] = field.extract(
+                        row,
+                        should_ensure_type=should_ensure_type,
+                        should_fire_exception=should_fire_exception,
+                        profiler=row_profiler,
+                    )
+            except Exception as exception:
+                if on_error is None:
+                    raise
+                on_error(row, offset, exception)
+                extract_s += clock() - start
+                continue
+
+            if force_values:
+                for key, val in force_values.items():
+                    to_write[key] = val
+            extract_s += clock() - start
+            extracted += 1
+            yield to_write
+    finally:
+        if stats is not None:
+            stats.add_wall_time("extract", extract_s, calls=extracted)
+
+
+class Pipeline(object):
+    """
+    Chain of lazy stages over an iterable of rows, e.g.
+
+        Pipeline(rows).filter(is_valid).extract(schema).map(enrich).write_to(sink)
+
+    Every stage returns a new pipeline; rows are pulled one by one through all stages
+    when the pipeline is iterated (pipelines over generators can only be consumed once).
+    """
+
+    def __init__(self, rows: _typing.Iterable):
+        self._rows = rows
+
+    def __iter__(self):
+        return iter(self._rows)
+
+    def map(self, fn: _typing.Callable[[_typing.Any], _typing.Any]) -> "Pipeline":
+        """
+        :param fn: fn(row) -> new row
+        """
+        return Pipeline(map(fn, self._rows))
+
+    def filter(self, fn: _typing.Callable[[_typing.Any], bool]) -> "Pipeline":
+        """
+        :param fn: fn(row) -> whether the row is kept
+        """
+        return Pipeline(filter(fn, self._rows))
+
+    def extract(
+        self,
+        schema: _typing.List[_bigquery_sink.SchemaField],
+        force_values: dict = None,
+        should_ensure_type: bool = True,
+        should_fire_exception: bool = False,
+        profiler=None,
+        stats: _stats.SinkStats = None,
+        on_error=None,
+    ) -> "Pipeline":
+        """
+        Extract the rows according to the schema, see `iter_extracted`
+        """
+        return Pipeline(
+            iter_extracted(
+                schema=schema,
+                rows=self._rows,
+                force_values=force_values,
+                should_ensure_type=should_ensure_type,
+                should_fire_exception=should_fire_exception,
+                profiler=profiler,
+                stats=stats,
+                on_error=on_error,
+            )
+        )
+
+    def write_to(self, target) -> int:
+        """
+        Consume the pipeline
+        :param target: a writer fn(row) (e.g. from `BQBulkSink.open()`) or an object with an `open()`
+            context manager that returns such a writer (e.g. a `BQBulkSink`; rows have to be extracted already)
+        :return: the number of rows written
+        """
+        if hasattr(target, "open"):
+            with target.open() as write:
+                return self.write_to(write)
+
+        rows_written = 0
+        for row in self._rows:
+            target(row)
+            rows_written += 1
+        return rows_written
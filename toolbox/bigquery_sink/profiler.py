@@ -0,0 +1,134 @@
+"""
+Opt-in per field profiling of `SchemaField.extract`
+"""
+
+import time as _time
+
+
+class FieldProfile(object):
+    """
+    Accumulated measurements of one field path
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.calls = 0
+        self.total_s = 0.0
+        self.missing = 0
+        self.exceptions = 0
+
+
+class ExtractionProfiler(object):
+    """
+    Records cumulative time, call counts, missing values and exceptions per field path.
+    Times are inclusive: a STRUCT field contains the time of its sub fields.
+
+    Usage:
+        profiler = ExtractionProfiler(sample_every=100)  # profile every 100th row
+        sink.from_iterable(rows, profiler=profiler)
+        print(profiler.report())
+    """
+
+    def __init__(self, sample_every: int = 1):
+        """
+        :param sample_every: only every Nth row is profiled (see `sample`), the others are extracted without overhead
+        """
+        if sample_every < 1:
+            raise ValueError("sample_every must be >= 1")
+        self.sample_every = sample_every
+        self.rows_seen = 0
+        self.rows_profiled = 0
+        self.fields = {}
+        self.current_field = None
+        self._stack = []
+
+    def sample(self):
+        """
+        Call once per row
+        :return: whether this row should be profiled
+        """
+        self.rows_seen += 1
+        if (self.rows_seen - 1) % self.sample_every:
+            return False
+        self.rows_profiled += 1
+        return True
+
+    def profile_field(self, field, row, path, should_ensure_type, should_fire_exception, repeated_copy=False):
+        """
+        Extract the value of `field` (called by `SchemaField._extract_inner`) and record the measurements
+        """
+        parent_field, parent_path = self._stack[-1] if self._stack else (None, None)
+
+        if repeated_copy:
+            # copies created via `replace` during the extraction of REPEATED fields are
+            # accounted for in the entry of the original field
+            profile = None
+            field_path = parent_path
+        else:
+            field_path = field.name if parent_path is None else parent_path + "." + field.name
+            profile = self.fields.get(field_path)
+            if profile is None:
+                profile = self.fields[field_path] = FieldProfile(path=field_path)
+
+        self._stack.append((field, field_path))
+        self.current_field = field
+        start = _time.perf_counter()
+        try:
+            value = field._extract_inner(
+                row,
+                path=path,
+                should_ensure_type=should_ensure_type,
+                should_fire_exception=should_fire_exception,
+                profiler=self,
+                repeated_copy=repeated_copy,
+            )
+        finally:
+            elapsed = _time.perf_counter() - start
+            self._stack.pop()
+            self.current_field = self._stack[-1][0] if self._stack else None
+            if profile is not None:
+                profile.calls += 1
+                profile.total_s += elapsed
+
+        if profile is not None and (value is None or (isinstance(value, list) and not value)):
+            profile.missing += 1
+        return value
+
+    def record_exception(self, field):
+        if self._stack and self._stack[-1][0] is field:
+            self.fields[self._stack[-1][1]].exceptions += 1
+
+    def ranked(self):
+        """
+        :return: list of FieldProfile, most expensive first
+        """
+        return sorted(self.fields.values(), key=lambda p: p.total_s, reverse=True)
+
+    def report(self, limit: int = 25):
+        """
+        :param limit: number of field paths to show
+        :return: a human readable table of the most expensive field paths
+        """
+        lines = [
+            "profiled {} of {} rows".format(self.rows_profiled, self.rows_seen),
+            "{:<50} {:>10} {:>12} {:>10} {:>10} {:>10}".format(
+                "field", "calls", "total ms", "avg us", "missing", "errors"
+            ),
+        ]
+        for profile in self.ranked()[:limit]:
+            lines.append(
+                "{:<50} {:>10} {:>12.3f} {:>10.2f} {:>10} {:>10}".format(
+                    profile.path,
+                    profile.calls,
+                    profile.total_s * 1e3,
+                    profile.total_s * 1e6 / profile.calls if profile.calls else 0.0,
+                    profile.missing,
+                    profile.exceptions,
+                )
+            )
+        return "\n".join(lines)
+
+    def reset(self):
+        self.rows_seen = 0
+        self.rows_profiled = 0
+        self.fields = {}
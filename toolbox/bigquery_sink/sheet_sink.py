@@ -1,8 +1,41 @@
 import re as _re
 import typing as _typing
 
+from google.api_core import exceptions as _exceptions
 from google.cloud import bigquery as _bigquery
 from toolbox import bigquery_sink as _bigquery_sink
+from toolbox.bigquery_sink import bulk_sink as _bulk_sink
+from toolbox.bigquery_sink import deploy as _deploy
+
+CONTENT_HASH_LABEL = "bqsink_content_hash"
+# label next to the content hash: the version of the spreadsheet file the snapshot was taken from
+SHEET_VERSION_LABEL = "bqsink_sheet_version"
+DRIVE_SCOPES = ["https://www.googleapis.com/auth/drive"]
+SHEET_SCOPES = DRIVE_SCOPES + ["https://www.googleapis.com/auth/bigquery"]
+DRIVE_FILES_URL = "https://www.googleapis.com/drive/v3/files/{}"
+
+
+class DriveClient(object):
+    """
+    Minimal client of the Drive API (v3): reads the metadata of files, see `Options.get_drive_client`
+    """
+
+    def __init__(self, project=None, credentials=None):
+        from google.auth.transport import requests as _requests
+
+        self.project = project
+        self._session = _requests.AuthorizedSession(credentials)
+
+    def get_file(self, file_id, fields="id,version,modifiedTime"):
+        """
+        :return: the requested fields of the file's metadata as dict
+        """
+        response = self._session.get(
+            DRIVE_FILES_URL.format(file_id), params={"fields": fields, "supportsAllDrives": "true"}
+        )
+        if response.status_code >= 400:
+            raise _exceptions.from_http_response(response)
+        return response.json()
 
 
 class SheetRange(object):
@@ -29,6 +62,36 @@ class SheetRange(object):
     def _escape_string(input_str):
         return "'{}'".format(input_str.replace("'", "''"))
 
+    def problems(self):
+        """
+        :return: list of reasons why this range is invalid (empty if it is valid)
+        """
+        problems = []
+        for column in (self.first_column, self.last_column):
+            if not _re.fullmatch(r'[a-zA-Z]+', column):
+                problems.append('invalid column {!r}'.format(column))
+        if not problems and _column_index(self.first_column) > _column_index(self.last_column):
+            problems.append('first column {} is after last column {}'.format(self.first_column, self.last_column))
+        if self.last_row is not None and self.last_row < self.first_row:
+            problems.append('first row {} is after last row {}'.format(self.first_row, self.last_row))
+        return problems
+
+    def overlaps(self, other):
+        """
+        :return: True if both ranges share at least one cell (of the same tab)
+        """
+        if self.tab != other.tab:
+            return False
+        columns_overlap = (
+            _column_index(self.first_column) <= _column_index(other.last_column)
+            and _column_index(other.first_column) <= _column_index(self.last_column)
+        )
+        rows_overlap = (
+            (other.last_row is None or self.first_row <= other.last_row)
+            and (self.last_row is None or other.first_row <= self.last_row)
+        )
+        return columns_overlap and rows_overlap
+
     def __str__(self):
         return '{tab}!{c1}{r1}:{c2}{r2}'.format(
             tab=self._escape_string(self.tab),
@@ -39,6 +102,16 @@ class SheetRange(object):
         )
 
 
+def _column_index(column):
+    """
+    "A" -> 1, "Z" -> 26, "AA" -> 27
+    """
+    index = 0
+    for char in column.upper():
+        index = index * 26 + ord(char) - ord("A") + 1
+    return index
+
+
 class BQSheetSink(object):
     """
     Data Sink for loading chunks of rows into bigquery (not streaming insert!)
@@ -69,24 +142,27 @@ class BQSheetSink(object):
         self.table_description = table_description
         self.auto_update_table_schema = auto_update_table_schema
 
-        self.bigquery = options.get_bigquery_client(
-            scopes=[
-                "https://www.googleapis.com/auth/drive",
-                "https://www.googleapis.com/auth/bigquery",
-            ]
-        )
+        self.bigquery = options.get_bigquery_client(scopes=SHEET_SCOPES)
 
-    def create_bq_table(self, exists_ok=True):
+    def to_table(self, table_ref=None):
+        """
+        :return: the desired external table (not created)
+        """
         bq_schema = (
             None if self.schema is None else [f.to_bq_field() for f in self.schema]
         )
-        table = _bigquery.Table(table_ref=self.table_ref, schema=bq_schema)
+        table = _bigquery.Table(table_ref=table_ref or self.table_ref, schema=bq_schema)
         external_config = _bigquery.ExternalConfig(
             _bigquery.ExternalSourceFormat.GOOGLE_SHEETS
         )
         external_config.source_uris = [self.sheet_url]
         external_config.options.range = str(self.sheet_range)
         table.external_data_configuration = external_config
+        return table
+
+    def create_bq_table(self, exists_ok=True):
+        table = self.to_table()
+        external_config = table.external_data_configuration
         table = self.bigquery.create_table(table, exists_ok=exists_ok)
 
         table = _bigquery_sink.check_and_update_external_config(
@@ -109,3 +185,165 @@ class BQSheetSink(object):
             bigquery=self.bigquery,
         )
         return table
+
+    def content_hash(self):
+        """
+        Hash over the current content of the sheet (reads the sheet once through the external table)
+        :return: the hash as string that can be used as label value
+        """
+        query = (
+            "SELECT FARM_FINGERPRINT(STRING_AGG(TO_JSON_STRING(t), '\\n' ORDER BY TO_JSON_STRING(t))) "
+            "AS content_hash FROM `{}` t".format(self.table_ref)
+        )
+        rows = list(self.bigquery.query(query=query).result())
+        content_hash = rows[0]["content_hash"] if rows else None
+        return "empty" if content_hash is None else str(content_hash)
+
+    def file_version(self):
+        """
+        The version of the spreadsheet file (it increases with every change of the file), read from the Drive API
+        :return: the version as string that can be used as label value, None if it is not available
+        """
+        match = _re.search(r"/d/([\w-]+)", self.sheet_url)
+        if not match:
+            return None
+        try:
+            return str(self.options.get_drive_client().get_file(match.group(1), fields="version")["version"])
+        except (_exceptions.GoogleAPICallError, KeyError):  # e.g. the drive api is not enabled: hash every time
+            return None
+
+    def materialize(self, native_table_id: str = None, force: bool = False):
+        """
+        Snapshot the sheet into a native table, so that queries don't have to read the sheet through the Drive API.
+        The snapshot is only refreshed if the content of the sheet changed: the version of the file and the
+        content hash of the last snapshot are stored as labels `SHEET_VERSION_LABEL` / `CONTENT_HASH_LABEL` on the
+        native table. The sheet is only read (to compute the hash) if the version of the file changed, e.g. an
+        edit of another tab changes the version but not the hash.
+        The external table is created / updated first (see `create_bq_table`).
+
+        :param native_table_id: the table id of the snapshot, defaults to "<table_id>_native"
+        :param force: refresh even if the content did not change
+        :return: True if the native table was (re)written
+        """
+        self.create_bq_table()
+        native_table_id = native_table_id or "{}_native".format(self.table_id)
+
+        sink = _bulk_sink.BQBulkSink(
+            table_id=native_table_id,
+            options=self.options,
+            schema=self.schema,
+            table_description=self.table_description,
+            write_disposition=_bulk_sink.WriteDisposition.REPLACE,
+            auto_update_table_schema=True,
+            bq_client_scopes=SHEET_SCOPES,  # reading the sheet requires the drive scope
+        )
+
+        file_version = self.file_version()  # before the content is read: a later change shows up as new version
+        content_hash = None
+        if not force:
+            try:
+                native_table = self.bigquery.get_table(sink.table_ref)
+            except _exceptions.NotFound:
+                native_table = None
+            if native_table is not None:
+                labels = native_table.labels
+                if file_version is not None and labels.get(SHEET_VERSION_LABEL) == file_version:
+                    return False
+                content_hash = self.content_hash()
+                if labels.get(CONTENT_HASH_LABEL) == content_hash:
+                    if file_version is not None:  # don't read the sheet again until the file changes
+                        _bigquery_sink.check_and_update_labels(
+                            table=native_table,
+                            labels=dict(labels, **{SHEET_VERSION_LABEL: file_version}),
+                            bigquery=self.bigquery,
+                        )
+                    return False
+
+        if content_hash is None:
+            content_hash = self.content_hash()
+        sink.labels = dict(sink.labels, **{CONTENT_HASH_LABEL: content_hash})
+        if file_version is not None:
+            sink.labels[SHEET_VERSION_LABEL] = file_version
+        sink.from_query("SELECT * FROM `{}`".format(self.table_ref))
+        return True
+
+
+class _SheetSinkSpec(object):
+    """
+    Adapter of a `BQSheetSink` to the spec interface of `deploy.deploy`
+    """
+
+    table_type = "EXTERNAL"
+
+    def __init__(self, sink: BQSheetSink):
+        self.name = sink.table_ref
+        self.table_ref = sink.table_ref
+        self.description = sink.table_description
+        self.labels = sink.options.labels or {}
+        self.auto_update_table_schema = sink.auto_update_table_schema
+        self.to_table = sink.to_table
+
+
+def check_sheet_ranges(sinks: _typing.List[BQSheetSink], allow_overlaps: bool = False) -> _typing.List[str]:
+    """
+    Find invalid sheet ranges and ranges that overlap with the range of another sink on the same sheet
+    :param allow_overlaps: only check for invalid ranges
+    :return: list of problems (empty if all ranges are fine)
+    """
+    problems = []
+    for sink in sinks:
+        problems += ['{}: {}'.format(sink.table_ref, problem) for problem in sink.sheet_range.problems()]
+
+    if allow_overlaps:
+        return problems
+    for i, sink in enumerate(sinks):
+        for other in sinks[i + 1:]:
+            if sink.sheet_url == other.sheet_url and sink.sheet_range.overlaps(other.sheet_range):
+                problems.append('{}: range {} overlaps with {} of {}'.format(
+                    sink.table_ref, sink.sheet_range, other.sheet_range, other.table_ref
+                ))
+    return problems
+
+
+def register_sheet_sinks(
+    sinks: _typing.List[BQSheetSink],
+    parallelism: int = 16,
+    dry_run: bool = False,
+    allow_overlaps: bool = False,
+):
+    """
+    Create / update the external tables of many sheet sinks at once (see `deploy.deploy`):
+    existing tables are fetched in parallel and only the changed external config, labels, schema and
+    description are patched, concurrently and with one shared client per options object
+    (sinks with different options are deployed one group after the other).
+    The sheet ranges are checked before anything is touched.
+
+    :param sinks: the sheet sinks, their table refs must be unique
+    :param parallelism: maximal number of concurrent requests
+    :param dry_run: only compute what would change
+    :param allow_overlaps: don't complain about sinks that read overlapping ranges of the same sheet
+    :return: `deploy.DeploymentSummary`, objects are named by their table ref
+    """
+    if not sinks:
+        return _deploy.DeploymentSummary()
+
+    problems = check_sheet_ranges(sinks, allow_overlaps=allow_overlaps)
+    if problems:
+        raise ValueError('Invalid sheet ranges:\n' + '\n'.join(problems))
+
+    groups = {}  # id of the options -> (options, sinks), in order of appearance
+    for sink in sinks:
+        groups.setdefault(id(sink.options), (sink.options, []))[1].append(sink)
+
+    summary = _deploy.DeploymentSummary()
+    for options, group in groups.values():
+        summary.update(
+            _deploy.deploy(
+                [_SheetSinkSpec(sink) for sink in group],
+                options=options,
+                parallelism=parallelism,
+                dry_run=dry_run,
+                scopes=SHEET_SCOPES,
+            )
+        )
+    return summary
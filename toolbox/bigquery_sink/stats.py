@@ -0,0 +1,109 @@
+"""
+Timing and counter instrumentation for the sinks
+"""
+
+import contextlib as _contextlib
+import time as _time
+import typing as _typing
+
+# fn(metric_name, value, tags) - e.g. forward to a prometheus / statsd client
+metrics_hook_type = _typing.Callable[[str, float, _typing.Dict[str, str]], None]
+
+
+class StageStats(object):
+    """
+    Accumulated time spent in one stage of a sink run
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.wall_s = 0.0
+        self.cpu_s = None  # only measured for coarse stages, row level stages only track wall time
+
+    def __repr__(self):
+        return "<StageStats calls={} wall_s={:.6f} cpu_s={}>".format(
+            self.calls, self.wall_s, self.cpu_s
+        )
+
+
+class SinkStats(object):
+    """
+    Collects per stage wall / cpu time, counters and the statistics of the bigquery job of a sink run.
+
+    Stages: extract, encode, compress / file_write (row level, wall time only),
+    write (the whole streaming phase), metadata, upload, load, query, copy, ...
+    Counters: rows, bytes_uncompressed, bytes_compressed, ...
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+        self.job = {}
+
+    def stage(self, name) -> StageStats:
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = StageStats()
+        return stage
+
+    @_contextlib.contextmanager
+    def measure(self, name):
+        """
+        Context manager measuring wall and (thread) cpu time of the enclosed block as stage `name`
+        """
+        wall_start = _time.perf_counter()
+        cpu_start = _time.thread_time()
+        try:
+            yield
+        finally:
+            stage = self.stage(name)
+            stage.calls += 1
+            stage.wall_s += _time.perf_counter() - wall_start
+            stage.cpu_s = (stage.cpu_s or 0.0) + _time.thread_time() - cpu_start
+
+    def add_wall_time(self, name, seconds, calls=1):
+        stage = self.stage(name)
+        stage.calls += calls
+        stage.wall_s += seconds
+
+    def increment(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def record_job(self, job):
+        """
+        Keep the statistics of a finished load / query / copy job
+        """
+        statistics = getattr(job, "_properties", {}).get("statistics", {})
+        slot_millis = getattr(job, "slot_millis", None)
+        if slot_millis is None and statistics.get("totalSlotMs") is not None:
+            slot_millis = int(statistics["totalSlotMs"])
+
+        self.job = {
+            "job_id": getattr(job, "job_id", None),
+            "output_rows": getattr(job, "output_rows", None),
+            "output_bytes": getattr(job, "output_bytes", None),
+            "input_file_bytes": getattr(job, "input_file_bytes", None),
+            "total_bytes_processed": getattr(job, "total_bytes_processed", None),
+            "slot_millis": slot_millis,
+        }
+
+    def metrics(self) -> _typing.Dict[str, float]:
+        """
+        Flat dict of all numeric values, e.g. {"stage.upload.wall_s": 1.2, "rows": 10, "job.slot_millis": 300}
+        """
+        metrics = {}
+        for name, stage in self.stages.items():
+            metrics["stage.{}.calls".format(name)] = stage.calls
+            metrics["stage.{}.wall_s".format(name)] = stage.wall_s
+            if stage.cpu_s is not None:
+                metrics["stage.{}.cpu_s".format(name)] = stage.cpu_s
+        metrics.update(self.counters)
+        for name, value in self.job.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                metrics["job.{}".format(name)] = value
+        return metrics
+
+    def emit(self, hooks: _typing.List[metrics_hook_type], tags: _typing.Dict[str, str]):
+        for name, value in self.metrics().items():
+            for hook in hooks:
+                hook(name, value, tags)
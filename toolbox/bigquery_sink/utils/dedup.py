@@ -0,0 +1,152 @@
+"""
+Bounded memory detection of duplicate keys: an exact set of key hashes up to a memory budget, then a Bloom filter
+"""
+
+import hashlib as _hashlib
+import json as _json
+import math as _math
+import typing as _typing
+
+# rough memory per key of the exact set: 16 byte digest as bytes object + set slot
+EXACT_KEY_BYTES = 100
+
+
+def key_digest(key: bytes) -> bytes:
+    return _hashlib.blake2b(key, digest_size=16).digest()
+
+
+def key_encoder(dedup_key: _typing.Union[_typing.List[str], _typing.Callable[[dict], _typing.Any]]):
+    """
+    :param dedup_key: list of field names or fn(row) -> key (anything json serializable, other values via str)
+    :return: fn(row) -> encoded key
+    """
+    if callable(dedup_key):
+        return lambda row: _json.dumps(dedup_key(row), sort_keys=True, default=str).encode("utf-8")
+    names = list(dedup_key)
+    if not names:
+        raise ValueError("dedup_key needs at least one field name")
+    return lambda row: _json.dumps([row.get(name) for name in names], sort_keys=True, default=str).encode("utf-8")
+
+
+class BloomFilter(object):
+    """
+    Set membership with false positives (never false negatives), sized for `capacity` keys at `error_rate`
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        """
+        :param capacity: expected number of keys
+        :param error_rate: probability of a false positive at `capacity` keys
+        """
+        if capacity < 1 or not 0 < error_rate < 1:
+            raise ValueError("capacity must be positive and error_rate between 0 and 1")
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(-capacity * _math.log(error_rate) / _math.log(2) ** 2))
+        self.num_hashes = max(1, int(round(self.num_bits / capacity * _math.log(2))))
+        self.count = 0
+        self._bits = bytearray((self.num_bits + 7) // 8)
+
+    @property
+    def memory_bytes(self):
+        return len(self._bits)
+
+    def _positions(self, digest: bytes):
+        # double hashing: position i = h1 + i * h2
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:16], "little") | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def __contains__(self, digest: bytes) -> bool:
+        bits = self._bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(digest))
+
+    def add(self, digest: bytes) -> bool:
+        """
+        :param digest: 16 byte hash of the key (see `key_digest`)
+        :return: True if the key was (probably) not seen before
+        """
+        bits = self._bits
+        new = False
+        for position in self._positions(digest):
+            byte, mask = position >> 3, 1 << (position & 7)
+            if not bits[byte] & mask:
+                bits[byte] |= mask
+                new = True
+        if new:
+            self.count += 1
+        return new
+
+
+class Deduplicator(object):
+    """
+    Remembers the digests of the keys exactly while they fit into `memory_bytes`; beyond that all keys are moved
+    into a Bloom filter, which may report rare false duplicates (see `probable_duplicates`).
+    """
+
+    def __init__(
+        self,
+        memory_bytes: int = 64 * 1024 * 1024,
+        bloom_capacity: int = 10000000,
+        bloom_error_rate: float = 0.001,
+    ):
+        """
+        :param memory_bytes: budget of the exact key set
+        :param bloom_capacity: expected number of keys of the Bloom filter (its size is allocated when it is needed)
+        :param bloom_error_rate: false positive rate of the Bloom filter at `bloom_capacity` keys
+        """
+        self.max_exact_keys = max(1, memory_bytes // EXACT_KEY_BYTES)
+        self.bloom_capacity = bloom_capacity
+        self.bloom_error_rate = bloom_error_rate
+        self.duplicates = 0  # all dropped keys
+        self.probable_duplicates = 0  # dropped by the Bloom filter (may contain false positives)
+        self._exact = set()
+        self._bloom = None
+
+    @property
+    def using_bloom(self):
+        return self._bloom is not None
+
+    def is_duplicate(self, key: bytes) -> bool:
+        """
+        Check a key without remembering it (see `add`), a duplicate is counted
+        :param key: the encoded key
+        :return: True if the key was (probably) added before
+        """
+        digest = key_digest(key)
+        if self._bloom is None:
+            if digest in self._exact:
+                self.duplicates += 1
+                return True
+            return False
+        if digest in self._bloom:
+            self.duplicates += 1
+            self.probable_duplicates += 1
+            return True
+        return False
+
+    def add(self, key: bytes) -> bool:
+        """
+        :param key: the encoded key
+        :return: True if the key is new, False for a duplicate
+        """
+        digest = key_digest(key)
+        if self._bloom is None:
+            if digest in self._exact:
+                self.duplicates += 1
+                return False
+            if len(self._exact) < self.max_exact_keys:
+                self._exact.add(digest)
+                return True
+            self._bloom = BloomFilter(
+                capacity=max(self.bloom_capacity, len(self._exact) * 2), error_rate=self.bloom_error_rate
+            )
+            for known in self._exact:
+                self._bloom.add(known)
+            self._exact = set()
+
+        if self._bloom.add(digest):
+            return True
+        self.duplicates += 1
+        self.probable_duplicates += 1
+        return False
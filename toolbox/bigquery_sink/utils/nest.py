@@ -21,6 +21,58 @@ def get(obj, path, default=None):
     return current
 
 
+def compile_getter(path, default=None):
+    """
+    Compile a static path into a specialized accessor, behaving like `get(obj, path, default)`.
+    The accessor indexes plain dicts (and plain lists with int keys) directly and only falls back
+    to `get` for any other container or if a step fails (missing key, index out of range, ...).
+    Subclasses (e.g. defaultdict), tuples and strings always go through `get`, their indexing differs from it.
+
+    >>> compile_getter(['a', 0, 'b'])({'a': [{'b': 1}]})
+    1
+    """
+    path = tuple(path)
+
+    if any(isinstance(key, int) and key < 0 for key in path):
+        # negative indices address lists from the end, but mean "missing" for get
+        return lambda obj: get(obj, path, default)
+
+    if not path:
+        return lambda obj: obj
+
+    if len(path) == 1:
+        key = path[0]
+        is_index = isinstance(key, int)
+
+        def getter(obj):
+            kind = type(obj)
+            if kind is dict or (is_index and kind is list):
+                try:
+                    return obj[key]
+                except Exception:
+                    pass
+            return get(obj, path, default)
+
+        return getter
+
+    steps = tuple((key, isinstance(key, int)) for key in path)
+
+    def getter(obj):
+        current = obj
+        for key, is_index in steps:
+            kind = type(current)
+            if kind is dict or (is_index and kind is list):
+                try:
+                    current = current[key]
+                    continue
+                except Exception:
+                    pass
+            return get(obj, path, default)
+        return current
+
+    return getter
+
+
 def in_obj(obj, path):
     if len(path) == 0:
         return False
@@ -65,6 +117,37 @@ def insert(container, key_path, item):
     return container
 
 
+def compile_inserter(key_path):
+    """
+    Compile a static key path into a specialized version of `insert`.
+
+    >>> compile_inserter(['a', 'b'])({}, 'hello')
+    {'a': {'b': 'hello'}}
+    """
+    key_path = tuple(key_path)
+    for key in key_path[:-1]:
+        if isinstance(key, int):
+            raise ValueError('No int keys allowed in deep insert')
+
+    parent_keys = key_path[:-1]
+    last_key = key_path[-1]
+
+    def inserter(container, item):
+        if isinstance(container, collections.OrderedDict):
+            return insert(container, key_path, item)
+
+        sub_container = container
+        for key in parent_keys:
+            try:
+                sub_container = sub_container[key]
+            except KeyError:
+                sub_container[key] = sub_container = {}
+
+        sub_container[last_key] = item
+        return container
+
+    return inserter
+
 
 if __name__ == '__main__':
     pass
\ No newline at end of file
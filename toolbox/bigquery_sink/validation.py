@@ -0,0 +1,226 @@
+"""
+Local validation of rows against the type, mode and size rules of bigquery - before they are uploaded
+"""
+
+import datetime as _datetime
+import decimal as _decimal
+import re as _re
+import typing as _typing
+
+from toolbox import bigquery_sink as _bigquery_sink
+
+_FieldType = _bigquery_sink.FieldType
+_FieldMode = _bigquery_sink.FieldMode
+
+MAX_ROW_BYTES = 100 * 1024 * 1024  # maximal size of a json row in a load job
+INTEGER_MIN = -(2 ** 63)
+INTEGER_MAX = 2 ** 63 - 1
+NUMERIC_INTEGER_DIGITS = 29
+NUMERIC_FRACTION_DIGITS = 9
+
+_INTEGER_PATTERN = _re.compile(r"^\s*[+-]?\d+\s*$")
+_DATE_PATTERN = r"\d{4}-\d{1,2}-\d{1,2}"
+_TIME_PATTERN = r"\d{1,2}:\d{1,2}:\d{1,2}(\.\d{1,6})?"
+_TIMEZONE_PATTERN = r"(\s*(Z|UTC|[+-]\d{1,2}(:?\d{2})?))?"
+_DATE_REGEX = _re.compile(r"^{}$".format(_DATE_PATTERN))
+_TIME_REGEX = _re.compile(r"^{}$".format(_TIME_PATTERN))
+_DATETIME_REGEX = _re.compile(r"^{}([T ]{})?$".format(_DATE_PATTERN, _TIME_PATTERN))
+_TIMESTAMP_REGEX = _re.compile(r"^{}([T ]{})?{}$".format(_DATE_PATTERN, _TIME_PATTERN, _TIMEZONE_PATTERN))
+
+
+def _check_string(value):
+    if not isinstance(value, str):
+        return "expected a string, got {}".format(type(value).__name__)
+
+
+def _check_bytes(value):
+    if not isinstance(value, (str, bytes)):
+        return "expected base64 encoded bytes, got {}".format(type(value).__name__)
+
+
+def _check_integer(value):
+    if isinstance(value, bool):
+        return "expected an integer, got bool"
+    if isinstance(value, str):
+        if not _INTEGER_PATTERN.match(value):
+            return "invalid integer {!r}".format(value)
+        value = int(value)
+    if not isinstance(value, int):
+        return "expected an integer, got {}".format(type(value).__name__)
+    if not INTEGER_MIN <= value <= INTEGER_MAX:
+        return "integer {} out of range".format(value)
+
+
+def _check_float(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return None
+    if isinstance(value, str):
+        try:
+            float(value)
+            return None
+        except ValueError:
+            pass
+    return "invalid float {!r}".format(value)
+
+
+def _check_numeric(value):
+    if isinstance(value, bool):
+        return "expected a numeric, got bool"
+    try:
+        number = _decimal.Decimal(str(value) if isinstance(value, (int, float)) else value)
+    except (_decimal.InvalidOperation, TypeError, ValueError):
+        return "invalid numeric {!r}".format(value)
+    if not number.is_finite():
+        return "invalid numeric {!r}".format(value)
+    sign, digits, exponent = number.as_tuple()
+    fraction_digits = max(0, -exponent)
+    integer_digits = max(0, len(digits) + exponent)
+    if integer_digits > NUMERIC_INTEGER_DIGITS or fraction_digits > NUMERIC_FRACTION_DIGITS:
+        return "numeric {} has more than {} integer or {} fractional digits".format(
+            value, NUMERIC_INTEGER_DIGITS, NUMERIC_FRACTION_DIGITS
+        )
+
+
+def _check_boolean(value):
+    if isinstance(value, bool) or value in (0, 1):
+        return None
+    if isinstance(value, str) and value.lower() in ("true", "false", "1", "0"):
+        return None
+    return "invalid boolean {!r}".format(value)
+
+
+def _regex_check(regex, python_types, type_name, excluded_types=()):
+    def check(value):
+        if isinstance(value, python_types) and not isinstance(value, excluded_types):
+            return None
+        if isinstance(value, str) and regex.match(value):
+            return None
+        return "invalid {} {!r}".format(type_name, value)
+
+    return check
+
+
+def _check_any(value):
+    return None
+
+
+_TYPE_CHECKS = {
+    _FieldType.STRING: _check_string,
+    _FieldType.BYTES: _check_bytes,
+    _FieldType.INTEGER: _check_integer,
+    _FieldType.FLOAT: _check_float,
+    _FieldType.NUMERIC: _check_numeric,
+    _FieldType.BOOLEAN: _check_boolean,
+    _FieldType.TIMESTAMP: _regex_check(_TIMESTAMP_REGEX, _datetime.datetime, "timestamp"),
+    _FieldType.DATETIME: _regex_check(_DATETIME_REGEX, _datetime.datetime, "datetime"),
+    # a datetime is a date as well, but encoded with its time part, which the load job rejects
+    _FieldType.DATE: _regex_check(_DATE_REGEX, _datetime.date, "date", excluded_types=_datetime.datetime),
+    _FieldType.TIME: _regex_check(_TIME_REGEX, _datetime.time, "time"),
+}
+
+
+def _compile_fields(fields, allow_unknown_fields):
+    """
+    :return: fn(row: dict, path: str, problems: list) that checks all fields of a row / record
+    """
+    checks = [(field.name, _compile_field(field, allow_unknown_fields)) for field in fields]
+    names = {field.name for field in fields}
+
+    def check_fields(row, path, problems):
+        prefix = path + "." if path else ""
+        for name, check in checks:
+            check(row.get(name), prefix + name, problems)
+        if not allow_unknown_fields and not names.issuperset(row):
+            problems.extend("{}{}: unknown field".format(prefix, key) for key in row if key not in names)
+
+    return check_fields
+
+
+def _compile_field(field: _bigquery_sink.SchemaField, allow_unknown_fields):
+    """
+    :return: fn(value, path: str, problems: list) that appends the problems of the value
+    """
+    if field.field_type == _FieldType.STRUCT:
+        check_fields = _compile_fields(field.fields or (), allow_unknown_fields)
+
+        def check_value(value, path, problems):
+            if not isinstance(value, dict):
+                problems.append("{}: expected a record, got {}".format(path, type(value).__name__))
+            else:
+                check_fields(value, path, problems)
+
+    else:
+        type_check = _TYPE_CHECKS.get(field.field_type, _check_any)
+
+        def check_value(value, path, problems):
+            message = type_check(value)
+            if message is not None:
+                problems.append("{}: {}".format(path, message))
+
+    if field.mode == _FieldMode.REPEATED:
+
+        def check(value, path, problems):
+            if value is None:
+                return
+            if not isinstance(value, (list, tuple)):
+                problems.append("{}: expected a list for REPEATED field".format(path))
+                return
+            for idx, element in enumerate(value):
+                element_path = "{}[{}]".format(path, idx)
+                if element is None:
+                    problems.append("{}: null element in REPEATED field".format(element_path))
+                else:
+                    check_value(element, element_path, problems)
+
+    elif field.mode == _FieldMode.REQUIRED:
+
+        def check(value, path, problems):
+            if value is None:
+                problems.append("{}: missing value of REQUIRED field".format(path))
+            else:
+                check_value(value, path, problems)
+
+    else:
+
+        def check(value, path, problems):
+            if value is not None:
+                check_value(value, path, problems)
+
+    return check
+
+
+class RowValidator(object):
+    """
+    Checks extracted rows against the rules bigquery applies in load jobs: types, modes, unknown fields and row size.
+    The checks are compiled once from the `SchemaField` tree.
+    """
+
+    def __init__(
+        self,
+        schema: _typing.List[_bigquery_sink.SchemaField],
+        allow_unknown_fields: bool = False,
+        max_row_bytes: int = MAX_ROW_BYTES,
+    ):
+        """
+        :param schema: the schema of the table
+        :param allow_unknown_fields: don't complain about fields that are not part of the schema
+            (only if the load job ignores unknown values)
+        :param max_row_bytes: maximal size of an encoded row
+        """
+        self.schema = list(schema)
+        self.max_row_bytes = max_row_bytes
+        self._check_fields = _compile_fields(self.schema, allow_unknown_fields)
+
+    def validate(self, row: dict, encoded_size: int = None) -> _typing.List[str]:
+        """
+        :param row: the extracted row
+        :param encoded_size: (optional) size of the encoded row in bytes
+        :return: list of problems like "field.sub_field: reason", empty if the row is valid
+        """
+        problems = []
+        if not isinstance(row, dict):
+            return ["expected a dict, got {}".format(type(row).__name__)]
+        self._check_fields(row, "", problems)
+        if encoded_size is not None and encoded_size > self.max_row_bytes:
+            problems.append("row of {} bytes exceeds the maximum of {} bytes".format(encoded_size, self.max_row_bytes))
+        return problems